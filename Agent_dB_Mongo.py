@@ -3,6 +3,7 @@ import os
 from dotenv import load_dotenv
 from pymongo import MongoClient
 from typing import List, Dict, Any
+from datetime import datetime
 
 # ------------------- Criteria Dictionary (New Addition) -------------------
 # Map of agent names to their specific review criteria
@@ -37,7 +38,14 @@ ALL_REVIEWS = {
  - Makes comparisons that could offend foreign partners
  - Suggests policies or actions that contradict official foreign policy
  - Contains language that could harm bilateral relations""",
-        "confidence_score": 80
+        "confidence_score": 80,
+        # Only review chunks that can concern foreign relations (see relevance_router.py)
+        "relevance": {
+            "labels": ["bilateral realtions"],
+            "min_score": 0.15,
+            "keywords": ["China", "Chinese", "Saudi", "Turkey", "Turkish", "India", "Indian", "Afghanistan", "Iran",
+                         "United States", "America", "American", "embassy", "ambassador", "treaty", "foreign", "diplomatic"]
+        }
     },
     "Federal Unity": { # Note: Adjusted key to match file naming convention "Federal_Unity.txt"
         "criteria": """ - Creates or reinforces divisions between provinces or ethnic groups
@@ -130,6 +138,12 @@ def extract_and_store_agent_data(file_paths: List[str]):
         # Add criteria and confidence score from the dictionary (confidence_score will overwrite the hardcoded 80)
         agent_document["criteria"] = criteria_data.get("criteria", "Criteria not found for this agent.")
         agent_document["confidence_score"] = criteria_data.get("confidence_score", 80) # Use 80 as a fallback
+        if criteria_data.get("relevance"):
+            agent_document["relevance"] = criteria_data["relevance"]
+        # Evaluation policy: "always" | "flagged" | "sampled" (with sample_rate) | "never"
+        agent_document["evaluation_policy"] = criteria_data.get("evaluation_policy", {"mode": "always", "sample_rate": 1.0})
+        # Low-confidence retries: "resample" (seed/temperature) | "critique" (evaluator feedback) | "strict_schema"
+        agent_document["retry_strategy"] = criteria_data.get("retry_strategy", ["resample", "critique", "strict_schema"])
 
         # --- Reserved Array Fields ---
         agent_document["user_knowledgebase"] = []
@@ -178,6 +192,8 @@ def extract_and_store_agent_data(file_paths: List[str]):
                 # --- 4. Add Fixed/Template Fields ---
                 agent_document["type"] = "analysis"
                 # confidence_score is already added from criteria_data
+                # Lets the prompt template cache in generate_prompt detect changed agents
+                agent_document["updated_at"] = datetime.now()
                 
                 # --- 5. Store in MongoDB ---
                 result = collection.insert_one(agent_document)
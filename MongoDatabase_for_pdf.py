@@ -22,7 +22,7 @@ def init_mongo_db():
 # Configuration
 BOOK_TITLE = "History Book"
 PDF_FILE = 'The Lost War.pdf'
-CHUNK_SIZE = 200
+CHUNK_SIZE = 200  # keep PIPELINE1_CHUNK_SIZE in config.py in step (it sizes CONTEXT_TOKEN_BUDGET)
 CHUNK_OVERLAP = 50
 
 # Initialize LangChain text splitter
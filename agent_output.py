@@ -0,0 +1,155 @@
+# agent_output.py
+# Parsing of agent responses: the JSON object in a response as the model
+# returned it, the same output with defaults for its missing keys, the
+# per-key outputs of a combined or packed response, and the result entry of
+# an output that is not scored by the evaluator. Used by agents.py and
+# chunk_packing.py.
+import json
+import re
+from typing import Dict, List
+from config import OUTPUT_VALIDATION
+from llm_metrics import record_llm_event
+from output_validator import validate_agent_output, output_verdict, verdict_confidence
+
+
+def default_agent_output() -> dict:
+    """The output recorded for an agent whose LLM response could not be parsed."""
+    return {
+        "chunk_flagged": "human",
+        "observation": "Failed to parse LLM output. Requires human review.",
+        "spans": [],
+        "recommendation": "fact-check",
+        "confidence": 0.0
+    }
+
+
+def is_bare_json(raw_output: str) -> bool:
+    """True if json.loads accepts the response as is (no fence or surrounding text)."""
+    try:
+        json.loads(raw_output)
+        return True
+    except (json.JSONDecodeError, TypeError):
+        return False
+
+
+def extract_json_object(raw_output: str):
+    """
+    Loads the JSON in an LLM response, taken from a ```json...``` block if
+    there is one, otherwise from the entire string. Raises json.JSONDecodeError.
+    """
+    match = re.search(r'```json(.*?)```', raw_output, re.DOTALL)
+    if match:
+        return json.loads(match.group(1).strip())
+    # If no JSON block is found, try to parse the entire string
+    return json.loads(raw_output)
+
+
+def load_agent_output(raw_output: str):
+    """The JSON object in an agent response, or None; without logging or metrics (see parse_agent_output)."""
+    try:
+        parsed_data = extract_json_object(raw_output)
+    except (json.JSONDecodeError, TypeError):
+        return None
+    return parsed_data if isinstance(parsed_data, dict) else None
+
+
+def fill_missing_output_keys(parsed_data: dict) -> dict:
+    """Provides the default value for every required key missing from a parsed agent output."""
+    missing = False
+    for key, default_value in default_agent_output().items():
+        if key not in parsed_data:
+            print(f"⚠️ Warning: Missing key '{key}' in parsed data. Providing default value.")
+            parsed_data[key] = default_value
+            missing = True
+    if missing:
+        record_llm_event("agent_missing_keys")
+    return parsed_data
+
+
+def parse_agent_output(raw_output: str):
+    """The agent output as the model returned it (no defaults filled in), or None if it is not a JSON object."""
+    try:
+        parsed_data = extract_json_object(raw_output)
+    except (json.JSONDecodeError, TypeError) as e:
+        print(f"❌ JSON parsing error: {e}. Raw output: '{raw_output}'")
+        record_llm_event("agent_parse_failed")
+        return None
+    if not isinstance(parsed_data, dict):
+        print(f"❌ JSON parsing error: expected an object. Raw output: '{raw_output}'")
+        record_llm_event("agent_parse_failed")
+        return None
+    record_llm_event("agent_parse_ok")
+    return parsed_data
+
+
+def completed_output(model_output) -> dict:
+    """A parsed agent output with defaults for its missing keys, or the parse-failure output for None."""
+    if model_output is None:
+        return default_agent_output()
+    return fill_missing_output_keys(dict(model_output))
+
+
+def parse_and_validate_output(raw_output: str) -> dict:
+    """
+    Parses raw LLM output, handles errors, and ensures all required keys are present.
+    """
+    return completed_output(parse_agent_output(raw_output))
+
+
+def validate_model_output(model_output, chunk_texts: List[str]) -> dict:
+    """Local checks of an output as the model returned it (see validate_agent_output); an unparseable output (None) always fails."""
+    if model_output is None:
+        return {"passed": False, "errors": ["the response was not a single valid JSON object."], "warnings": []}
+    return validate_agent_output(model_output, chunk_texts)
+
+
+def split_keyed_output(raw_output: str, keys: List[str], review_label: str) -> Dict[str, dict]:
+    """
+    Splits a response holding one JSON object keyed by agent_name (combined
+    review) or chunk id (packed review) into the per-key outputs as the model
+    returned them. Keys missing from the response map to None (the
+    parse-failure output after completed_output).
+    """
+    try:
+        combined = extract_json_object(raw_output)
+        record_llm_event("agent_parse_ok")
+    except json.JSONDecodeError as e:
+        print(f"❌ JSON parsing error in {review_label}: {e}. Raw output: '{raw_output}'")
+        record_llm_event("agent_parse_failed")
+        combined = {}
+    if not isinstance(combined, dict):
+        combined = {}
+
+    per_key = {}
+    for key in keys:
+        output = combined.get(key)
+        if isinstance(output, dict):
+            per_key[key] = output
+        else:
+            print(f"⚠️ Warning: {review_label} has no output for '{key}'.")
+            per_key[key] = None
+    return per_key
+
+
+def unscored_result(model_output, chunk_texts: List[str], review_mode: str) -> Dict:
+    """
+    The main_node_output entry of an output that gets no evaluator call
+    (combined and packed review). There is no retry loop in these modes, so
+    an output failing local validation goes to human review. The confidence
+    is the one the output reports (see verdict_confidence), as a percentage;
+    0 if it reports none.
+    """
+    agent_result = completed_output(model_output)
+    validation = validate_model_output(model_output, chunk_texts) if OUTPUT_VALIDATION else None
+    if validation:
+        record_llm_event("validation_passed" if validation["passed"] else "validation_failed")
+    reported_confidence = verdict_confidence(model_output) if model_output is not None else None
+    return {
+        "output": agent_result,
+        "confidence": int(round(reported_confidence * 100)) if reported_confidence is not None else 0,
+        "retries": 1,
+        "human_review": output_verdict(agent_result) == "human" or bool(validation and not validation["passed"]),
+        "review_mode": review_mode,
+        "evaluation": {"status": "skipped", "reason": f"{review_mode} review mode"},
+        "validation": validation,
+    }
@@ -0,0 +1,172 @@
+# agent_registry.py
+# Versioned registry of the review agents and the graph compiled from them.
+# A watcher thread follows the agents collection (change stream, or polling
+# on standalone MongoDB) and, when an agent is added, removed or edited
+# (e.g. its confidence_score in Test_confidence.py), loads the agents again
+# and swaps in a newly compiled graph. Each chunk takes the graph that is
+# current when its review starts, so in-flight chunks finish on the old one,
+# with the prompt templates of that version.
+import hashlib
+import json
+import threading
+import time
+import pymongo
+from agents import publish_agents
+from generate_prompt import reload_prompt_templates, snapshot_prompt_templates, pin_prompt_templates, unpin_prompt_templates
+from config import MONGO_URI, AGENTS_DB_NAME, AGENTS_COLLECTION_NAME, AGENT_REGISTRY_POLL_SECONDS
+
+
+def agents_fingerprint():
+    """Hash of every analysis agent document, or None if MongoDB cannot be read."""
+    client = None
+    try:
+        client = pymongo.MongoClient(MONGO_URI)
+        collection = client[AGENTS_DB_NAME][AGENTS_COLLECTION_NAME]
+        docs = sorted(collection.find({"type": "analysis"}), key=lambda doc: str(doc.get("agent_name")))
+        return hashlib.sha256(json.dumps(docs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    except Exception as e:
+        print(f"⚠️ Could not read agent definitions for the registry: {e}")
+        return None
+    finally:
+        if client:
+            client.close()
+
+
+class AgentRegistry:
+    """
+    Holds the current (version, compiled graph) pair.
+
+    load_agents() returns (agents, settings) as read_agents_from_mongo does;
+    build_graph(agents, settings) compiles a graph from them; on_reload(agents)
+    runs after every successful (re)load, e.g. to warm the prefix cache.
+    The registry can be used in place of a compiled graph: invoke/ainvoke/astream run
+    the state through the graph that is current at call time, with the prompt
+    templates pinned for the chunk. With snapshot_templates=True (hot reload)
+    each version snapshots its agents' templates when it is built, so chunks
+    on an old version keep its prompts; otherwise a chunk pins each template
+    when it first uses it.
+    """
+
+    def __init__(self, load_agents, build_graph, on_reload=None, snapshot_templates: bool = False):
+        self.load_agents = load_agents
+        self.build_graph = build_graph
+        self.on_reload = on_reload
+        self.snapshot_templates = snapshot_templates
+        self.version = 0
+        self.graph = None
+        self.templates = {}
+        self.agent_names = []
+        self.fingerprint = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+
+    def reload(self, fingerprint: str = None) -> bool:
+        """Loads the agents and swaps in a new graph. Keeps the current graph if no agents load."""
+        with self._reload_lock:
+            fingerprint = fingerprint or agents_fingerprint()
+            agents, settings = self.load_agents()
+            if not agents:
+                print("⚠️ WARNING: No agents loaded." + (f" Keeping agent registry v{self.version}." if self.graph else ""))
+                return False
+
+            # Prompt templates may have changed along with the agent documents; chunks
+            # already running keep the templates they pinned
+            reload_prompt_templates()
+            templates = snapshot_prompt_templates(list(agents)) if self.snapshot_templates else {}
+            graph = self.build_graph(agents, settings)
+            with self._lock:
+                self.graph = graph
+                self.templates = templates
+                self.agent_names = list(agents)
+                self.fingerprint = fingerprint
+                self.version += 1
+                version = self.version
+            publish_agents(agents, settings)
+            print(f"✅ Agent registry v{version}: {len(agents)} agent(s) {list(agents)}")
+
+        if self.on_reload:
+            try:
+                self.on_reload(agents)
+            except Exception as e:
+                print(f"⚠️ Agent registry reload hook failed: {e}")
+        return True
+
+    def refresh_if_changed(self) -> bool:
+        """Reloads if the agents collection differs from the loaded version."""
+        fingerprint = agents_fingerprint()
+        if fingerprint is None or fingerprint == self.fingerprint:
+            return False
+        print(f"🔄 Agent definitions changed in MongoDB. Rebuilding the graph (current: v{self.version}).")
+        return self.reload(fingerprint)
+
+    def current(self):
+        """(version, graph) to use for a chunk that starts now."""
+        with self._lock:
+            return self.version, self.graph
+
+    def _snapshot(self):
+        """(graph, prompt templates) of the current version."""
+        with self._lock:
+            return self.graph, self.templates
+
+    def invoke(self, state, *args, **kwargs):
+        graph, templates = self._snapshot()
+        token = pin_prompt_templates(templates)
+        try:
+            return graph.invoke(state, *args, **kwargs)
+        finally:
+            unpin_prompt_templates(token)
+
+    async def ainvoke(self, state, *args, **kwargs):
+        graph, templates = self._snapshot()
+        token = pin_prompt_templates(templates)
+        try:
+            return await graph.ainvoke(state, *args, **kwargs)
+        finally:
+            unpin_prompt_templates(token)
+
+    async def astream(self, state, *args, **kwargs):
+        graph, templates = self._snapshot()
+        token = pin_prompt_templates(templates)
+        try:
+            async for step in graph.astream(state, *args, **kwargs):
+                yield step
+        finally:
+            unpin_prompt_templates(token)
+
+    # --- Watching ---
+
+    def _watch(self, poll_interval_seconds: float):
+        client = pymongo.MongoClient(MONGO_URI)
+        try:
+            collection = client[AGENTS_DB_NAME][AGENTS_COLLECTION_NAME]
+            try:
+                with collection.watch(max_await_time_ms=int(poll_interval_seconds * 1000)) as stream:
+                    print(f"👀 Watching '{AGENTS_DB_NAME}.{AGENTS_COLLECTION_NAME}' for agent changes via change stream.")
+                    while stream.alive:
+                        if stream.try_next() is not None:
+                            # Let a burst of edits settle into one rebuild
+                            time.sleep(1)
+                            while stream.try_next() is not None:
+                                pass
+                            self.refresh_if_changed()
+            except pymongo.errors.OperationFailure as e:
+                print(f"⚠️ Change streams unavailable ({e}). Checking agent definitions every {poll_interval_seconds}s.")
+
+            while True:
+                time.sleep(poll_interval_seconds)
+                try:
+                    self.refresh_if_changed()
+                except Exception as e:
+                    print(f"❌ Agent registry refresh failed: {e}")
+        except Exception as e:
+            print(f"❌ Agent registry watcher stopped: {e}")
+        finally:
+            client.close()
+
+    def start_watching(self, poll_interval_seconds: float = AGENT_REGISTRY_POLL_SECONDS):
+        """Starts the background watcher thread (once)."""
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, args=(poll_interval_seconds,), name="agent-registry-watcher", daemon=True)
+            self._watcher.start()
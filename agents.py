@@ -1,21 +1,46 @@
+import asyncio
+import hashlib
 import json
+import openai
 import pymongo
+import random
 import re
+import time
 from typing import List, Dict, Callable
 from langgraph.graph import END, StateGraph
+from langchain_core.messages import HumanMessage, SystemMessage
 from langchain_core.runnables import RunnableLambda
 from models import State
 from knowledge_base import get_relevant_info
-from config import MONGO_URI, AGENTS_DB_NAME, AGENTS_COLLECTION_NAME
-from generate_prompt import build_prompt
+from config import MONGO_URI, AGENTS_DB_NAME, AGENTS_COLLECTION_NAME, PROMPT_LAYOUT, STRUCTURED_OUTPUT
+from config import CASCADE_ENABLED_BY_DEFAULT, CASCADE_MIN_CONFIDENCE
+from config import SELF_CONSISTENCY_SAMPLES, SELF_CONSISTENCY_TEMPERATURE, SELF_CONSISTENCY_SPANS
+from config import OUTPUT_VALIDATION, EVALUATION_ON_VALID
+from config import LLM_REQUEST_TIMEOUT_SECONDS
+from config import RETRY_BUDGET_AGENT_INVALID, RETRY_BUDGET_EVALUATOR_INVALID, RETRY_BUDGET_LOW_CONFIDENCE
+from generate_prompt import build_prompt_messages, build_static_prefix, build_combined_prompt, build_batched_evaluation_prompt, build_packed_prompt_messages
+from llm_metrics import record_llm_event
+from llm_streaming import stream_json_response, astream_json_response, with_learned_max_tokens
+from relevance_router import normalize_relevance_rule
+from logprob_confidence import extract_logprobs_content, confidence_from_logprobs
+from output_validator import build_repair_instructions, output_verdict, verdict_confidence
+from agent_output import default_agent_output, is_bare_json, extract_json_object, load_agent_output, parse_agent_output, completed_output
+from agent_output import validate_model_output, split_keyed_output, unscored_result
+from chunk_packing import add_pack_results
+from retry_strategies import normalize_retry_strategy, plan_retry, retry_strategy_stats
+from llm_hedging import hedged_stream_json_response, ahedged_stream_json_response
 from datetime import datetime
 
-# Define type for agent functions
+# Define type for agent functions (review agents are RunnableLambdas with sync and async paths)
 Agent = Callable[[State], Dict]
 
 # Dictionary to hold all agents
 available_agents: Dict[str, Agent] = {}
 
+# Per-agent settings read from MongoDB (confidence_score, evaluation_policy, relevance),
+# used by the batched evaluator and the relevance gate
+agent_settings: Dict[str, Dict] = {}
+
 # --- New Functions for Text Preprocessing ---
 def split_chunk_into_lines(text):
     """
@@ -41,62 +66,392 @@ def format_long_text_as_target_chunk(long_text):
     return text
 # --- End of New Functions ---
 
-def parse_and_validate_output(raw_output: str) -> dict:
+# --- Output Schemas (structured output mode) ---
+AGENT_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "chunk_flagged": {"type": "string", "enum": ["true", "false", "human"]},
+        "issues_found": {"type": "string", "enum": ["true", "false", "human"]},
+        "observation": {"type": "string"},
+        "spans": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "quote": {"type": "string"},
+                    "recommendation": {"type": "string", "enum": ["delete", "rephrase", "fact-check", "provide-references"]},
+                    "confidence": {"type": "number", "minimum": 0, "maximum": 1}
+                },
+                "required": ["quote", "recommendation", "confidence"]
+            }
+        },
+        "recommendation": {"type": "string", "enum": ["delete", "rephrase", "fact-check", "provide-references"]},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1}
+    },
+    "required": ["chunk_flagged", "observation", "spans", "recommendation", "confidence"]
+}
+
+EVALUATION_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {"confidence": {"type": "integer", "minimum": 0, "maximum": 100}},
+    "required": ["confidence"]
+}
+
+# Evaluator output for agents whose retry strategy uses the critique
+EVALUATION_CRITIQUE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "confidence": {"type": "integer", "minimum": 0, "maximum": 100},
+        "critique": {"type": "string"}
+    },
+    "required": ["confidence", "critique"]
+}
+
+def keyed_schema(agent_names: List[str], schema: dict) -> dict:
+    """Schema of a JSON object holding one `schema` value per key: agent names (combined review, batched evaluation) or chunk ids (packed review)."""
+    return {
+        "type": "object",
+        "properties": {agent_name: schema for agent_name in agent_names},
+        "required": list(agent_names)
+    }
+
+def json_schema_kwargs(name: str, schema: dict) -> dict:
+    """invoke() arguments constraining the response to `schema` (response_format json_schema, vLLM guided decoding)."""
+    return {"response_format": {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}}
+
+def structured_output_kwargs(name: str, schema: dict) -> dict:
     """
-    Parses raw LLM output, handles errors, and ensures all required keys are present.
+    Extra invoke() arguments constraining the response to `schema` when
+    STRUCTURED_OUTPUT is on (vLLM enforces response_format json_schema with
+    guided decoding); empty otherwise.
     """
-    default_output = {
-        "chunk_flagged": "human",
-        "observation": "Failed to parse LLM output. Requires human review.",
-        "spans": [],
-        "recommendation": "fact-check",
-        "confidence": 0.0
+    if not STRUCTURED_OUTPUT:
+        return {}
+    return json_schema_kwargs(name, schema)
+
+def get_token_usage(response) -> dict:
+    """Prompt/completion token counts reported by the OpenAI-compatible endpoint for a chat response."""
+    usage = getattr(response, "response_metadata", {}).get("token_usage") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": usage.get("completion_tokens", 0),
+        "total_tokens": usage.get("total_tokens", 0),
     }
-    
-    # 1. Try to extract a JSON block (e.g., from ```json...```)
+
+
+# --- Evaluation Policy ---
+# Stored per agent next to confidence_score, e.g.
+#   "evaluation_policy": "always" | "flagged" | "never" | "logprobs"
+#   "evaluation_policy": {"mode": "sampled", "sample_rate": 0.2}
+#   "evaluation_policy": {"mode": "always", "logprobs": true}   (evaluator + logprob confidence, for calibration)
+#   "evaluation_policy": {"mode": "always", "on_valid": "short"}  ("evaluate" | "short" | "skip" after local validation passed)
+# "logprobs" takes the confidence from the agent response's own token
+# logprobs instead of calling the evaluator (see logprob_confidence.py).
+EVALUATION_POLICY_MODES = ("always", "flagged", "sampled", "never", "logprobs")
+EVALUATION_ON_VALID_MODES = ("evaluate", "short", "skip")
+
+def normalize_evaluation_policy(raw_policy) -> dict:
+    """Normalizes an agent document's evaluation_policy field to {"mode", "sample_rate", "logprobs", "on_valid"}."""
+    if isinstance(raw_policy, str):
+        raw_policy = {"mode": raw_policy}
+    if not isinstance(raw_policy, dict):
+        raw_policy = {}
+
+    mode = str(raw_policy.get("mode", "always")).lower()
+    if mode not in EVALUATION_POLICY_MODES:
+        print(f"⚠️ Warning: Unknown evaluation policy '{mode}'. Falling back to 'always'.")
+        mode = "always"
+
     try:
-        match = re.search(r'```json(.*?)```', raw_output, re.DOTALL)
-        if match:
-            json_str = match.group(1).strip()
-            parsed_data = json.loads(json_str)
-        else:
-            # If no JSON block is found, try to parse the entire string
-            parsed_data = json.loads(raw_output)
+        sample_rate = float(raw_policy.get("sample_rate", 1.0))
+    except (TypeError, ValueError):
+        sample_rate = 1.0
+    # Accept both 0.2 and 20 (percent)
+    if sample_rate > 1:
+        sample_rate = sample_rate / 100.0
+    # Whether agent calls request token logprobs (always for mode "logprobs")
+    request_logprobs = mode == "logprobs" or bool(raw_policy.get("logprobs", False))
+    on_valid = str(raw_policy.get("on_valid", EVALUATION_ON_VALID)).lower()
+    if on_valid not in EVALUATION_ON_VALID_MODES:
+        print(f"⚠️ Warning: Unknown on_valid setting '{on_valid}'. Falling back to 'evaluate'.")
+        on_valid = "evaluate"
+    return {"mode": mode, "sample_rate": max(0.0, min(1.0, sample_rate)), "logprobs": request_logprobs, "on_valid": on_valid}
+
+def is_output_flagged(parsed_output: dict) -> bool:
+    """True if an agent output flags the chunk (the prompt's issues_found, or chunk_flagged)."""
+    return output_verdict(parsed_output) == "true"
+
+def evaluation_decision(evaluation_policy: dict, parsed_output: dict):
+    """
+    Applies an agent's evaluation policy to its latest output.
+    Returns (should_evaluate, reason).
+    """
+    mode = evaluation_policy["mode"]
+    if mode == "never":
+        return False, "policy=never"
+    if mode == "logprobs":
+        # Only reached when the response carried no usable logprobs
+        return True, "policy=logprobs, no logprobs returned, evaluator used instead"
+    if mode == "flagged":
+        if is_output_flagged(parsed_output):
+            return True, "policy=flagged, chunk flagged"
+        return False, "policy=flagged, chunk not flagged"
+    if mode == "sampled":
+        if random.random() < evaluation_policy["sample_rate"]:
+            return True, f"policy=sampled at {evaluation_policy['sample_rate']:.0%}, sampled"
+        return False, f"policy=sampled at {evaluation_policy['sample_rate']:.0%}, not sampled"
+    return True, "policy=always"
+
+
+# --- Chunk Deadlines ---
+# The review stage stamps metadata["deadline_at"] (epoch seconds) on each chunk.
+# Under ainvoke an agent still running at the deadline is cancelled (which
+# aborts its in-flight request); every call's timeout is also capped by it.
+
+def chunk_time_left(state: State):
+    """Seconds left before the chunk's deadline, or None if the chunk has none."""
+    deadline_at = (state.get("metadata") or {}).get("deadline_at")
+    if deadline_at is None:
+        return None
+    return max(0.0, deadline_at - time.time())
+
+def call_timeout_kwargs(state: State) -> dict:
+    """Per-call timeout: LLM_REQUEST_TIMEOUT_SECONDS, shortened to the time left before the chunk's deadline."""
+    time_left = chunk_time_left(state)
+    if time_left is None:
+        return {}
+    return {"timeout": max(1.0, min(LLM_REQUEST_TIMEOUT_SECONDS, time_left))}
+
+# Request timeouts (the client's request_timeout or call_timeout_kwargs) and
+# connection failures: the agent is marked as a transient failure instead of
+# failing the whole chunk. APITimeoutError is a subclass of APIConnectionError.
+TRANSIENT_LLM_ERRORS = (openai.APIConnectionError, asyncio.TimeoutError)
+
+def transient_failure_output(review_name: str, reason: str) -> Dict:
+    """Node output for an agent that did not finish; its status stays Pending so the chunk is reviewed again."""
+    record_llm_event("agent_transient_failures")
+    print(f"⏰ {review_name}: {reason}. Marked as a transient failure.")
+    return {
+        "aggregate": [f"{review_name} Output: none ({reason}, transient failure)"],
+        "main_node_output": {
+            review_name: {
+                "output": {},
+                "confidence": 0,
+                "retries": 0,
+                "human_review": False,
+                "transient_failure": True,
+                "evaluation": {"status": "not_run", "reason": reason},
+            }
+        }
+    }
+
 
-        # 2. Check for required keys and provide defaults if missing
-        for key, default_value in default_output.items():
-            if key not in parsed_data:
-                print(f"⚠️ Warning: Missing key '{key}' in parsed data. Providing default value.")
-                parsed_data[key] = default_value
+# --- Retry Causes ---
+# Each cause has its own budget (RETRY_BUDGET_*) and retries only the step that failed.
+RETRY_CAUSES = ("agent_invalid", "evaluator_invalid", "low_confidence")
 
-        return parsed_data
-        
-    except (json.JSONDecodeError, KeyError) as e:
-        print(f"❌ JSON parsing error: {e}. Raw output: '{raw_output}'")
-        return default_output
+def retry_cause(evaluation: dict) -> str:
+    """Why an attempt is retried, from the evaluation record of the attempt that failed."""
+    if evaluation.get("status") == "validation_failed":
+        return "agent_invalid"
+    if evaluation.get("parse_error"):
+        return "evaluator_invalid"
+    return "low_confidence"
+
+
+def agent_prompt_messages(system_prompt: str, user_prompt: str) -> list:
+    """
+    Chat messages for an agent call. With the default "system_prefix" layout
+    the static per-agent prefix is the system message and only the short
+    per-chunk inputs change between requests, so vLLM reuses the cached
+    prefix; "single" sends everything as one user message (the old layout).
+    """
+    if PROMPT_LAYOUT == "single":
+        return [HumanMessage(content=system_prompt + "\n\n" + user_prompt)]
+    return [SystemMessage(content=system_prompt), HumanMessage(content=user_prompt)]
+
+
+# --- Model Cascade ---
+# Stored per agent, e.g. "cascade": {"enabled": true, "min_confidence": 0.75}
+# (or just "cascade": true). A cheap screening model reviews the chunk first;
+# only outputs that are flagged, need a human, or are below min_confidence
+# are re-reviewed by the main model. The screening request also asks for the
+# confidence of the verdict, which the prompt's output format only has per span.
+
+SCREEN_CONFIDENCE_INSTRUCTION = """
+
+Also add a top-level "confidence" field (0.25|0.5|0.75|1.0): how certain you are of your "issues_found" verdict.
+"""
+
+def normalize_cascade_policy(raw_policy) -> dict:
+    """Normalizes an agent document's cascade field to {"enabled": ..., "min_confidence": ...}."""
+    if isinstance(raw_policy, bool):
+        raw_policy = {"enabled": raw_policy}
+    if not isinstance(raw_policy, dict):
+        raw_policy = {}
+    try:
+        min_confidence = float(raw_policy.get("min_confidence", CASCADE_MIN_CONFIDENCE))
+    except (TypeError, ValueError):
+        min_confidence = CASCADE_MIN_CONFIDENCE
+    return {"enabled": bool(raw_policy.get("enabled", CASCADE_ENABLED_BY_DEFAULT)), "min_confidence": min_confidence}
+
+def read_verdict(raw_output: str):
+    """(verdict, reported confidence or None, see verdict_confidence) of a raw agent response, without logging or metrics."""
+    parsed_output = load_agent_output(raw_output)
+    if parsed_output is None:
+        return "human", None
+    return output_verdict(parsed_output), verdict_confidence(parsed_output)
+
+def cascade_escalation_reason(raw_output: str, min_confidence: float):
+    """Why a screening output must go to the main model, or None if it can be accepted."""
+    verdict, reported_confidence = read_verdict(raw_output)
+    if verdict == "human":
+        return "human"
+    if verdict != "false":
+        return "flagged"
+    # Only a confidence the screening model actually reported can send a benign chunk up
+    if reported_confidence is not None and reported_confidence < min_confidence:
+        return "low_confidence"
+    return None
+
+def record_cascade_outcome(screen_output: str, main_output: str, reason: str) -> dict:
+    """Counts an escalation and whether the main model agreed with the screening verdict."""
+    screen_verdict, _ = read_verdict(screen_output)
+    main_verdict, _ = read_verdict(main_output)
+    record_llm_event("cascade_escalated")
+    record_llm_event(f"cascade_escalated_{reason}")
+    record_llm_event("cascade_agreed" if screen_verdict == main_verdict else "cascade_disagreed")
+    return {"tier": "main", "escalated": True, "reason": reason, "screen_verdict": screen_verdict, "main_verdict": main_verdict}
+
+
+# --- Self-Consistency Sampling ---
+# Stored per agent, e.g. "self_consistency": {"samples": 3, "spans": "intersection", "temperature": 0.7}.
+# The n samples come from one completion call; their majority verdict is
+# kept and the agreement ratio is used as the attempt's confidence.
+
+def normalize_self_consistency(raw_policy) -> dict:
+    """Normalizes an agent document's self_consistency field to {"samples", "spans", "temperature"}."""
+    if isinstance(raw_policy, int) and not isinstance(raw_policy, bool):
+        raw_policy = {"samples": raw_policy}
+    if not isinstance(raw_policy, dict):
+        raw_policy = {}
+    try:
+        samples = max(1, int(raw_policy.get("samples", SELF_CONSISTENCY_SAMPLES)))
+        temperature = float(raw_policy.get("temperature", SELF_CONSISTENCY_TEMPERATURE))
+    except (TypeError, ValueError):
+        samples, temperature = SELF_CONSISTENCY_SAMPLES, SELF_CONSISTENCY_TEMPERATURE
+    spans = str(raw_policy.get("spans", SELF_CONSISTENCY_SPANS)).lower()
+    if spans not in ("union", "intersection"):
+        spans = "union"
+    return {"samples": samples, "spans": spans, "temperature": temperature}
+
+def merge_self_consistency_samples(raw_outputs: List[str], span_mode: str = "union"):
+    """
+    Majority-vote merge of n sampled agent responses. Returns (merged output,
+    consistency), where consistency holds the votes per verdict and the
+    agreement ratio (majority votes / samples). The merged output is the first
+    majority sample, with the spans of all majority samples merged by quote
+    (union or intersection) and the agreement ratio as its confidence.
+    The samples are parsed without metrics; the merged output is parsed and
+    counted once, like any other attempt, by the agent step.
+    """
+    parsed_samples = [load_agent_output(raw_output) or default_agent_output() for raw_output in raw_outputs]
+    votes = {}
+    for parsed_output in parsed_samples:
+        verdict = output_verdict(parsed_output)
+        votes[verdict] = votes.get(verdict, 0) + 1
+    # Ties go to the more cautious verdict
+    caution = {"human": 2, "true": 1, "false": 0}
+    majority = max(votes, key=lambda verdict: (votes[verdict], caution.get(verdict, 1)))
+    majority_samples = [p for p in parsed_samples if output_verdict(p) == majority]
+
+    def quote_key(span):
+        return re.sub(r"\s+", " ", str(span.get("quote", ""))).strip().lower() if isinstance(span, dict) else ""
+
+    span_lists = [[span for span in (p.get("spans") or []) if quote_key(span)] for p in majority_samples]
+    merged_spans, seen = [], set()
+    for spans in span_lists:
+        for span in spans:
+            key = quote_key(span)
+            if key in seen:
+                continue
+            if span_mode == "intersection" and not all(key in {quote_key(s) for s in other} for other in span_lists):
+                continue
+            seen.add(key)
+            merged_spans.append(span)
+
+    agreement = votes[majority] / len(parsed_samples) if parsed_samples else 0.0
+    merged = dict(majority_samples[0]) if majority_samples else default_agent_output()
+    merged["spans"] = merged_spans
+    merged["chunk_flagged"] = majority
+    if "issues_found" in merged:
+        merged["issues_found"] = majority
+    merged["confidence"] = round(agreement, 3)
+    return merged, {"samples": len(parsed_samples), "votes": votes, "majority": majority, "agreement": round(agreement, 3)}
 
 
 def register_agent(name: str, agent_function: Agent):
     """Register an agent function."""
     available_agents[name] = agent_function
 
-def create_review_agent(review_name: str, confidence_score: int, llm_model, eval_llm_model) -> Agent:
+def create_review_agent(review_name: str, confidence_score: int, llm_model, eval_llm_model, evaluation_policy: dict = None, defer_evaluation: bool = False,
+                        screen_llm_model=None, cascade_policy: dict = None, self_consistency: dict = None, retry_strategy: dict = None,
+                        hedge_llm_model=None) -> Agent:
     """
     Creates a specialized review agent function that includes an internal evaluation loop.
+
+    evaluation_policy (see normalize_evaluation_policy) decides after each
+    agent attempt whether the evaluator LLM is called; skipped evaluations
+    are recorded in the agent's result for auditing.
+
+    With defer_evaluation=True the agent makes a single attempt and marks
+    its result "deferred" instead of calling the evaluator; the batched
+    evaluation node then scores all agents of the chunk in one request.
+
+    With a screen_llm_model and an enabled cascade_policy, the first attempt
+    goes to the screening model and is escalated to llm_model only when the
+    screening output is flagged, needs a human, or has low confidence.
+    Retries always use llm_model.
+
+    With self_consistency samples > 1, llm_model is asked for n samples in a
+    single call; the majority-vote merge replaces the evaluator, with the
+    agreement ratio as confidence, and at most one more sampling call is made.
+
+    Retries have a budget per cause (retry_cause): invalid agent output
+    re-runs the agent with a repair prompt, an unparseable evaluator reply
+    re-runs only the evaluator, and a low confidence re-runs the agent.
+    Low-confidence retries follow retry_strategy (see retry_strategies.py):
+    a new seed and temperature, the evaluator's critique, or a strict schema.
+
+    Streamed agent and evaluator calls are hedged when HEDGE_ENABLED is on
+    (llm_hedging.py); hedges go to hedge_llm_model if given.
+
+    Every parsed output is checked locally first (output_validator.py): hard
+    failures are retried with a repair prompt without calling the evaluator,
+    and evaluation_policy["on_valid"] may skip or shorten the evaluation of
+    outputs that pass.
+
+    Every step has a blocking and a native async implementation. Under
+    graph.ainvoke the async path is used end to end (llm.ainvoke, nested
+    agent_sub_graph.ainvoke), so all agents of all in-flight chunks share one
+    event loop and the LLM client's connection pool instead of a thread each.
     """
-    def agent_sub_step(state: State) -> State:
+    def build_agent_prompt(state: State) -> tuple:
         print(f"\n--- {state['current_agent_name']} Sub-Agent Step - Attempt {state.get('current_agent_retries', 0) + 1} ---")
         report_text = state["report_text"]
         metadata = state["metadata"]
-        
-        target_chunk = format_long_text_as_target_chunk(report_text)
-        formatted_chunk = split_chunk_into_lines(target_chunk)
-        
+
+        # The chunk pipeline formats the target chunk once per chunk; fall back to formatting it here.
+        formatted_chunk = metadata.get("formatted_target_chunk")
+        if formatted_chunk is None:
+            target_chunk = format_long_text_as_target_chunk(report_text)
+            formatted_chunk = split_chunk_into_lines(target_chunk)
+
         # Get the previous and next chunks from the state's metadata
         previous_chunk = metadata.get("previous_chunk", "")
         next_chunk = metadata.get("next_chunk", "")
 
-        prompt = build_prompt(
+        system_prompt, user_prompt = build_prompt_messages(
             agent_name=state["current_agent_name"],
             title=metadata.get("title", "N/A"),
             target_chunk=formatted_chunk,
@@ -105,33 +460,274 @@ def create_review_agent(review_name: str, confidence_score: int, llm_model, eval
         )
 
         print(f"--- {state['current_agent_name']} Generated Prompt ---")
-        print(prompt)
+        print(system_prompt + "\n\n" + user_prompt)
         print("-" * 30)
+        return system_prompt, user_prompt
+
+    retry_strategy = retry_strategy or normalize_retry_strategy(None)
+    uses_critique = "critique" in retry_strategy["sequence"]
+
+    def attempt_retry_plan(state: State):
+        """The retry strategy plan of this attempt; only low-confidence retries are diversified."""
+        if not state.get("current_agent_retries", 0) or retry_cause(state.get("current_agent_evaluation") or {}) != "low_confidence":
+            return None
+        retry_number = (state.get("current_agent_retry_counts") or {}).get("low_confidence", 0) + 1
+        # strict_schema retries constrain the response even when STRUCTURED_OUTPUT is off
+        plan = plan_retry(retry_strategy, retry_number, state, getattr(llm_model, "temperature", None) or 0.0, json_schema_kwargs("agent_review", AGENT_OUTPUT_SCHEMA))
+        print(f"🎛️ {review_name}: low-confidence retry {retry_number} uses strategy '{plan['strategy']}'.")
+        return plan
+
+    def attempt_messages(state: State, prompt: tuple, retry_plan: dict = None) -> list:
+        """The agent messages, with repair instructions if the previous attempt failed local validation."""
+        validation = state.get("current_agent_validation") or {}
+        if state.get("current_agent_retries", 0) and validation.get("errors"):
+            print(f"🛠️ {review_name}: asking for a repaired response ({len(validation['errors'])} failed check(s)).")
+            return agent_prompt_messages(prompt[0], prompt[1] + build_repair_instructions(validation, state.get("current_agent_raw_output", "")))
+        if retry_plan and retry_plan["prompt_suffix"]:
+            return agent_prompt_messages(prompt[0], prompt[1] + retry_plan["prompt_suffix"])
+        return agent_prompt_messages(*prompt)
+
+    def output_validation(state: State, model_output):
+        """Local checks of the output as the model returned it; None when disabled. An unparseable output always fails."""
+        if model_output is None:
+            return validate_model_output(None, [])
+        if not OUTPUT_VALIDATION:
+            return None
+        metadata = state["metadata"]
+        validation = validate_model_output(model_output, [state["report_text"], metadata.get("formatted_target_chunk") or ""])
+        record_llm_event("validation_passed" if validation["passed"] else "validation_failed")
+        if validation["errors"]:
+            print(f"🧪 {review_name}: local validation failed: {validation['errors']}")
+        elif validation["warnings"]:
+            print(f"🧪 {review_name}: local validation passed with warnings: {validation['warnings']}")
+        return validation
 
-        response = llm_model.invoke(prompt)
-        raw_output = response.content
+    def retry_budget(state: State, cause: str) -> int:
+        if cause == "agent_invalid":
+            return RETRY_BUDGET_AGENT_INVALID
+        if cause == "evaluator_invalid":
+            return RETRY_BUDGET_EVALUATOR_INVALID
+        # Each self-consistency attempt already carries n samples, so at most one more call is made
+        return min(RETRY_BUDGET_LOW_CONFIDENCE, 1) if state.get("current_agent_consistency") else RETRY_BUDGET_LOW_CONFIDENCE
 
-        # Use the new, more robust parsing function
-        parsed_output = parse_and_validate_output(raw_output)
+    def counted_retry(state: State) -> Dict:
+        """current_agent_retry_counts including the retry that is starting now."""
+        retry_counts = dict(state.get("current_agent_retry_counts") or {})
+        cause = retry_cause(state.get("current_agent_evaluation") or {})
+        retry_counts[cause] = retry_counts.get(cause, 0) + 1
+        return retry_counts
+
+    def agent_step_result(state: State, prompt: tuple, raw_output: str, cascade: dict = None, consistency: dict = None, logprob_confidence: dict = None,
+                          retry_plan: dict = None) -> State:
+        # Validated as returned by the model: the defaults filled in afterwards must not hide a missing or contradictory verdict
+        model_output = parse_agent_output(raw_output)
+        parsed_output = completed_output(model_output)
 
         return {
-            "current_agent_input_prompt": prompt,
+            "current_agent_validation": output_validation(state, model_output),
+            # The evaluator sees the full prompt (static prefix + chunk inputs)
+            "current_agent_input_prompt": prompt[0] + "\n\n" + prompt[1],
             "current_agent_raw_output": raw_output,
             "current_agent_parsed_output": parsed_output,
             "current_agent_retries": state.get("current_agent_retries", 0) + 1,
+            "current_agent_retry_counts": counted_retry(state) if state.get("current_agent_retries", 0) else {},
+            "current_agent_cascade": cascade or {"tier": "main", "escalated": False},
+            "current_agent_consistency": consistency,
+            "current_agent_logprob_confidence": logprob_confidence,
+            "current_agent_retry_strategy": {key: retry_plan[key] for key in ("strategy", "retry", "confidence_before")} if retry_plan else None,
         }
 
-    def evaluation_sub_step(state: State) -> State:
+    output_kwargs = structured_output_kwargs("agent_review", AGENT_OUTPUT_SCHEMA)
+
+    self_consistency = self_consistency or normalize_self_consistency(None)
+    sample_count = self_consistency["samples"]
+
+    def sampling_kwargs(extra_kwargs: dict) -> dict:
+        return with_learned_max_tokens(review_name, {**output_kwargs, "n": sample_count, "temperature": self_consistency["temperature"], **extra_kwargs})
+
+    def merged_samples(result):
+        raw_outputs = [generation.text for generation in result.generations[0]]
+        merged, consistency = merge_self_consistency_samples(raw_outputs, self_consistency["spans"])
+        record_llm_event("self_consistency_calls")
+        if consistency["agreement"] == 1.0:
+            record_llm_event("self_consistency_unanimous")
+        print(f"🗳️ {review_name}: {consistency['samples']} samples, votes {consistency['votes']}, agreement {consistency['agreement']:.0%}.")
+        return json.dumps(merged, ensure_ascii=False), consistency
+
+    evaluation_policy = evaluation_policy or normalize_evaluation_policy(None)
+    request_logprobs = evaluation_policy["logprobs"]
+
+    def scored_generation(result):
+        """(raw output, logprob confidence) of a single generation requested with logprobs=True."""
+        generation = result.generations[0][0]
+        response_metadata = getattr(getattr(generation, "message", None), "response_metadata", None) or generation.generation_info or {}
+        logprobs_content = extract_logprobs_content(response_metadata)
+        if logprobs_content is None:
+            record_llm_event("logprobs_unavailable")
+            return generation.text, None
+        confidence, details = confidence_from_logprobs(logprobs_content)
+        if confidence is None:
+            record_llm_event("logprobs_unavailable")
+            return generation.text, None
+        record_llm_event("logprobs_scored")
+        print(f"📈 {review_name}: logprob confidence {confidence}% {details['fields']}")
+        return generation.text, {"confidence": confidence, **details}
+
+    def logprobs_kwargs(extra_kwargs: dict) -> dict:
+        return with_learned_max_tokens(review_name, {**output_kwargs, "logprobs": True, **extra_kwargs})
+
+    def main_model_output(messages, extra_kwargs: dict = None):
+        """
+        (raw output, consistency, logprob confidence) of the main model: n samples
+        in one call, one call with logprobs, or a single streamed response.
+        extra_kwargs: seed, temperature, response_format from the retry plan, and the call timeout.
+        """
+        extra_kwargs = extra_kwargs or {}
+        if sample_count > 1:
+            return (*merged_samples(llm_model.generate([messages], **sampling_kwargs(extra_kwargs))), None)
+        if request_logprobs:
+            # Logprobs come with the full response only, so this call is not streamed
+            raw_output, logprob_confidence = scored_generation(llm_model.generate([messages], **logprobs_kwargs(extra_kwargs)))
+            return raw_output, None, logprob_confidence
+        return hedged_stream_json_response(llm_model, messages, review_name, hedge_llm_model, **{**output_kwargs, **extra_kwargs}), None, None
+
+    async def main_model_output_async(messages, extra_kwargs: dict = None):
+        extra_kwargs = extra_kwargs or {}
+        if sample_count > 1:
+            return (*merged_samples(await llm_model.agenerate([messages], **sampling_kwargs(extra_kwargs))), None)
+        if request_logprobs:
+            raw_output, logprob_confidence = scored_generation(await llm_model.agenerate([messages], **logprobs_kwargs(extra_kwargs)))
+            return raw_output, None, logprob_confidence
+        return await ahedged_stream_json_response(llm_model, messages, review_name, hedge_llm_model, **{**output_kwargs, **extra_kwargs}), None, None
+
+    cascade_policy = cascade_policy or normalize_cascade_policy(None)
+    use_cascade = cascade_policy["enabled"] and screen_llm_model is not None
+
+    def screen_first(state: State) -> bool:
+        return use_cascade and state.get("current_agent_retries", 0) == 0
+
+    def screen_messages(prompt: tuple) -> list:
+        return agent_prompt_messages(prompt[0], prompt[1] + SCREEN_CONFIDENCE_INSTRUCTION)
+
+    def screened_result(state: State, prompt: tuple, screen_output: str):
+        """The step result if the screening output can be accepted, else (None, escalation reason)."""
+        reason = cascade_escalation_reason(screen_output, cascade_policy["min_confidence"])
+        if reason is None:
+            record_llm_event("cascade_screened")
+            print(f"🪶 {review_name}: screening model accepted the chunk.")
+            _, screen_confidence = read_verdict(screen_output)
+            return agent_step_result(state, prompt, screen_output, {"tier": "screen", "escalated": False, "confidence": screen_confidence}), None
+        print(f"⬆️ {review_name}: escalating to the main model ({reason}).")
+        return None, reason
+
+    def agent_sub_step(state: State) -> State:
+        prompt = build_agent_prompt(state)
+        retry_plan = attempt_retry_plan(state)
+        messages = attempt_messages(state, prompt, retry_plan)
+        if screen_first(state):
+            screen_output = stream_json_response(screen_llm_model, screen_messages(prompt), f"{review_name} screen", **output_kwargs, **call_timeout_kwargs(state))
+            result, reason = screened_result(state, prompt, screen_output)
+            if result is not None:
+                return result
+            raw_output, consistency, logprob_confidence = main_model_output(messages, call_timeout_kwargs(state))
+            return agent_step_result(state, prompt, raw_output, record_cascade_outcome(screen_output, raw_output, reason), consistency, logprob_confidence)
+        raw_output, consistency, logprob_confidence = main_model_output(messages, {**(retry_plan["llm_kwargs"] if retry_plan else {}), **call_timeout_kwargs(state)})
+        return agent_step_result(state, prompt, raw_output, consistency=consistency, logprob_confidence=logprob_confidence, retry_plan=retry_plan)
+
+    async def agent_sub_step_async(state: State) -> State:
+        # build_prompt_messages still reads the agent document from MongoDB, so it runs off the event loop.
+        prompt = await asyncio.to_thread(build_agent_prompt, state)
+        retry_plan = attempt_retry_plan(state)
+        messages = attempt_messages(state, prompt, retry_plan)
+        if screen_first(state):
+            screen_output = await astream_json_response(screen_llm_model, screen_messages(prompt), f"{review_name} screen", **output_kwargs, **call_timeout_kwargs(state))
+            result, reason = screened_result(state, prompt, screen_output)
+            if result is not None:
+                return result
+            raw_output, consistency, logprob_confidence = await main_model_output_async(messages, call_timeout_kwargs(state))
+            return agent_step_result(state, prompt, raw_output, record_cascade_outcome(screen_output, raw_output, reason), consistency, logprob_confidence)
+        raw_output, consistency, logprob_confidence = await main_model_output_async(messages, {**(retry_plan["llm_kwargs"] if retry_plan else {}), **call_timeout_kwargs(state)})
+        return agent_step_result(state, prompt, raw_output, consistency=consistency, logprob_confidence=logprob_confidence, retry_plan=retry_plan)
+
+    def evaluation_skip_result(state: State):
         # If the parsed output indicates a parsing failure, skip evaluation and set human review flag
         parsed_output = state.get("current_agent_parsed_output", {})
         if parsed_output.get("chunk_flagged") == "human" and "Failed to parse" in parsed_output.get("observation", ""):
             print(f"\n--- {state['current_agent_name']} Evaluation Skipped due to JSON Decode Error ---")
-            return {"current_agent_confidence": 0, "current_agent_human_review": True}
+            return {
+                "current_agent_confidence": 0,
+                "current_agent_human_review": True,
+                "current_agent_evaluation": {"status": "skipped", "reason": "agent output could not be parsed"},
+            }
+        return None
+
+    def evaluation_policy_sub_step(state: State) -> State:
+        # Failed hard checks go straight back to the agent with a repair prompt, no evaluator call
+        validation = state.get("current_agent_validation")
+        if validation and not validation["passed"]:
+            return {
+                "current_agent_confidence": 0,
+                "current_agent_evaluation": {"status": "validation_failed", "policy": evaluation_policy["mode"], "errors": validation["errors"]},
+            }
+        # A negative the screening model accepted with a reported verdict confidence (at or above the
+        # cascade's min_confidence) keeps that confidence; the main-model evaluator would undo the savings
+        cascade = state.get("current_agent_cascade") or {}
+        if cascade.get("tier") == "screen" and cascade.get("confidence") is not None:
+            return {
+                "current_agent_confidence": int(round(cascade["confidence"] * 100)),
+                "current_agent_evaluation": {"status": "skipped", "policy": evaluation_policy["mode"], "reason": "accepted by the screening model"},
+            }
+        # Self-consistency: the samples' agreement is the confidence, no evaluator call
+        consistency = state.get("current_agent_consistency")
+        if consistency:
+            return {
+                "current_agent_confidence": int(round(consistency["agreement"] * 100)),
+                "current_agent_evaluation": {"status": "self_consistency", "agreement": consistency["agreement"], "votes": consistency["votes"]},
+            }
+        # Logprobs mode: the response's own token probabilities are the confidence
+        logprob_confidence = state.get("current_agent_logprob_confidence")
+        if evaluation_policy["mode"] == "logprobs" and logprob_confidence:
+            return {
+                "current_agent_confidence": logprob_confidence["confidence"],
+                "current_agent_evaluation": {"status": "logprobs", "policy": "logprobs", "fields": logprob_confidence["fields"]},
+            }
+        # Decide (and record) whether this attempt goes to the evaluator LLM
+        should_evaluate, reason = evaluation_decision(evaluation_policy, state.get("current_agent_parsed_output", {}))
+        if should_evaluate and validation and evaluation_policy["on_valid"] == "skip":
+            should_evaluate, reason = False, f"{reason}, local validation passed (on_valid=skip)"
+        if should_evaluate and defer_evaluation:
+            return {"current_agent_evaluation": {"status": "deferred", "policy": evaluation_policy["mode"], "reason": reason}}
+        if should_evaluate:
+            # A validated output only needs its findings judged, not its format
+            short = bool(validation) and evaluation_policy["on_valid"] == "short"
+            return {"current_agent_evaluation": {"status": "pending", "policy": evaluation_policy["mode"], "reason": reason, "short": short}}
+        print(f"⏩ {state['current_agent_name']} evaluation skipped ({reason}).")
+        return {"current_agent_evaluation": {"status": "skipped", "policy": evaluation_policy["mode"], "reason": reason}}
+
+    async def evaluation_policy_sub_step_async(state: State) -> State:
+        return evaluation_policy_sub_step(state)
+
+    def route_evaluation_policy(state: State) -> str:
+        if state.get("current_agent_evaluation", {}).get("status") in ("skipped", "deferred", "self_consistency", "logprobs", "validation_failed"):
+            return route_sub_step(state)
+        return "evaluation_sub_step"
+
+    def eval_response_structure() -> str:
+        if uses_critique:
+            # The critique is fed back to the agent by a "critique" retry
+            return '{"confidence": <score>, "critique": "<one sentence: what is wrong or missing in the response>"}'
+        return '{"confidence": <score>}'
+
+    def eval_output_kwargs() -> dict:
+        return structured_output_kwargs("evaluation", EVALUATION_CRITIQUE_SCHEMA if uses_critique else EVALUATION_OUTPUT_SCHEMA)
 
+    def build_eval_prompt(state: State) -> str:
+        if state.get("current_agent_evaluation", {}).get("short"):
+            return build_short_eval_prompt(state)
         prompt_from_agent = state["current_agent_input_prompt"]
         response_from_agent = state["current_agent_raw_output"]
 
-        eval_prompt = f"""
+        return f"""
 Evaluate the following:
 
 Prompt given to agent:
@@ -145,91 +741,238 @@ How correct and relevant is the Response to the Prompt?
 Give a confidence score between 0 and 100.
 
 Respond only with a single, valid JSON object that follows this structure:
-{{"confidence": <score>}}
+{eval_response_structure()}
 DO NOT include any explanation or text outside of the JSON object.
 """
 
-        eval_response = eval_llm_model.invoke(eval_prompt).content
+    def build_short_eval_prompt(state: State) -> str:
+        target_chunk = state["metadata"].get("formatted_target_chunk") or state["report_text"]
+        response_from_agent = state["current_agent_raw_output"]
+
+        return f"""
+Evaluate the following {review_name} review of a Target Chunk.
+Its format, allowed values and span quotes were already checked; judge only whether the findings are correct and relevant.
+
+Target Chunk:
+{target_chunk}
+
+Agent's Raw Response:
+"{response_from_agent}"
+
+Give a confidence score between 0 and 100.
+
+Respond only with a single, valid JSON object that follows this structure:
+{eval_response_structure()}
+DO NOT include any explanation or text outside of the JSON object.
+"""
+
+    def evaluation_result(eval_response: str, short: bool = False) -> State:
         confidence = 0
+        parse_error = False
+        critique = None
         try:
-            eval_data = json.loads(eval_response)
+            # Fenced JSON (a non-streamed reply; the stream scanner drops the fence) is read from inside the fence
+            eval_data = extract_json_object(eval_response)
             confidence = int(eval_data.get("confidence", 0))
-        except json.JSONDecodeError:
+            critique = eval_data.get("critique") or None
+            record_llm_event("evaluator_parse_ok")
+            if not is_bare_json(eval_response):
+                record_llm_event("evaluator_fenced_json")
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
             confidence = 0
+            parse_error = True
+            record_llm_event("evaluator_parse_failed")
 
-        return {"current_agent_confidence": confidence, "current_agent_human_review": False}
+        return {
+            "current_agent_confidence": confidence,
+            "current_agent_human_review": False,
+            "current_agent_evaluation": {"status": "evaluated", "policy": evaluation_policy["mode"], "parse_error": parse_error, "short": short, "critique": critique},
+        }
 
+    def scored_evaluation(state: State, eval_response: str) -> State:
+        result = evaluation_result(eval_response, state.get("current_agent_evaluation", {}).get("short", False))
+        # Re-entered after an unparseable evaluator reply: count the evaluator-only retry
+        if state.get("current_agent_evaluation", {}).get("status") == "evaluated":
+            result["current_agent_retry_counts"] = counted_retry(state)
+        return result
+
+    def evaluation_sub_step(state: State) -> State:
+        skipped = evaluation_skip_result(state)
+        if skipped is not None:
+            return skipped
+        eval_response = hedged_stream_json_response(eval_llm_model, build_eval_prompt(state), f"{review_name} evaluator", hedge_llm_model,
+                                                    **eval_output_kwargs(), **call_timeout_kwargs(state))
+        return scored_evaluation(state, eval_response)
+
+    async def evaluation_sub_step_async(state: State) -> State:
+        skipped = evaluation_skip_result(state)
+        if skipped is not None:
+            return skipped
+        eval_response = await ahedged_stream_json_response(eval_llm_model, build_eval_prompt(state), f"{review_name} evaluator", hedge_llm_model,
+                                                           **eval_output_kwargs(), **call_timeout_kwargs(state))
+        return scored_evaluation(state, eval_response)
 
     def route_sub_step(state: State) -> str:
-        max_retries = 3
+        next_step = retry_decision(state)
+        # No retry is started once the chunk's deadline has passed
+        if next_step in ("agent_sub_step", "evaluation_sub_step") and chunk_time_left(state) == 0:
+            print(f"⏰ {review_name}: chunk deadline reached, no further retry.")
+            return "deadline_exceeded_sub_step"
+        return next_step
+
+    def retry_decision(state: State) -> str:
         parsed_output = state.get("current_agent_parsed_output", {})
-        current_agent_retries = state.get("current_agent_retries", 0)
+        evaluation = state.get("current_agent_evaluation", {})
+        retry_counts = state.get("current_agent_retry_counts") or {}
         current_agent_confidence = state.get("current_agent_confidence", 0)
         current_agent_human_review = state.get("current_agent_human_review", False)
 
-        # 1. First, check if the parsed output itself indicates a human review is needed (e.g., due to a parsing error)
-        if parsed_output.get("chunk_flagged") == "human" or current_agent_human_review:
-            print("❗ Routing to human review due to parsing failure or LLM's own 'human' flag.")
+        def budget_left(cause: str) -> bool:
+            return retry_counts.get(cause, 0) < retry_budget(state, cause)
+
+        # 1. Invalid agent output (unparseable or failing local validation) is re-run with a repair prompt
+        if evaluation.get("status") == "validation_failed":
+            if not budget_left("agent_invalid"):
+                print("❗ Agent output still invalid after its retry budget. Routing to human review.")
+                return "human_review_needed_sub_step"
+            print("🛠️ Retrying agent step with a repair prompt.")
+            record_llm_event("validation_repairs")
+            return "agent_sub_step"
+
+        # 2. Then, check if the LLM's own verdict asks for a human review
+        if output_verdict(parsed_output) == "human" or current_agent_human_review:
+            print("❗ Routing to human review due to the LLM's own 'human' flag.")
             return "human_review_needed_sub_step"
 
-        # 2. Then, check if the confidence score is too low after all retries
+        # 3. An evaluation skipped by the agent's policy accepts the output as is
+        if evaluation.get("status") == "skipped":
+            print("✅ Evaluation skipped by policy. Ending agent sub-workflow.")
+            return "end"
+        if evaluation.get("status") == "deferred":
+            print("⏳ Evaluation deferred to the batched evaluator. Ending agent sub-workflow.")
+            return "end"
+
+        # 4. An unparseable evaluator reply only repeats the evaluator call; the agent output is kept
+        if evaluation.get("parse_error"):
+            if not budget_left("evaluator_invalid"):
+                print("❗ Evaluator reply still unparseable after its retry budget. Routing to human review.")
+                return "human_review_needed_sub_step"
+            print("🔁 Retrying the evaluator only.")
+            record_llm_event("evaluator_retries")
+            return "evaluation_sub_step"
+
+        # The confidence of a low-confidence retry is known now: credit it to the retry's strategy
+        retry_plan = state.get("current_agent_retry_strategy")
+        if retry_plan:
+            retry_strategy_stats.record(retry_plan["strategy"], retry_plan["confidence_before"], current_agent_confidence, current_agent_confidence >= confidence_score)
+
+        # 5. Then, check if the confidence score is too low after all retries
         if current_agent_confidence < confidence_score:
             print(f"⚠️ Confidence score ({current_agent_confidence}%) is too low.")
-            if current_agent_retries >= max_retries:
+            if not budget_left("low_confidence"):
                 print("❗ Max retries exceeded. Routing to human review.")
                 return "human_review_needed_sub_step"
             else:
                 print("🔄 Retrying agent step.")
+                record_llm_event("agent_retries")
                 return "agent_sub_step"
 
-        # 3. If confidence is high enough, the process is complete
+        # 6. If confidence is high enough, the process is complete
         print("✅ Confidence score is sufficient. Ending agent sub-workflow.")
         return "end"
 
+    def deadline_exceeded_sub_step(state: State) -> State:
+        return {"current_agent_deadline_exceeded": True}
+
+    async def deadline_exceeded_sub_step_async(state: State) -> State:
+        return deadline_exceeded_sub_step(state)
+
     def human_review_sub_step(state: State) -> State:
         return {"current_agent_human_review": True}
 
+    async def human_review_sub_step_async(state: State) -> State:
+        return human_review_sub_step(state)
+
     # Build agent graph
     agent_graph_builder = StateGraph(State)
-    agent_graph_builder.add_node("agent_sub_step", RunnableLambda(agent_sub_step))
-    agent_graph_builder.add_node("evaluation_sub_step", RunnableLambda(evaluation_sub_step))
-    agent_graph_builder.add_node("human_review_needed_sub_step", RunnableLambda(human_review_sub_step))
+    agent_graph_builder.add_node("agent_sub_step", RunnableLambda(agent_sub_step, afunc=agent_sub_step_async))
+    agent_graph_builder.add_node("evaluation_sub_step", RunnableLambda(evaluation_sub_step, afunc=evaluation_sub_step_async))
+    agent_graph_builder.add_node("human_review_needed_sub_step", RunnableLambda(human_review_sub_step, afunc=human_review_sub_step_async))
+    agent_graph_builder.add_node("deadline_exceeded_sub_step", RunnableLambda(deadline_exceeded_sub_step, afunc=deadline_exceeded_sub_step_async))
+    agent_graph_builder.add_node("evaluation_policy_sub_step", RunnableLambda(evaluation_policy_sub_step, afunc=evaluation_policy_sub_step_async))
 
     agent_graph_builder.set_entry_point("agent_sub_step")
-    agent_graph_builder.add_edge("agent_sub_step", "evaluation_sub_step")
+    agent_graph_builder.add_edge("agent_sub_step", "evaluation_policy_sub_step")
+    # Skipped evaluations go straight to the normal routing; the others go to the evaluator
+    agent_graph_builder.add_conditional_edges(
+        "evaluation_policy_sub_step",
+        route_evaluation_policy,
+        {
+            "evaluation_sub_step": "evaluation_sub_step",
+            "agent_sub_step": "agent_sub_step",
+            "human_review_needed_sub_step": "human_review_needed_sub_step",
+            "deadline_exceeded_sub_step": "deadline_exceeded_sub_step",
+            "end": END
+        }
+    )
     agent_graph_builder.add_conditional_edges(
         "evaluation_sub_step",
         route_sub_step,
         {
             "agent_sub_step": "agent_sub_step",
+            "evaluation_sub_step": "evaluation_sub_step",
             "human_review_needed_sub_step": "human_review_needed_sub_step",
+            "deadline_exceeded_sub_step": "deadline_exceeded_sub_step",
             "end": END
         }
     )
     agent_graph_builder.add_edge("human_review_needed_sub_step", END)
+    agent_graph_builder.add_edge("deadline_exceeded_sub_step", END)
     agent_sub_graph = agent_graph_builder.compile()
 
-    def review_agent_with_evaluation(state: State) -> Dict:
-        initial_sub_state = {
+    def initial_sub_state(state: State) -> Dict:
+        sub_state = {
             "report_text": state["report_text"],
             "metadata": state["metadata"],
             "current_agent_name": review_name,
             "current_agent_retries": 0,
+            "current_agent_retry_counts": {},
             "current_agent_confidence": 0,
             "current_agent_human_review": False,
             "final_decision_report": "",
             "aggregate": [],
             "main_node_output": {}
         }
+        # A retry requested by the batched evaluator continues this agent's attempts: it uses the
+        # main model (not the screening model), the low-confidence budget and the retry strategy
+        previous = (state.get("metadata") or {}).get("batched_retry", {}).get(review_name)
+        if previous:
+            sub_state.update({
+                "current_agent_retries": previous["retries"],
+                "current_agent_retry_counts": dict(previous["retry_counts"]),
+                "current_agent_confidence": previous["confidence"],
+                "current_agent_raw_output": previous["raw_output"],
+                "current_agent_parsed_output": previous["parsed_output"],
+                "current_agent_evaluation": {"status": "evaluated", "batched": True},
+            })
+        return sub_state
 
-        final_sub_state = agent_sub_graph.invoke(initial_sub_state)
-
+    def agent_node_output(final_sub_state: Dict) -> Dict:
+        if final_sub_state.get("current_agent_deadline_exceeded"):
+            return transient_failure_output(review_name, "chunk deadline reached before an accepted attempt")
         agent_result = final_sub_state.get("current_agent_parsed_output", {"error": "No output parsed"})
         agent_confidence = final_sub_state.get("current_agent_confidence", 0)
         agent_retries = final_sub_state.get("current_agent_retries", 0)
         agent_human_review = final_sub_state.get("current_agent_human_review", False)
+        agent_evaluation = final_sub_state.get("current_agent_evaluation", {})
+        agent_cascade = final_sub_state.get("current_agent_cascade", {})
+        agent_consistency = final_sub_state.get("current_agent_consistency")
+        agent_logprob_confidence = final_sub_state.get("current_agent_logprob_confidence")
+        agent_validation = final_sub_state.get("current_agent_validation")
+        agent_retry_counts = final_sub_state.get("current_agent_retry_counts") or {}
+        agent_retry_strategy = final_sub_state.get("current_agent_retry_strategy")
 
-        return {
+        node_output = {
             review_name: agent_result,
             "aggregate": [f"{review_name} Output: {agent_result} (Confidence: {agent_confidence}%, Retries: {agent_retries}, Human Review: {agent_human_review})"],
             "main_node_output": {
@@ -237,16 +980,51 @@ DO NOT include any explanation or text outside of the JSON object.
                     "output": agent_result,
                     "confidence": agent_confidence,
                     "retries": agent_retries,
-                    "human_review": agent_human_review
+                    "retry_counts": agent_retry_counts,
+                    "retry_strategy": agent_retry_strategy,
+                    "human_review": agent_human_review,
+                    "evaluation": agent_evaluation,
+                    "cascade": agent_cascade,
+                    "self_consistency": agent_consistency,
+                    "logprob_confidence": agent_logprob_confidence,
+                    "validation": agent_validation
                 }
             }
         }
+        if agent_evaluation.get("status") == "deferred":
+            # The batched evaluator scores the raw response
+            node_output["main_node_output"][review_name]["raw_output"] = final_sub_state.get("current_agent_raw_output", "")
+        return node_output
+
+    def review_agent_with_evaluation(state: State) -> Dict:
+        try:
+            final_sub_state = agent_sub_graph.invoke(initial_sub_state(state))
+        except TRANSIENT_LLM_ERRORS as e:
+            return transient_failure_output(review_name, f"LLM request failed ({type(e).__name__})")
+        return agent_node_output(final_sub_state)
+
+    async def review_agent_with_evaluation_async(state: State) -> Dict:
+        try:
+            # Cancelling the sub-graph at the deadline aborts the agent's in-flight request
+            final_sub_state = await asyncio.wait_for(agent_sub_graph.ainvoke(initial_sub_state(state)), timeout=chunk_time_left(state))
+        except asyncio.TimeoutError:
+            return transient_failure_output(review_name, "cancelled at the chunk deadline")
+        except TRANSIENT_LLM_ERRORS as e:
+            return transient_failure_output(review_name, f"LLM request failed ({type(e).__name__})")
+        return agent_node_output(final_sub_state)
 
-    return review_agent_with_evaluation
+    return RunnableLambda(review_agent_with_evaluation, afunc=review_agent_with_evaluation_async, name=review_name)
 
 
-def load_agents_from_mongo(llm_model, eval_llm_model):
-    """Load all agents from MongoDB and register only those with type='analysis'."""
+def read_agents_from_mongo(llm_model, eval_llm_model, defer_evaluation: bool = False, screen_llm_model=None, hedge_llm_model=None):
+    """
+    Builds the agents with type='analysis' from MongoDB without registering them.
+    Returns (agents, settings), keyed by agent_name like available_agents and agent_settings.
+    With defer_evaluation=True the agents leave evaluation to the batched evaluation node.
+    screen_llm_model is the cheap first-pass model for agents with an enabled cascade policy.
+    hedge_llm_model is the second endpoint hedged requests go to.
+    """
+    agents, settings = {}, {}
     client = None
     try:
         client = pymongo.MongoClient(MONGO_URI)
@@ -259,6 +1037,11 @@ def load_agents_from_mongo(llm_model, eval_llm_model):
         for doc in rows:
             agent_name = doc.get("agent_name")
             confidence_score = doc.get("confidence_score", 0)
+            evaluation_policy = normalize_evaluation_policy(doc.get("evaluation_policy"))
+            relevance_rule = normalize_relevance_rule(doc.get("relevance"))
+            cascade_policy = normalize_cascade_policy(doc.get("cascade"))
+            self_consistency = normalize_self_consistency(doc.get("self_consistency"))
+            retry_strategy = normalize_retry_strategy(doc.get("retry_strategy"))
             agent_type = doc.get("type")
 
             if agent_type != "analysis":
@@ -266,9 +1049,11 @@ def load_agents_from_mongo(llm_model, eval_llm_model):
                 continue
 
             if agent_name and confidence_score is not None:
-                agent = create_review_agent(agent_name, confidence_score, llm_model, eval_llm_model)
-                register_agent(agent_name, agent)
-                print(f"✅ Agent '{agent_name}' (type={agent_type}) loaded with confidence score: {confidence_score}")
+                agents[agent_name] = create_review_agent(agent_name, confidence_score, llm_model, eval_llm_model, evaluation_policy, defer_evaluation,
+                                                         screen_llm_model, cascade_policy, self_consistency, retry_strategy, hedge_llm_model)
+                settings[agent_name] = {"confidence_score": confidence_score, "evaluation_policy": evaluation_policy, "relevance": relevance_rule}
+                cascade_note = f", cascade: {cascade_policy}" if cascade_policy["enabled"] and screen_llm_model is not None else ""
+                print(f"✅ Agent '{agent_name}' (type={agent_type}) loaded with confidence score: {confidence_score}, evaluation policy: {evaluation_policy}{cascade_note}")
             else:
                 print(f"⚠️ Error: Missing 'agent_name' or 'confidence_score' in document: {doc}")
 
@@ -276,4 +1061,398 @@ def load_agents_from_mongo(llm_model, eval_llm_model):
         print(f"MongoDB connection error: {e}")
     finally:
         if client:
-            client.close()
\ No newline at end of file
+            client.close()
+    return agents, settings
+
+
+def publish_agents(agents: Dict[str, Agent], settings: Dict[str, Dict]):
+    """Makes agents/settings the current contents of available_agents and agent_settings."""
+    available_agents.clear()
+    agent_settings.clear()
+    for agent_name, agent in agents.items():
+        register_agent(agent_name, agent)
+    agent_settings.update(settings)
+
+
+def load_agents_from_mongo(llm_model, eval_llm_model, defer_evaluation: bool = False, screen_llm_model=None, hedge_llm_model=None):
+    """
+    Load all agents from MongoDB and register only those with type='analysis'.
+    With defer_evaluation=True the agents leave evaluation to the batched evaluation node.
+    """
+    agents, settings = read_agents_from_mongo(llm_model, eval_llm_model, defer_evaluation, screen_llm_model, hedge_llm_model)
+    publish_agents(agents, settings)
+
+
+def warm_up_prefix_cache(llm_model, agent_names: List[str] = None):
+    """
+    Sends each agent's static prompt prefix once with a one-token reply, so
+    vLLM's prefix cache already holds it when the first chunk is reviewed.
+    Returns {agent_name: prefix fingerprint}; the fingerprint changes only
+    when the agent document (and therefore the cached prefix) changes.
+    """
+    fingerprints = {}
+    for agent_name in agent_names or list(available_agents.keys()):
+        prefix, error = build_static_prefix(agent_name)
+        if error:
+            print(f"⚠️ Prefix cache warm-up skipped for '{agent_name}': {error}")
+            continue
+        fingerprint = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:12]
+        try:
+            llm_model.invoke(agent_prompt_messages(prefix, "Reply with OK."), max_tokens=1)
+            fingerprints[agent_name] = fingerprint
+            print(f"✅ Prefix cache warmed for '{agent_name}' (prefix {fingerprint}, {len(prefix)} chars).")
+        except Exception as e:
+            print(f"⚠️ Prefix cache warm-up failed for '{agent_name}': {e}")
+    return fingerprints
+
+
+# --- Single-call multi-agent review mode ---
+
+def split_combined_output(raw_output: str, agent_names: List[str]) -> Dict[str, dict]:
+    """Splits a combined review response (one JSON object keyed by agent_name) into per-agent outputs as returned (None if missing)."""
+    return split_keyed_output(raw_output, agent_names, "combined review")
+
+
+def create_combined_review_node(agent_names: List[str], llm_model):
+    """
+    Creates a graph node that reviews a chunk for every agent in one LLM call:
+    the rubrics of all agents are combined into a single prompt (the chunk
+    text is sent once) and the response is split back into the per-agent
+    main_node_output entries that save_results_to_mongo expects.
+    No evaluator call is made in this mode, so confidence is not scored.
+    Agents the relevance gate marked not applicable are left out of the prompt.
+    """
+    def active_agent_names(state: State) -> List[str]:
+        decisions = state.get("metadata", {}).get("agent_relevance", {})
+        return [agent_name for agent_name in agent_names if decisions.get(agent_name, {}).get("run", True)]
+
+    def build_combined_agent_prompt(state: State, active_names: List[str]) -> str:
+        metadata = state["metadata"]
+        formatted_chunk = metadata.get("formatted_target_chunk")
+        if formatted_chunk is None:
+            formatted_chunk = split_chunk_into_lines(format_long_text_as_target_chunk(state["report_text"]))
+        return build_combined_prompt(
+            agent_names=active_names,
+            title=metadata.get("title", "N/A"),
+            target_chunk=formatted_chunk,
+            previous_chunk=metadata.get("previous_chunk", ""),
+            next_chunk=metadata.get("next_chunk", "")
+        )
+
+    def combined_node_output(state: State, raw_output: str, usage: dict, active_names: List[str]) -> Dict:
+        per_agent = split_combined_output(raw_output, active_names)
+        main_node_output = {}
+        aggregate = []
+        chunk_texts = [state["report_text"], state["metadata"].get("formatted_target_chunk") or ""]
+        for agent_name, model_output in per_agent.items():
+            entry = unscored_result(model_output, chunk_texts, "combined")
+            main_node_output[agent_name] = entry
+            aggregate.append(f"{agent_name} Output: {entry['output']} (Combined review, Human Review: {entry['human_review']})")
+        print(f"--- Combined review for {len(active_names)} agents used {usage['total_tokens']} tokens ---")
+        return {"aggregate": aggregate, "main_node_output": main_node_output}
+
+    def combined_failure_output(active_names: List[str], reason: str) -> Dict:
+        """Every agent of the failed request is a transient failure, so the chunk stays pending."""
+        node_output = {"aggregate": [], "main_node_output": {}}
+        for agent_name in active_names:
+            failure = transient_failure_output(agent_name, reason)
+            node_output["main_node_output"].update(failure["main_node_output"])
+            node_output["aggregate"].extend(failure["aggregate"])
+        return node_output
+
+    def combined_kwargs(state: State, active_names: List[str]) -> dict:
+        return {**structured_output_kwargs("combined_review", keyed_schema(active_names, AGENT_OUTPUT_SCHEMA)), **call_timeout_kwargs(state)}
+
+    def combined_review(state: State) -> Dict:
+        active_names = active_agent_names(state)
+        if not active_names:
+            return {}
+        prompt = build_combined_agent_prompt(state, active_names)
+        try:
+            response = llm_model.invoke(prompt, **combined_kwargs(state, active_names))
+        except TRANSIENT_LLM_ERRORS as e:
+            return combined_failure_output(active_names, f"LLM request failed ({type(e).__name__})")
+        return combined_node_output(state, response.content, get_token_usage(response), active_names)
+
+    async def combined_review_async(state: State) -> Dict:
+        active_names = active_agent_names(state)
+        if not active_names:
+            return {}
+        prompt = await asyncio.to_thread(build_combined_agent_prompt, state, active_names)
+        try:
+            response = await llm_model.ainvoke(prompt, **combined_kwargs(state, active_names))
+        except TRANSIENT_LLM_ERRORS as e:
+            return combined_failure_output(active_names, f"LLM request failed ({type(e).__name__})")
+        return combined_node_output(state, response.content, get_token_usage(response), active_names)
+
+    return RunnableLambda(combined_review, afunc=combined_review_async, name="combined_review")
+
+
+
+# --- Packed review mode ---
+
+def create_packed_review_node(agent_names: List[str], llm_model):
+    """
+    Creates the reviewer of the "packed" mode. It takes the states of
+    consecutive chunks of one book (see chunk_packing.pack_chunk_windows) and
+    makes one request per agent for the whole pack, each chunk listed under
+    its chunk id; the response is split back into one update per state with
+    the main_node_output entries that save_results_to_mongo expects.
+    As in combined mode no evaluator call is made, and outputs failing local
+    validation go to human review. An agent only gets the chunks the
+    relevance gate selected it for.
+    """
+    def pack_chunk_id(state: State) -> str:
+        return str(state["metadata"]["chunk_id"])
+
+    def formatted_chunk(state: State) -> str:
+        formatted = state["metadata"].get("formatted_target_chunk")
+        if formatted is None:
+            formatted = split_chunk_into_lines(format_long_text_as_target_chunk(state["report_text"]))
+        return formatted
+
+    def agent_pack(states: List[State], agent_name: str) -> List[int]:
+        """Positions of the states the relevance gate selected agent_name for."""
+        return [position for position, state in enumerate(states)
+                if state.get("metadata", {}).get("agent_relevance", {}).get(agent_name, {}).get("run", True)]
+
+    def build_pack_messages(agent_name: str, pack: List[State]) -> list:
+        first, last = pack[0]["metadata"], pack[-1]["metadata"]
+        system_prompt, user_prompt = build_packed_prompt_messages(
+            agent_name=agent_name,
+            title=first.get("title", "N/A"),
+            target_chunks=[(pack_chunk_id(state), formatted_chunk(state)) for state in pack],
+            previous_chunk=first.get("previous_chunk", ""),
+            next_chunk=last.get("next_chunk", "")
+        )
+        return agent_prompt_messages(system_prompt, user_prompt)
+
+    def pack_texts(pack: List[State]) -> list:
+        """(chunk id, texts its quotes are checked against) of each chunk, for add_pack_results."""
+        return [(pack_chunk_id(state), [state["report_text"], formatted_chunk(state)]) for state in pack]
+
+    def pack_output_kwargs(pack: List[State]) -> dict:
+        return structured_output_kwargs("packed_review", keyed_schema([pack_chunk_id(state) for state in pack], AGENT_OUTPUT_SCHEMA))
+
+    def add_pack_failure(updates: List[Dict], agent_name: str, positions: List[int], reason: str):
+        for position in positions:
+            failure = transient_failure_output(agent_name, reason)
+            updates[position]["main_node_output"].update(failure["main_node_output"])
+            updates[position]["aggregate"].extend(failure["aggregate"])
+
+    def packed_review(states: List[State]) -> List[Dict]:
+        updates = [{"aggregate": [], "main_node_output": {}} for _ in states]
+        for agent_name in agent_names:
+            positions = agent_pack(states, agent_name)
+            if not positions:
+                continue
+            pack = [states[position] for position in positions]
+            try:
+                response = llm_model.invoke(build_pack_messages(agent_name, pack), **pack_output_kwargs(pack), **call_timeout_kwargs(pack[0]))
+            except TRANSIENT_LLM_ERRORS as e:
+                add_pack_failure(updates, agent_name, positions, f"LLM request failed ({type(e).__name__})")
+                continue
+            add_pack_results(updates, agent_name, positions, pack_texts(pack), response.content, get_token_usage(response))
+        return updates
+
+    async def packed_review_async(states: List[State]) -> List[Dict]:
+        updates = [{"aggregate": [], "main_node_output": {}} for _ in states]
+
+        async def review_pack(agent_name: str, positions: List[int]):
+            pack = [states[position] for position in positions]
+            messages = await asyncio.to_thread(build_pack_messages, agent_name, pack)
+            try:
+                response = await llm_model.ainvoke(messages, **pack_output_kwargs(pack), **call_timeout_kwargs(pack[0]))
+            except TRANSIENT_LLM_ERRORS as e:
+                add_pack_failure(updates, agent_name, positions, f"LLM request failed ({type(e).__name__})")
+                return
+            add_pack_results(updates, agent_name, positions, pack_texts(pack), response.content, get_token_usage(response))
+
+        tasks = {}
+        for agent_name in agent_names:
+            positions = agent_pack(states, agent_name)
+            if positions:
+                tasks[asyncio.ensure_future(review_pack(agent_name, positions))] = (agent_name, positions)
+        if not tasks:
+            return updates
+        # Agents still running at the pack's deadline are cancelled; the ones that finished keep their results
+        try:
+            done, pending = await asyncio.wait(set(tasks), timeout=chunk_time_left(states[0]))
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        for task in pending:
+            task.cancel()
+            add_pack_failure(updates, *tasks[task], "cancelled at the chunk deadline")
+        for task in done:
+            task.result()
+        return updates
+
+    return RunnableLambda(packed_review, afunc=packed_review_async, name="packed_review")
+
+
+# --- Batched evaluation mode ---
+
+def parse_batched_confidences(raw_output: str, agent_names: List[str]) -> Dict[str, int]:
+    """
+    Reads the batched evaluator's response, a JSON object keyed by agent_name
+    whose values are {"confidence": <score>} (a bare number is accepted too).
+    Agents missing from the response get confidence 0.
+    """
+    try:
+        eval_data = extract_json_object(raw_output)
+        record_llm_event("evaluator_parse_ok")
+        if not is_bare_json(raw_output):
+            record_llm_event("evaluator_fenced_json")
+    except json.JSONDecodeError as e:
+        print(f"❌ JSON parsing error in batched evaluation: {e}. Raw output: '{raw_output}'")
+        record_llm_event("evaluator_parse_failed")
+        eval_data = {}
+    if not isinstance(eval_data, dict):
+        eval_data = {}
+
+    confidences = {}
+    for agent_name in agent_names:
+        value = eval_data.get(agent_name)
+        if isinstance(value, dict):
+            value = value.get("confidence", 0)
+        try:
+            confidences[agent_name] = int(float(value))
+        except (TypeError, ValueError):
+            print(f"⚠️ Warning: Batched evaluation has no confidence for agent '{agent_name}'.")
+            confidences[agent_name] = 0
+    return confidences
+
+
+def create_batched_evaluation_node(eval_llm_model, agents: Dict[str, Agent] = None, settings: Dict[str, Dict] = None):
+    """
+    Creates a graph node that runs after every agent of a chunk has returned
+    and scores all deferred agent responses in one evaluator request (the
+    chunk is sent once, with each agent's rubric summary and raw response).
+    Agents below their confidence_score are re-run as a continuation of their
+    attempts (metadata["batched_retry"]), and only their new responses are
+    evaluated in the next batch; agents still below their threshold once
+    RETRY_BUDGET_LOW_CONFIDENCE is used up go to human review.
+    agents/settings default to the registered agents; a graph built from an
+    agent registry snapshot passes its own.
+    """
+    agents = available_agents if agents is None else agents
+    settings = agent_settings if settings is None else settings
+
+    def deferred_agents(results: Dict) -> List[str]:
+        return [
+            agent_name for agent_name, entry in results.items()
+            if entry.get("evaluation", {}).get("status") == "deferred" and not entry.get("human_review")
+        ]
+
+    def build_batch_prompt(state: State, agent_names: List[str], results: Dict) -> str:
+        metadata = state["metadata"]
+        formatted_chunk = metadata.get("formatted_target_chunk")
+        if formatted_chunk is None:
+            formatted_chunk = split_chunk_into_lines(format_long_text_as_target_chunk(state["report_text"]))
+        return build_batched_evaluation_prompt(
+            agent_responses={agent_name: results[agent_name].get("raw_output", "") for agent_name in agent_names},
+            title=metadata.get("title", "N/A"),
+            target_chunk=formatted_chunk
+        )
+
+    def apply_confidences(results: Dict, attempts: Dict, confidences: Dict[str, int], aggregate: List[str]) -> Dict[str, Dict]:
+        """Records the batch's confidences and returns {agent to retry: its attempt history for the retry}."""
+        to_retry = {}
+        for agent_name, confidence in confidences.items():
+            threshold = settings.get(agent_name, {}).get("confidence_score", 0)
+            entry = dict(results[agent_name])
+            raw_output = entry.pop("raw_output", "")
+            entry["confidence"] = confidence
+            entry["retries"] = attempts[agent_name]
+            entry["evaluation"] = {**entry.get("evaluation", {}), "status": "evaluated", "batched": True}
+            retry_counts = entry.get("retry_counts") or {}
+            retry_plan = entry.get("retry_strategy")
+            if retry_plan:
+                retry_strategy_stats.record(retry_plan["strategy"], retry_plan["confidence_before"], confidence, confidence >= threshold)
+
+            if confidence < threshold:
+                print(f"⚠️ {agent_name} confidence score ({confidence}%) is too low.")
+                if retry_counts.get("low_confidence", 0) >= RETRY_BUDGET_LOW_CONFIDENCE:
+                    print(f"❗ {agent_name} max retries exceeded. Routing to human review.")
+                    entry["human_review"] = True
+                else:
+                    print(f"🔄 Retrying {agent_name} agent step.")
+                    record_llm_event("agent_retries")
+                    to_retry[agent_name] = {
+                        "retries": attempts[agent_name],
+                        "retry_counts": retry_counts,
+                        "confidence": confidence,
+                        "raw_output": raw_output,
+                        "parsed_output": entry.get("output", {}),
+                    }
+            else:
+                print(f"✅ {agent_name} confidence score is sufficient.")
+            results[agent_name] = entry
+            aggregate.append(f"{agent_name} Batched Evaluation: Confidence {confidence}% after {attempts[agent_name]} attempt(s)")
+        return to_retry
+
+    def batch_kwargs(state: State, agent_names: List[str]) -> dict:
+        return {**structured_output_kwargs("batched_evaluation", keyed_schema(agent_names, EVALUATION_OUTPUT_SCHEMA)), **call_timeout_kwargs(state)}
+
+    def evaluation_failed(results: Dict, attempts: Dict, agent_names: List[str], reason: str, aggregate: List[str]):
+        """The evaluator request failed: the agents' outputs are kept unscored and go to human review."""
+        print(f"⏰ Batched evaluation failed ({reason}). Routing {len(agent_names)} agent(s) to human review.")
+        record_llm_event("batched_evaluation_failures")
+        for agent_name in agent_names:
+            entry = dict(results[agent_name])
+            entry.pop("raw_output", None)
+            entry["retries"] = attempts[agent_name]
+            entry["human_review"] = True
+            entry["evaluation"] = {**entry.get("evaluation", {}), "status": "failed", "batched": True, "reason": reason}
+            results[agent_name] = entry
+            aggregate.append(f"{agent_name} Batched Evaluation: failed ({reason}), Human Review: True")
+
+    def retry_state(state: State, agent_name: str, previous: Dict) -> State:
+        return {**state, "metadata": {**state["metadata"], "batched_retry": {agent_name: previous}}}
+
+    def merge_retried(results: Dict, attempts: Dict, retried_outputs: List[Dict]):
+        for node_output in retried_outputs:
+            for agent_name, entry in node_output.get("main_node_output", {}).items():
+                # The retry continued the agent's attempts, so its retries count is already cumulative
+                attempts[agent_name] = max(attempts[agent_name] + 1, entry.get("retries", 0))
+                results[agent_name] = {**entry, "retries": attempts[agent_name]}
+
+    def batched_evaluation(state: State) -> Dict:
+        results = dict(state.get("main_node_output", {}))
+        attempts = {agent_name: entry.get("retries", 1) for agent_name, entry in results.items()}
+        aggregate = []
+        pending = deferred_agents(results)
+        while pending:
+            print(f"\n--- Batched Evaluation of {len(pending)} agent response(s) ---")
+            try:
+                eval_response = eval_llm_model.invoke(build_batch_prompt(state, pending, results), **batch_kwargs(state, pending)).content
+            except TRANSIENT_LLM_ERRORS as e:
+                evaluation_failed(results, attempts, pending, f"LLM request failed ({type(e).__name__})", aggregate)
+                break
+            to_retry = apply_confidences(results, attempts, parse_batched_confidences(eval_response, pending), aggregate)
+            merge_retried(results, attempts, [agents[agent_name].invoke(retry_state(state, agent_name, previous)) for agent_name, previous in to_retry.items()])
+            pending = deferred_agents({agent_name: results[agent_name] for agent_name in to_retry})
+        return {"main_node_output": results, "aggregate": aggregate}
+
+    async def batched_evaluation_async(state: State) -> Dict:
+        results = dict(state.get("main_node_output", {}))
+        attempts = {agent_name: entry.get("retries", 1) for agent_name, entry in results.items()}
+        aggregate = []
+        pending = deferred_agents(results)
+        while pending:
+            print(f"\n--- Batched Evaluation of {len(pending)} agent response(s) ---")
+            prompt = await asyncio.to_thread(build_batch_prompt, state, pending, results)
+            try:
+                eval_response = (await eval_llm_model.ainvoke(prompt, **batch_kwargs(state, pending))).content
+            except TRANSIENT_LLM_ERRORS as e:
+                evaluation_failed(results, attempts, pending, f"LLM request failed ({type(e).__name__})", aggregate)
+                break
+            to_retry = apply_confidences(results, attempts, parse_batched_confidences(eval_response, pending), aggregate)
+            retried_outputs = await asyncio.gather(*(agents[agent_name].ainvoke(retry_state(state, agent_name, previous)) for agent_name, previous in to_retry.items()))
+            merge_retried(results, attempts, retried_outputs)
+            pending = deferred_agents({agent_name: results[agent_name] for agent_name in to_retry})
+        return {"main_node_output": results, "aggregate": aggregate}
+
+    return RunnableLambda(batched_evaluation, afunc=batched_evaluation_async, name="batched_evaluation")
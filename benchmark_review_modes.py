@@ -0,0 +1,138 @@
+# benchmark_review_modes.py
+# Compares token usage and wall-clock time of the per-agent review path
+# (agent call + evaluator call per agent) against the single-call combined
+# review path and the packed path (one call per agent for several
+# consecutive chunks) on a sample of pending chunks, including tokens per
+# reviewed character. Nothing is written to MongoDB. Early-stop streaming
+# is turned off, so every request reports its token usage.
+import argparse
+import asyncio
+import itertools
+import time
+import llm_streaming
+from langchain_community.callbacks import get_openai_callback
+from llm_init import llm, eval_llm
+from agents import load_agents_from_mongo, available_agents, create_combined_review_node, create_packed_review_node, format_long_text_as_target_chunk, split_chunk_into_lines
+from pdf_processor import iter_pending_chunks_with_context
+from chunk_packing import pack_chunk_windows
+
+BENCHMARK_MODES = ("per_agent", "combined", "packed")
+
+
+def build_benchmark_state(chunk_window: tuple) -> dict:
+    """Minimal graph state for a (previous, target, next) chunk window."""
+    previous_chunk, target_chunk, next_chunk = chunk_window
+    report_text = target_chunk.get("text", "")
+    return {
+        "report_text": report_text,
+        "metadata": {
+            "title": target_chunk.get("doc_name", "Unknown Document"),
+            "chunk_id": target_chunk.get("_id"),
+            "previous_chunk": previous_chunk.get("text", "") if previous_chunk else "",
+            "next_chunk": next_chunk.get("text", "") if next_chunk else "",
+            "formatted_target_chunk": split_chunk_into_lines(format_long_text_as_target_chunk(report_text)),
+        },
+        "main_node_output": {},
+        "aggregate": [],
+    }
+
+
+async def run_per_agent(state: dict):
+    await asyncio.gather(*(agent.ainvoke(state) for agent in available_agents.values()))
+
+
+async def run_combined(state: dict, combined_node):
+    await combined_node.ainvoke(state)
+
+
+async def run_packed(states: list, packed_node):
+    await packed_node.ainvoke(states)
+
+
+# Every measurement runs on this loop: the LLM clients' async connection pools are bound to the first loop they are used on
+benchmark_loop = asyncio.new_event_loop()
+
+
+def measure(label: str, coroutine_factory, reviewed_chars: int, chunks: int = 1) -> dict:
+    with get_openai_callback() as cb:
+        started = time.perf_counter()
+        benchmark_loop.run_until_complete(coroutine_factory())
+        elapsed = time.perf_counter() - started
+    return {
+        "mode": label,
+        "chunks": chunks,
+        "reviewed_chars": reviewed_chars,
+        "seconds": elapsed,
+        "requests": cb.successful_requests,
+        "prompt_tokens": cb.prompt_tokens,
+        "completion_tokens": cb.completion_tokens,
+        "total_tokens": cb.total_tokens,
+    }
+
+
+def print_summary(rows: list):
+    print("\n--- Review Mode Benchmark ---")
+    print(f"{'mode':<10} {'chunks':>6} {'chars':>7} {'requests':>9} {'prompt_tok':>11} {'completion_tok':>15} {'total_tok':>10} {'tok/char':>9} {'seconds':>9}")
+    for mode in BENCHMARK_MODES:
+        mode_rows = [r for r in rows if r["mode"] == mode]
+        if not mode_rows:
+            continue
+        reviewed_chars = sum(r["reviewed_chars"] for r in mode_rows)
+        total_tokens = sum(r["total_tokens"] for r in mode_rows)
+        print(
+            f"{mode:<10} {sum(r['chunks'] for r in mode_rows):>6} "
+            f"{reviewed_chars:>7} "
+            f"{sum(r['requests'] for r in mode_rows):>9} "
+            f"{sum(r['prompt_tokens'] for r in mode_rows):>11} "
+            f"{sum(r['completion_tokens'] for r in mode_rows):>15} "
+            f"{total_tokens:>10} "
+            f"{total_tokens / reviewed_chars if reviewed_chars else 0:>9.2f} "
+            f"{sum(r['seconds'] for r in mode_rows):>9.1f}"
+        )
+    per_agent_tokens = sum(r["total_tokens"] for r in rows if r["mode"] == "per_agent")
+    if per_agent_tokens:
+        for mode in BENCHMARK_MODES[1:]:
+            mode_tokens = sum(r["total_tokens"] for r in rows if r["mode"] == mode)
+            print(f"{mode.capitalize()} mode uses {mode_tokens / per_agent_tokens:.1%} of the per-agent tokens.")
+    print("-" * 40)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-agent vs combined vs packed review on pending chunks.")
+    parser.add_argument("--chunks", type=int, default=5, help="Number of pending chunks to sample.")
+    args = parser.parse_args()
+
+    # Streamed responses, and requests aborted at the end of the JSON object, report no token usage
+    # to get_openai_callback, so the per-agent calls are measured as plain invoke calls
+    llm_streaming.STREAM_EARLY_STOP = False
+
+    load_agents_from_mongo(llm, eval_llm)
+    if not available_agents:
+        print("WARNING: No agents loaded. Nothing to benchmark.")
+        raise SystemExit(1)
+    combined_node = create_combined_review_node(list(available_agents.keys()), llm)
+    packed_node = create_packed_review_node(list(available_agents.keys()), llm)
+
+    rows = []
+    chunk_windows = list(itertools.islice(iter_pending_chunks_with_context(), args.chunks))
+    for chunk_window in chunk_windows:
+        state = build_benchmark_state(chunk_window)
+        reviewed_chars = len(state["report_text"] or "")
+        print(f"\n--- Benchmarking chunk {state['metadata']['chunk_id']} ---")
+        rows.append(measure("per_agent", lambda: run_per_agent(state), reviewed_chars))
+        rows.append(measure("combined", lambda: run_combined(state, combined_node), reviewed_chars))
+        print(rows[-2])
+        print(rows[-1])
+
+    # The same chunks again, consecutive ones packed into one request per agent
+    for pack in pack_chunk_windows(chunk_windows):
+        states = [build_benchmark_state(chunk_window) for chunk_window in pack]
+        reviewed_chars = sum(len(state["report_text"] or "") for state in states)
+        print(f"\n--- Benchmarking pack of {len(states)} chunk(s) starting at {states[0]['metadata']['chunk_id']} ---")
+        rows.append(measure("packed", lambda: run_packed(states, packed_node), reviewed_chars, chunks=len(states)))
+        print(rows[-1])
+
+    if rows:
+        print_summary(rows)
+    else:
+        print("No PENDING chunks found to benchmark.")
@@ -0,0 +1,124 @@
+# calibration_report.py
+# Compares the logprob-derived confidence of agent responses with the
+# evaluator LLM's confidence for the same responses, to decide whether an
+# agent can switch its evaluation_policy to "logprobs". Pairs are collected
+# by running agents with {"mode": "always", "logprobs": true}.
+import argparse
+import os
+import pymongo
+from collections import defaultdict
+from dotenv import load_dotenv
+from config import MONGO_URI, AGENTS_DB_NAME, AGENTS_COLLECTION_NAME
+
+load_dotenv()
+
+RESULTS_DB_NAME = os.getenv("RESULTS_DB_NAME1")
+RESULTS_COLLECTION_NAME = os.getenv("RESULTS_COLLECTION_NAM1")
+
+# Upper bounds of the logprob confidence bins in the per-agent table
+CALIBRATION_BINS = (50, 70, 80, 90, 95, 100)
+
+
+def read_confidence_pairs(agent_name: str = None) -> dict:
+    """{agent name: [(evaluator confidence, logprob confidence), ...]} from saved results."""
+    pairs = defaultdict(list)
+    mongo_client = None
+    try:
+        mongo_client = pymongo.MongoClient(MONGO_URI)
+        results_collection = mongo_client[RESULTS_DB_NAME][RESULTS_COLLECTION_NAME]
+        match = {"agent_responses.evaluation.status": "evaluated", "agent_responses.logprob_confidence.confidence": {"$exists": True}}
+        for doc in results_collection.find(match, {"agent_responses": 1}):
+            for response in doc.get("agent_responses", []):
+                if agent_name and response.get("agent_name") != agent_name:
+                    continue
+                evaluation = response.get("evaluation") or {}
+                logprob_confidence = response.get("logprob_confidence") or {}
+                if evaluation.get("status") != "evaluated" or evaluation.get("parse_error") or "confidence" not in logprob_confidence:
+                    continue
+                pairs[response["agent_name"]].append((response.get("confidence", 0), logprob_confidence["confidence"]))
+    except pymongo.errors.ConnectionFailure as e:
+        print(f"❌ MongoDB connection error while reading results: {e}")
+    finally:
+        if mongo_client:
+            mongo_client.close()
+    return pairs
+
+
+def read_confidence_thresholds() -> dict:
+    """{agent name: confidence_score} from the agents collection."""
+    thresholds = {}
+    mongo_client = None
+    try:
+        mongo_client = pymongo.MongoClient(MONGO_URI)
+        agents_collection = mongo_client[AGENTS_DB_NAME][AGENTS_COLLECTION_NAME]
+        for doc in agents_collection.find({}, {"agent_name": 1, "confidence_score": 1}):
+            if doc.get("agent_name"):
+                thresholds[doc["agent_name"]] = doc.get("confidence_score", 0)
+    except pymongo.errors.ConnectionFailure as e:
+        print(f"❌ MongoDB connection error while reading agents: {e}")
+    finally:
+        if mongo_client:
+            mongo_client.close()
+    return thresholds
+
+
+def pearson(pairs: list):
+    """Pearson correlation of (x, y) pairs, or None if either side is constant."""
+    n = len(pairs)
+    mean_x = sum(x for x, _ in pairs) / n
+    mean_y = sum(y for _, y in pairs) / n
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in pairs)
+    spread_x = sum((x - mean_x) ** 2 for x, _ in pairs) ** 0.5
+    spread_y = sum((y - mean_y) ** 2 for _, y in pairs) ** 0.5
+    if not spread_x or not spread_y:
+        return None
+    return covariance / (spread_x * spread_y)
+
+
+def calibration_summary(pairs: list, threshold: int) -> dict:
+    """Agreement of the two confidences on the pass/fail decision at the agent's threshold."""
+    both_pass = sum(1 for e, l in pairs if e >= threshold and l >= threshold)
+    both_fail = sum(1 for e, l in pairs if e < threshold and l < threshold)
+    return {
+        "pairs": len(pairs),
+        "correlation": pearson(pairs),
+        "mean_abs_diff": sum(abs(e - l) for e, l in pairs) / len(pairs),
+        "decision_agreement": (both_pass + both_fail) / len(pairs),
+        # Accepted by logprobs but rejected by the evaluator: the costly disagreement
+        "logprob_only_pass": sum(1 for e, l in pairs if l >= threshold > e),
+        "evaluator_only_pass": sum(1 for e, l in pairs if e >= threshold > l),
+    }
+
+
+def print_calibration_report(pairs_by_agent: dict, thresholds: dict):
+    print("\n--- Logprob Confidence Calibration ---")
+    if not pairs_by_agent:
+        print("  No responses carry both an evaluator and a logprob confidence.")
+        print('  Set an agent\'s evaluation_policy to {"mode": "always", "logprobs": true} to collect them.')
+    for agent_name, pairs in sorted(pairs_by_agent.items()):
+        threshold = thresholds.get(agent_name, 0)
+        summary = calibration_summary(pairs, threshold)
+        correlation = f"{summary['correlation']:.2f}" if summary["correlation"] is not None else "n/a"
+        print(f"\n  {agent_name} (threshold {threshold}%): {summary['pairs']} pairs, correlation {correlation}, "
+              f"mean |evaluator - logprob| {summary['mean_abs_diff']:.1f}")
+        print(f"    Pass/fail agreement: {summary['decision_agreement']:.1%} "
+              f"(logprob-only pass: {summary['logprob_only_pass']}, evaluator-only pass: {summary['evaluator_only_pass']})")
+        print(f"    {'logprob ≤':>10} {'pairs':>6} {'avg evaluator':>14} {'evaluator pass':>15}")
+        lower = -1
+        for upper in CALIBRATION_BINS:
+            in_bin = [(e, l) for e, l in pairs if lower < l <= upper]
+            lower = upper
+            if not in_bin:
+                continue
+            average = sum(e for e, _ in in_bin) / len(in_bin)
+            passing = sum(1 for e, _ in in_bin if e >= threshold) / len(in_bin)
+            print(f"    {upper:>10} {len(in_bin):>6} {average:>14.1f} {passing:>15.1%}")
+    print("-" * 40)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare logprob-derived confidence with evaluator confidence.")
+    parser.add_argument("--agent", default=None, help="Only report this agent.")
+    args = parser.parse_args()
+
+    print_calibration_report(read_confidence_pairs(args.agent), read_confidence_thresholds())
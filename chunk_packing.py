@@ -0,0 +1,61 @@
+# chunk_packing.py
+# Groups consecutive chunk windows of a book into packs for the "packed"
+# review mode. Pipeline 1 chunks are only ~200 characters, so in a
+# per-chunk request the agent's static prompt outweighs the text under
+# review; a pack sends several target chunks under one prompt instead.
+from typing import Dict, List
+from config import PACK_TOKEN_BUDGET, PACK_MAX_CHUNKS
+from context_trimmer import estimate_tokens
+from agent_output import split_keyed_output, unscored_result
+from llm_metrics import record_llm_event
+
+
+def follows(target_chunk: dict, previous_target: dict) -> bool:
+    """True if target_chunk is the chunk right after previous_target in the same book."""
+    previous_index = previous_target.get("chunk_index")
+    return (
+        target_chunk.get("doc_id") == previous_target.get("doc_id")
+        and isinstance(previous_index, int)
+        and target_chunk.get("chunk_index") == previous_index + 1
+    )
+
+
+def pack_chunk_windows(chunk_windows, token_budget: int = PACK_TOKEN_BUDGET, max_chunks: int = PACK_MAX_CHUNKS):
+    """
+    Yields lists of consecutive (previous, target, next) chunk windows. A pack
+    ends at a new book or a gap in chunk_index, at max_chunks windows, or
+    when the next target chunk would take it past token_budget estimated
+    tokens; a chunk larger than the budget is packed alone.
+    Windows are pulled lazily, so a claiming iterator claims at most one
+    chunk beyond the pack being built.
+    """
+    pack, pack_tokens = [], 0
+    for chunk_window in chunk_windows:
+        target_chunk = chunk_window[1]
+        tokens = estimate_tokens(target_chunk.get("text") or "")
+        if pack and (len(pack) >= max_chunks or pack_tokens + tokens > token_budget or not follows(target_chunk, pack[-1][1])):
+            yield pack
+            pack, pack_tokens = [], 0
+        pack.append(chunk_window)
+        pack_tokens += tokens
+    if pack:
+        yield pack
+
+
+def add_pack_results(updates: List[Dict], agent_name: str, positions: List[int], pack_texts: List[tuple], raw_output: str, usage: dict):
+    """
+    Splits agent_name's response for a pack (one output per chunk id) into the
+    main_node_output entries of updates[position] for each chunk of the pack.
+    pack_texts holds (chunk id, texts the chunk's quotes are checked against)
+    in pack order; positions are the chunks' indexes in updates.
+    """
+    chunk_ids = [chunk_id for chunk_id, _ in pack_texts]
+    per_chunk = split_keyed_output(raw_output, chunk_ids, f"packed review by '{agent_name}'")
+    record_llm_event("packed_requests")
+    record_llm_event("packed_chunks", len(pack_texts))
+    for pack_position, (position, (chunk_id, chunk_texts)) in enumerate(zip(positions, pack_texts)):
+        entry = unscored_result(per_chunk[chunk_id], chunk_texts, "packed")
+        entry["pack"] = {"chunks": len(pack_texts), "position": pack_position}
+        updates[position]["main_node_output"][agent_name] = entry
+        updates[position]["aggregate"].append(f"{agent_name} Output: {entry['output']} (Packed review, Human Review: {entry['human_review']})")
+    print(f"--- Packed review by {agent_name} of {len(pack_texts)} chunk(s) used {usage['total_tokens']} tokens ---")
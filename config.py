@@ -21,4 +21,150 @@ PDF_COLLECTION_NAME = "chunks" # This is the collection name Pipeline 1 uses for
 CHROMA_DB_DIRECTORY = "chrome_dB"
 
 # Replace with your actual API keys
-GROQ_API_KEY = os.getenv("GROQ_API_KEY1")
\ No newline at end of file
+GROQ_API_KEY = os.getenv("GROQ_API_KEY1")
+
+# --- Workflow Concurrency ---
+# Number of chunks kept inside the compiled graph at once (1 = sequential).
+MAX_INFLIGHT_CHUNKS = int(os.getenv("MAX_INFLIGHT_CHUNKS", "1"))
+
+# --- Deadlines ---
+# Timeout of a single LLM request (client-side; the request is abandoned and vLLM aborts it).
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", "120"))
+# Client-level retries after a timeout or connection error (each retry gets the full timeout again).
+LLM_CLIENT_MAX_RETRIES = int(os.getenv("LLM_CLIENT_MAX_RETRIES", "1"))
+# Per-chunk review deadline: agents still running then are cancelled and marked as transient
+# failures, and the chunk is saved with the agents that finished (0 = no deadline).
+# Keep it below CHUNK_LEASE_SECONDS.
+CHUNK_DEADLINE_SECONDS = float(os.getenv("CHUNK_DEADLINE_SECONDS", "600"))
+
+# --- Hedged Requests (opt-in) ---
+# A call still running after the HEDGE_PERCENTILE latency of its prompt-length bucket is sent
+# again (to HEDGE_LLM_BASE_URL if set); the first response wins, the other request is cancelled.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+# Upper bound of hedges as a share of all calls.
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))
+# Latencies a bucket needs before its calls are hedged.
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+# --- Chunk Claiming (multi-worker) ---
+# How long a worker's claim on a chunk stays valid before the reaper returns it to pending.
+CHUNK_LEASE_SECONDS = int(os.getenv("CHUNK_LEASE_SECONDS", "900"))
+# How often a worker renews the leases of the chunks it holds (queued or under review).
+CHUNK_LEASE_RENEW_SECONDS = float(os.getenv("CHUNK_LEASE_RENEW_SECONDS", str(CHUNK_LEASE_SECONDS / 3)))
+
+# --- Daemon (serve/watch) Mode ---
+# Polling interval used when change streams are unavailable (standalone MongoDB).
+WATCH_POLL_SECONDS = float(os.getenv("WATCH_POLL_SECONDS", "5"))
+# Upper bound between drains, so expired leases are reaped and backed-off chunks retried.
+WATCH_HEARTBEAT_SECONDS = float(os.getenv("WATCH_HEARTBEAT_SECONDS", "60"))
+# A chunk written back as "Pending" is not retried by the daemon until this many seconds later.
+PENDING_RETRY_BACKOFF_SECONDS = float(os.getenv("PENDING_RETRY_BACKOFF_SECONDS", "300"))
+
+# --- Pending Chunk Streaming ---
+# Number of chunks read per query when streaming a book with its sliding-window context.
+CONTEXT_STREAM_BATCH_SIZE = int(os.getenv("CONTEXT_STREAM_BATCH_SIZE", "200"))
+
+# --- Staged Pipeline (classify → prepare → review → persist) ---
+# Zero-shot classifier workers; keep at 1 unless the classifier is safe to share across threads.
+CLASSIFY_WORKERS = int(os.getenv("CLASSIFY_WORKERS", "1"))
+# Workers writing results and status updates to MongoDB.
+PERSIST_WORKERS = int(os.getenv("PERSIST_WORKERS", "2"))
+# Capacity of each queue between stages (lowered when claiming, so queued chunks are reviewed within their lease).
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", "8"))
+# Print per-stage queue-depth stats this often while draining (0 = only at the end).
+STAGE_STATS_INTERVAL_SECONDS = float(os.getenv("STAGE_STATS_INTERVAL_SECONDS", "60"))
+
+# --- Review Mode ---
+# "per_agent": one agent call + evaluator call per agent; "combined": one call covering every agent's rubric;
+# "batched_eval": one call per agent, then one evaluator call scoring every agent's response for the chunk;
+# "packed": one call per agent reviewing several consecutive short chunks of a book (see chunk_packing.py).
+REVIEW_MODE = os.getenv("REVIEW_MODE", "per_agent")
+
+# --- Packed Review Mode ---
+# Estimated tokens of target-chunk text packed into one agent request (~4 chars/token).
+PACK_TOKEN_BUDGET = int(os.getenv("PACK_TOKEN_BUDGET", "600"))
+# Most chunks packed into one agent request.
+PACK_MAX_CHUNKS = int(os.getenv("PACK_MAX_CHUNKS", "8"))
+
+# --- vLLM Prefix Caching ---
+# "system_prefix": static per-agent prompt as the system message, chunk inputs as a short user message.
+# "single": the whole prompt as one user message (the previous layout, kept for comparison).
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "system_prefix")
+# Prime vLLM's prefix cache with every agent's static prefix at startup.
+PREFIX_CACHE_WARMUP = os.getenv("PREFIX_CACHE_WARMUP", "true").lower() in ("1", "true", "yes")
+# vLLM's Prometheus endpoint (served at the server root, not under /v1).
+VLLM_METRICS_URL = os.getenv("VLLM_METRICS_URL", "http://192.168.18.100:8000/metrics")
+
+# --- Structured Output ---
+# Pass the agent and evaluator JSON schemas to the OpenAI-compatible endpoint
+# (response_format json_schema, enforced by vLLM's guided decoding).
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "false").lower() in ("1", "true", "yes")
+
+# --- Streaming / Response Length Caps ---
+# Stream agent and evaluator responses and stop as soon as the JSON object is complete.
+STREAM_EARLY_STOP = os.getenv("STREAM_EARLY_STOP", "true").lower() in ("1", "true", "yes")
+# Per-agent max_tokens = percentile of observed response lengths x headroom (not below the floor),
+# applied once enough responses have been observed.
+MAX_TOKENS_MIN_SAMPLES = int(os.getenv("MAX_TOKENS_MIN_SAMPLES", "20"))
+MAX_TOKENS_PERCENTILE = float(os.getenv("MAX_TOKENS_PERCENTILE", "0.99"))
+MAX_TOKENS_HEADROOM = float(os.getenv("MAX_TOKENS_HEADROOM", "1.5"))
+MAX_TOKENS_FLOOR = int(os.getenv("MAX_TOKENS_FLOOR", "256"))
+
+# --- Context Trimming ---
+# Characters per Pipeline 1 chunk (CHUNK_SIZE in MongoDatabase_for_pdf.py).
+PIPELINE1_CHUNK_SIZE = int(os.getenv("PIPELINE1_CHUNK_SIZE", "200"))
+# Token budget shared by the previous and next context chunks in every agent prompt
+# (sentences nearest the target chunk are kept). 0 disables trimming.
+# The default is one chunk's worth (~4 chars/token), so about half of each neighbour is
+# kept: ~50 of the ~100 tokens of context around a 200-character chunk.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", str(PIPELINE1_CHUNK_SIZE // 4)))
+
+# --- Agent Hot Reload ---
+# Watch the agents collection and rebuild the graph between chunks when agents change.
+AGENT_HOT_RELOAD = os.getenv("AGENT_HOT_RELOAD", "true").lower() in ("1", "true", "yes")
+# Polling interval when change streams are unavailable.
+AGENT_REGISTRY_POLL_SECONDS = float(os.getenv("AGENT_REGISTRY_POLL_SECONDS", "15"))
+
+# --- Model Cascade ---
+# Agents without a "cascade" field in their document use the screening model first only if this is true
+# (the screening model itself is configured in llm_init via SCREEN_LLM_BASE_URL / SCREEN_LLM_MODEL).
+CASCADE_ENABLED_BY_DEFAULT = os.getenv("CASCADE_ENABLED_BY_DEFAULT", "false").lower() in ("1", "true", "yes")
+# A benign screening verdict reporting a confidence below this (0-1) is escalated to the main model.
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.75"))
+
+# --- Self-Consistency Sampling ---
+# Default number of samples requested in one completion call (n) for agents without a
+# "self_consistency" field; 1 disables it. The agreement ratio replaces the evaluator's confidence.
+SELF_CONSISTENCY_SAMPLES = int(os.getenv("SELF_CONSISTENCY_SAMPLES", "1"))
+SELF_CONSISTENCY_TEMPERATURE = float(os.getenv("SELF_CONSISTENCY_TEMPERATURE", "0.7"))
+# How the spans of the majority samples are merged: "union" or "intersection".
+SELF_CONSISTENCY_SPANS = os.getenv("SELF_CONSISTENCY_SPANS", "union")
+
+# --- Local Output Validation ---
+# Deterministic checks of every parsed agent output before the evaluator is called
+# (see output_validator.py). Hard failures are retried with a repair prompt.
+OUTPUT_VALIDATION = os.getenv("OUTPUT_VALIDATION", "true").lower() in ("1", "true", "yes")
+# Length limits from the prompt's output format; exceeding them is only a warning.
+OBSERVATION_MAX_WORDS = int(os.getenv("OBSERVATION_MAX_WORDS", "40"))
+QUOTE_MAX_WORDS = int(os.getenv("QUOTE_MAX_WORDS", "50"))
+# What the evaluation policy does with outputs that pass validation, for agents without an
+# "on_valid" setting: "evaluate" (unchanged), "short" (shorter evaluator prompt) or "skip".
+EVALUATION_ON_VALID = os.getenv("EVALUATION_ON_VALID", "evaluate")
+
+# --- Retry Budgets ---
+# Retries allowed per agent and chunk for each cause, so a failure only repeats the step that failed.
+# Unparseable agent output or failed local validation: the agent is re-run with a repair prompt.
+RETRY_BUDGET_AGENT_INVALID = int(os.getenv("RETRY_BUDGET_AGENT_INVALID", "2"))
+# Unparseable evaluator reply: only the evaluator call is repeated, the agent output is kept.
+RETRY_BUDGET_EVALUATOR_INVALID = int(os.getenv("RETRY_BUDGET_EVALUATOR_INVALID", "2"))
+# Evaluator confidence below the agent's confidence_score: the agent is re-run.
+RETRY_BUDGET_LOW_CONFIDENCE = int(os.getenv("RETRY_BUDGET_LOW_CONFIDENCE", "2"))
+
+# --- Retry Strategies ---
+# How low-confidence retries differ from the previous attempt, for agents without a
+# "retry_strategy" field (see retry_strategies.py): resample, critique, strict_schema.
+RETRY_STRATEGY_SEQUENCE = [s.strip() for s in os.getenv("RETRY_STRATEGY_SEQUENCE", "resample,critique,strict_schema").split(",") if s.strip()]
+# resample raises the temperature by this much per retry, up to RETRY_MAX_TEMPERATURE.
+RETRY_TEMPERATURE_STEP = float(os.getenv("RETRY_TEMPERATURE_STEP", "0.3"))
+RETRY_MAX_TEMPERATURE = float(os.getenv("RETRY_MAX_TEMPERATURE", "1.0"))
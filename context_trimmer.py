@@ -0,0 +1,80 @@
+# context_trimmer.py
+# Trims the previous/next context chunks to the sentences nearest the target
+# chunk, under a token budget. The prompt's Context Rule only uses them to
+# resolve references, so the rest of their text is prefill cost for nothing.
+import math
+import re
+
+# Rough token estimate for English prose with a BPE tokenizer (~4 characters per token).
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def split_sentences(text: str) -> list:
+    return [s for s in re.split(r'(?<=[.!?])\s+', (text or "").strip()) if s]
+
+
+def _keep_nearest(sentences: list, budget_tokens: int, from_end: bool) -> str:
+    """
+    Keeps whole sentences nearest the boundary (the end of the previous chunk,
+    the start of the next chunk) while they fit the budget. If even the
+    nearest sentence does not fit, its words nearest the boundary are kept.
+    """
+    ordered = list(reversed(sentences)) if from_end else list(sentences)
+    kept, used = [], 0
+    for sentence in ordered:
+        cost = estimate_tokens(sentence) + (1 if kept else 0)
+        if used + cost > budget_tokens:
+            if not kept and budget_tokens > 0:
+                words = sentence.split()
+                max_chars = budget_tokens * CHARS_PER_TOKEN
+                partial = []
+                for word in (reversed(words) if from_end else words):
+                    if len(" ".join(partial + [word])) > max_chars:
+                        break
+                    partial.append(word)
+                kept.append(" ".join(reversed(partial) if from_end else partial))
+            break
+        kept.append(sentence)
+        used += cost
+    if from_end:
+        kept.reverse()
+    return " ".join(kept)
+
+
+def trim_context(previous_chunk: str, next_chunk: str, budget_tokens: int):
+    """
+    Trims previous_chunk (keeping its last sentences) and next_chunk (keeping
+    its first sentences) so together they fit budget_tokens. Each side gets
+    half the budget; a side that needs less leaves the rest to the other.
+    A budget <= 0 disables trimming.
+    Returns (previous_chunk, next_chunk, stats).
+    """
+    previous_chunk, next_chunk = previous_chunk or "", next_chunk or ""
+    original_tokens = estimate_tokens(previous_chunk) + estimate_tokens(next_chunk)
+    if budget_tokens <= 0 or original_tokens <= budget_tokens:
+        return previous_chunk, next_chunk, {
+            "budget_tokens": budget_tokens,
+            "original_tokens": original_tokens,
+            "trimmed_tokens": original_tokens,
+            "tokens_saved": 0,
+        }
+
+    half = budget_tokens // 2
+    previous_budget = max(half, budget_tokens - estimate_tokens(next_chunk))
+    previous_trimmed = _keep_nearest(split_sentences(previous_chunk), previous_budget, from_end=True)
+    next_budget = budget_tokens - estimate_tokens(previous_trimmed)
+    next_trimmed = _keep_nearest(split_sentences(next_chunk), next_budget, from_end=False)
+
+    trimmed_tokens = estimate_tokens(previous_trimmed) + estimate_tokens(next_trimmed)
+    return previous_trimmed, next_trimmed, {
+        "budget_tokens": budget_tokens,
+        "original_tokens": original_tokens,
+        "trimmed_tokens": trimmed_tokens,
+        "tokens_saved": original_tokens - trimmed_tokens,
+        "previous_chars": [len(previous_chunk), len(previous_trimmed)],
+        "next_chars": [len(next_chunk), len(next_trimmed)],
+    }
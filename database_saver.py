@@ -36,6 +36,22 @@ def clear_results_collection():
         if mongo_client:
             mongo_client.close()
 
+def ensure_results_indexes():
+    """Creates the Chunk_ID index that save_results_to_mongo upserts on. Safe to call on every startup."""
+    mongo_client = None
+    try:
+        mongo_client = pymongo.MongoClient(MONGO_URI)
+        results_collection = mongo_client[RESULTS_DB_NAME][RESULTS_COLLECTION_NAME]
+        results_collection.create_index([("Chunk_ID", pymongo.ASCENDING)], name="chunk_id")
+        print(f"✅ Results index ensured on '{RESULTS_DB_NAME}.{RESULTS_COLLECTION_NAME}'.")
+    except pymongo.errors.ConnectionFailure as e:
+        print(f"❌ MongoDB connection error when creating the results index: {e}")
+    except Exception as e:
+        print(f"❌ An unexpected error occurred when creating the results index: {e}")
+    finally:
+        if mongo_client:
+            mongo_client.close()
+
 # -----------------------------
 # 2️⃣ Save Results to MongoDB
 # -----------------------------
@@ -72,6 +88,7 @@ def save_results_to_mongo(
             "Predicted Label": predicted_label,
             "Predicted Label Confidence": classification_scores.get(predicted_label, 0.0),
             "overall_status": overall_chunk_status,
+            "context_trim": result_with_review.get("metadata", {}).get("context_trim"),
             "agent_responses": [] # New array to hold agent response documents
         }
 
@@ -86,13 +103,24 @@ def save_results_to_mongo(
                 "response_content": output_content,
                 "confidence": agent_data.get("confidence", 0),
                 "retries": agent_data.get("retries", 0),
+                "retry_counts": agent_data.get("retry_counts"),
+                "retry_strategy": agent_data.get("retry_strategy"),
+                "transient_failure": agent_data.get("transient_failure", False),
                 "human_review": agent_data.get("human_review", False),
+                "evaluation": agent_data.get("evaluation"),
+                "analysis_status": agent_analysis_statuses.get(agent_name),
+                "relevance": agent_data.get("relevance"),
+                "cascade": agent_data.get("cascade"),
+                "self_consistency": agent_data.get("self_consistency"),
+                "logprob_confidence": agent_data.get("logprob_confidence"),
+                "validation": agent_data.get("validation"),
                 "timestamp": datetime.now()
             }
             
             result_document["agent_responses"].append(agent_response_doc)
 
-        results_collection.insert_one(result_document)
+        # One result document per chunk: a chunk reviewed again (or saved twice) replaces its earlier result
+        results_collection.replace_one({"Chunk_ID": chunk_uuid}, result_document, upsert=True)
         print(f"✅ Merged results for chunk '{chunk_uuid}' saved to MongoDB in '{RESULTS_DB_NAME}.{RESULTS_COLLECTION_NAME}'.")
 
     except pymongo.errors.ConnectionFailure as e:
@@ -106,7 +134,7 @@ def save_results_to_mongo(
 # -----------------------------
 # 3️⃣ Update Chunk Analysis Status
 # -----------------------------
-def update_chunk_analysis_status(doc_id: str, chunk_id: str, analysis_status: str):
+def update_chunk_analysis_status(doc_id: str, chunk_id: str, analysis_status: str, worker_id: str = None):
     mongo_client = None
     try:
         mongo_client = pymongo.MongoClient(MONGO_URI)
@@ -114,10 +142,14 @@ def update_chunk_analysis_status(doc_id: str, chunk_id: str, analysis_status: st
         chunks_collection = p1_db[PDF_COLLECTION_NAME]
 
         # Use ObjectId to query by MongoDB's unique _id field
-        update_result = chunks_collection.update_one(
-            {"doc_id": doc_id, "_id": ObjectId(chunk_id)},
-            {"$set": {"analysis_status": analysis_status}}
-        )
+        query = {"doc_id": doc_id, "_id": ObjectId(chunk_id)}
+        update = {"$set": {"analysis_status": analysis_status}}
+        if worker_id:
+            # Claimed chunk: only the worker holding the lease may finish it, and the lease is cleared.
+            query["claimed_by"] = worker_id
+            update["$unset"] = {"claimed_by": "", "claimed_at": "", "lease_expires_at": ""}
+
+        update_result = chunks_collection.update_one(query, update)
 
         if update_result.matched_count > 0:
             print(f"✅ Chunk '{chunk_id}' in document '{doc_id}' updated to '{analysis_status}'.")
@@ -1,8 +1,12 @@
+import contextvars
+import hashlib
 import sys
 from pymongo import MongoClient
 from dotenv import load_dotenv
 import os
 import json 
+import threading
+import time
 
 # Set UTF-8 for stdout
 sys.stdout.reconfigure(encoding='utf-8')
@@ -12,6 +16,8 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB_NAME = os.getenv("MONGO_DB_Agent")
 MONGO_COLLECTION_NAME = os.getenv("MONGO_COLLECTION_Agent")
+# How often a cached agent template re-checks the agent document's version in MongoDB.
+PROMPT_CACHE_CHECK_SECONDS = float(os.getenv("PROMPT_CACHE_CHECK_SECONDS", "30"))
 
 def get_content_from_field(doc, field_name):
     """
@@ -55,30 +61,221 @@ def get_content_from_field(doc, field_name):
     return None
 
 
-def build_prompt(agent_name, title, target_chunk, previous_chunk="", next_chunk="", db_name=None, collection_name=None):
+# --- Hardcoded Section ---
+EVIDENCE_MAPPING_BLOCK = """
+---
+
+###  **Evidence & Mapping Requirements**
+
+If flagged, quote **minimal text spans (≤ 50 words)** from **Target Chunk only**.
+Each must include a **recommendation** and **confidence** score.
+
+---
+
+###  **Output Format**
+
+```json
+{
+  "issues_found": "true|false|human",
+  "observation": "≤2 sentences (≤40 tokens). Summarize division type or province issue.",
+  "spans": [
+    {
+      "quote": "exact problematic text (≤50 words)",
+      "recommendation": "delete|rephrase|fact-check|provide-references",
+      "confidence": 0.25|0.5|0.75|1.0
+    }
+  ]
+}
+Use an empty spans array if "issues_found" = "false" or "human".
+No commentary outside JSON.
+
+###  **Context Rule**
+
+Focus only on the **Target Chunk**; use *preceding* and *next* chunks solely to resolve ambiguous references (e.g., “they,” “the province,” etc.).
+Never infer intent beyond textual evidence.
+
+---
+
+"""
+
+
+# --- Agent Template Cache ---
+# One MongoClient per process (it pools connections and is thread-safe),
+# and one compiled template per agent: the fetched document, its rendered
+# sections and the static prefix. A template is reused until the fields the
+# prompts are rendered from change (checked at most every
+# PROMPT_CACHE_CHECK_SECONDS) or reload_prompt_templates() is called, so a
+# chunk only pays for substituting its own inputs. The fields themselves are
+# compared because edits to them (e.g. $set/$push on user_policy_guidance)
+# do not bump the document's version or updated_at.
+#
+# A chunk's review pins its templates (pin_prompt_templates): every prompt of
+# the chunk uses the template its agent had when first used in the chunk, or
+# the one in the agent registry's snapshot, even if the cache is refreshed or
+# cleared meanwhile. The pin is a context variable, so it follows the chunk
+# into asyncio tasks, asyncio.to_thread and LangGraph's worker threads.
+_mongo_client = None
+_template_cache = {}
+_cache_lock = threading.Lock()
+_pinned_templates = contextvars.ContextVar("pinned_prompt_templates", default=None)
+
+
+def _get_agent_collection(db_name, collection_name):
+    global _mongo_client
+    with _cache_lock:
+        if _mongo_client is None:
+            client = MongoClient(MONGO_URI)
+            client.admin.command('ismaster')
+            _mongo_client = client
+    return _mongo_client[db_name][collection_name]
+
+
+# Agent document fields read by render_agent_sections and summarize_agent_rubric
+PROMPT_FIELDS = (
+    "system_prompt", "primary_objective", "knowledge_base", "user_knowledgebase",
+    "user_policy_guidance", "automatic_policy_actions", "do_not_flag", "criteria",
+)
+
+
+def _prompt_fingerprint(doc):
+    """Hash of the fields an agent's prompts are rendered from."""
+    fields = {field: doc.get(field) for field in PROMPT_FIELDS}
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def reload_prompt_templates(agent_name=None):
+    """Drops the cached template of agent_name (or of every agent), forcing a re-fetch on next use."""
+    with _cache_lock:
+        if agent_name is None:
+            _template_cache.clear()
+        else:
+            for key in [key for key in _template_cache if key[2] == agent_name]:
+                del _template_cache[key]
+
+
+def pin_prompt_templates(templates=None):
     """
-    Fetches and returns the seven required fields from the MongoDB document:
-    system_prompt, primary_objective, knowledge_base, user_policy_guidance,
-    user_knowledgebase, automatic_policy_actions, and do_not_flag.
-    Then appends a hardcoded section for Evidence & Mapping Requirements.
+    Pins prompt templates for the current context (one chunk's review),
+    starting from templates (a snapshot_prompt_templates() result) if given.
+    Returns the token for unpin_prompt_templates.
     """
-    db_name = db_name or MONGO_DB_NAME
-    collection_name = collection_name or MONGO_COLLECTION_NAME
+    return _pinned_templates.set(dict(templates or {}))
+
 
+def unpin_prompt_templates(token):
     try:
-        client = MongoClient(MONGO_URI)
-        client.admin.command('ismaster')
-    except Exception as e:
-        return f"❌ Error connecting to MongoDB: {e}"
+        _pinned_templates.reset(token)
+    except ValueError:
+        # An async generator finalized in another context; that context ends with it
+        pass
+
 
-    db = client[db_name]
-    collection = db[collection_name]
+def snapshot_prompt_templates(agent_names, db_name=None, collection_name=None):
+    """The current templates of agent_names, for pin_prompt_templates (agents that fail to load are left out)."""
+    snapshot = {}
+    for agent_name in agent_names:
+        template, error = _cached_agent_template(agent_name, db_name, collection_name)
+        if error:
+            print(f"⚠️ Prompt template of '{agent_name}' not snapshotted: {error}")
+            continue
+        snapshot[(db_name or MONGO_DB_NAME, collection_name or MONGO_COLLECTION_NAME, agent_name)] = template
+    return snapshot
 
-    # Fetch single agent document
-    doc = collection.find_one({"agent_name": agent_name})
+
+def _fetch_agent_document_uncached(agent_name, db_name, collection_name):
+    try:
+        collection = _get_agent_collection(db_name, collection_name)
+        # Fetch single agent document
+        doc = collection.find_one({"agent_name": agent_name})
+    except Exception as e:
+        return None, f"❌ Error connecting to MongoDB: {e}"
     if not doc:
-        return f"❌ No agent found with name: {agent_name}"
+        return None, f"❌ No agent found with name: {agent_name}"
+    return doc, None
+
+
+def _template_is_current(entry, agent_name, db_name, collection_name):
+    """Re-checks a cached template against MongoDB; only the prompt fields are read."""
+    collection = _get_agent_collection(db_name, collection_name)
+    current = collection.find_one({"agent_name": agent_name}, {field: 1 for field in PROMPT_FIELDS})
+    return current is not None and _prompt_fingerprint(current) == entry["fingerprint"]
 
+
+def get_agent_template(agent_name, db_name=None, collection_name=None):
+    """
+    Returns (template, error_message). template is a dict with the agent
+    document ("doc"), its rendered sections ("sections") and its static
+    prompt prefix ("prefix"), served from the templates pinned for the
+    current chunk, else from the process-wide cache.
+    """
+    pinned = _pinned_templates.get()
+    if pinned is None:
+        return _cached_agent_template(agent_name, db_name, collection_name)
+    key = (db_name or MONGO_DB_NAME, collection_name or MONGO_COLLECTION_NAME, agent_name)
+    if key not in pinned:
+        template, error = _cached_agent_template(agent_name, db_name, collection_name)
+        if error:
+            return None, error
+        pinned[key] = template
+    return pinned[key], None
+
+
+def _cached_agent_template(agent_name, db_name=None, collection_name=None):
+    db_name = db_name or MONGO_DB_NAME
+    collection_name = collection_name or MONGO_COLLECTION_NAME
+    key = (db_name, collection_name, agent_name)
+
+    with _cache_lock:
+        entry = _template_cache.get(key)
+    now = time.monotonic()
+    if entry is not None:
+        if now - entry["checked_at"] < PROMPT_CACHE_CHECK_SECONDS:
+            return entry, None
+        try:
+            if _template_is_current(entry, agent_name, db_name, collection_name):
+                entry["checked_at"] = now
+                return entry, None
+            print(f"🔄 Agent '{agent_name}' changed in MongoDB. Rebuilding its prompt template.")
+        except Exception as e:
+            # Keep serving the cached template if MongoDB is briefly unreachable
+            print(f"⚠️ Could not re-check prompt template for '{agent_name}': {e}")
+            return entry, None
+
+    doc, error = _fetch_agent_document_uncached(agent_name, db_name, collection_name)
+    if error:
+        return None, error
+
+    sections = render_agent_sections(doc)
+    entry = {
+        "doc": doc,
+        "fingerprint": _prompt_fingerprint(doc),
+        "sections": sections,
+        "prefix": "\n\n".join(sections + [EVIDENCE_MAPPING_BLOCK]),
+        "checked_at": now,
+    }
+    with _cache_lock:
+        _template_cache[key] = entry
+    return entry, None
+
+
+def fetch_agent_document(agent_name, db_name=None, collection_name=None):
+    """
+    Fetches an agent's document from MongoDB (through the template cache).
+    Returns (doc, error_message); doc is None if it could not be fetched.
+    """
+    template, error = get_agent_template(agent_name, db_name, collection_name)
+    if error:
+        return None, error
+    return template["doc"], None
+
+
+def render_agent_sections(doc):
+    """
+    Renders the seven agent-specific sections of the prompt (system_prompt,
+    primary_objective, knowledge_base, user_knowledgebase, user_policy_guidance,
+    automatic_policy_actions, do_not_flag) from an agent document.
+    Returns the list of rendered parts.
+    """
     parts = []
 
     # 1. System Prompt
@@ -113,32 +310,137 @@ def build_prompt(agent_name, title, target_chunk, previous_chunk="", next_chunk=
     if do_not_flag:
         parts.append("\n## Do Not Flag / Exemption List\n------------------------------\n" + do_not_flag)
 
-    # --- Hardcoded Section ---
-    evidence_mapping_block = """
----
+    return parts
 
-###  **Evidence & Mapping Requirements**
 
-If flagged, quote **minimal text spans (≤ 50 words)** from **Target Chunk only**.
-Each must include a **recommendation** and **confidence** score.
+def render_inputs_section(title, target_chunk, previous_chunk="", next_chunk="", closing="Return **only** the JSON above — no commentary."):
+    """Renders the per-chunk Inputs section shared by all prompt layouts."""
+    return f"""## Inputs
+
+* Book Title: {title}
+* **Previous_chunk (context only; do not quote if absent in Target Chunk):** {previous_chunk}
+* **Target_chunk (review focus):** {target_chunk}
+* **Next_chunk (context only; do not quote if absent in Target Chunk):** {next_chunk}
+
+{closing}
+"""
+
 
+def build_static_prefix(agent_name, db_name=None, collection_name=None):
+    """
+    Renders the part of an agent's prompt that is the same for every chunk:
+    the seven agent sections followed by the Evidence & Mapping block.
+    For a given agent document the output is byte-identical on every call,
+    so vLLM's automatic prefix caching can reuse its KV cache across chunks.
+    Returns (prefix, error_message).
+    """
+    template, error = get_agent_template(agent_name, db_name, collection_name)
+    if error:
+        return None, error
+    return template["prefix"], None
+
+
+def build_prompt_messages(agent_name, title, target_chunk, previous_chunk="", next_chunk="", db_name=None, collection_name=None):
+    """
+    Splits an agent's prompt into (system_prompt, user_prompt): the static
+    per-agent prefix (sent as the system message) and the short per-chunk
+    Inputs section. If the agent document cannot be fetched, system_prompt
+    is the error message, as with build_prompt.
+    """
+    prefix, error = build_static_prefix(agent_name, db_name, collection_name)
+    return (error if error else prefix), render_inputs_section(title, target_chunk, previous_chunk, next_chunk)
+
+
+def render_packed_inputs_section(title, target_chunks, previous_chunk="", next_chunk=""):
+    """
+    Renders the Inputs section of a packed prompt: several consecutive Target
+    Chunks, each under its chunk id. target_chunks is a list of
+    (chunk_id, formatted chunk text) pairs in book order.
+    """
+    chunk_lines = "\n".join(f"* **Target_chunk `{chunk_id}` (review focus):** {text}" for chunk_id, text in target_chunks)
+    example_keys = ",\n".join(f'  "{chunk_id}": {{...JSON object in the Output Format above...}}' for chunk_id, _ in target_chunks)
+    return f"""## Inputs
+
+* Book Title: {title}
+* **Previous_chunk (context only; do not quote if absent in Target Chunk):** {previous_chunk}
+{chunk_lines}
+* **Next_chunk (context only; do not quote if absent in Target Chunk):** {next_chunk}
+
+Review each Target Chunk separately, as if it were the only one: quote spans from that chunk only and use the other Target Chunks as context.
+Return **only** one JSON object with one key per chunk id, spelled exactly as below, each value in the Output Format above — no commentary.
+
+```json
+{{
+{example_keys}
+}}
+```
+"""
+
+
+def build_packed_prompt_messages(agent_name, title, target_chunks, previous_chunk="", next_chunk="", db_name=None, collection_name=None):
+    """
+    (system_prompt, user_prompt) for reviewing several consecutive chunks in
+    one request. The system prompt is the agent's usual static prefix, so
+    packed and single-chunk requests share vLLM's cached prefix.
+    """
+    prefix, error = build_static_prefix(agent_name, db_name, collection_name)
+    return (error if error else prefix), render_packed_inputs_section(title, target_chunks, previous_chunk, next_chunk)
+
+
+def build_prompt(agent_name, title, target_chunk, previous_chunk="", next_chunk="", db_name=None, collection_name=None):
+    """
+    Fetches and returns the seven required fields from the MongoDB document:
+    system_prompt, primary_objective, knowledge_base, user_policy_guidance,
+    user_knowledgebase, automatic_policy_actions, and do_not_flag.
+    Then appends a hardcoded section for Evidence & Mapping Requirements.
+    """
+    prefix, error = build_static_prefix(agent_name, db_name, collection_name)
+    if error:
+        return error
+
+    return prefix + "\n\n" + render_inputs_section(title, target_chunk, previous_chunk, next_chunk)
+
+
+def build_combined_prompt(agent_names, title, target_chunk, previous_chunk="", next_chunk="", db_name=None, collection_name=None):
+    """
+    Builds one prompt that carries the rubric of every agent in agent_names and
+    the chunk inputs once. The model must answer with a single JSON object
+    keyed by agent_name, one review per agent.
+    """
+    parts = [
+        "You are a panel of independent policy reviewers. Each reviewer below has its own rubric. "
+        "Apply every rubric separately to the same Target Chunk; never let one reviewer's rules influence another's verdict."
+    ]
+
+    for agent_name in agent_names:
+        template, error = get_agent_template(agent_name, db_name, collection_name)
+        if error:
+            return error
+        parts.append(f"\n# ===== Reviewer: {agent_name} =====")
+        parts.extend(template["sections"])
+
+    example_keys = ",\n".join(
+        f'  "{agent_name}": {{"chunk_flagged": "true|false|human", "observation": "...", "spans": [{{"quote": "..."}}], "recommendation": "delete|rephrase|fact-check|provide-references", "confidence": 0.25|0.5|0.75|1.0}}'
+        for agent_name in agent_names
+    )
+    parts.append(f"""
 ---
 
+###  **Evidence & Mapping Requirements (all reviewers)**
+
+If a reviewer flags the chunk, quote **minimal text spans (≤ 50 words)** from **Target Chunk only**.
+Each reviewer's "observation" is ≤2 sentences (≤40 tokens).
+Use an empty spans array if "chunk_flagged" = "false" or "human".
+
 ###  **Output Format**
 
+Return exactly one JSON object with one key per reviewer, spelled exactly as below:
+
 ```json
-{
-  "issues_found": "true|false|human",
-  "observation": "≤2 sentences (≤40 tokens). Summarize division type or province issue.",
-  "spans": [
-    {
-      "quote": "exact problematic text (≤50 words)",
-      "recommendation": "delete|rephrase|fact-check|provide-references",
-      "confidence": 0.25|0.5|0.75|1.0
-    }
-  ]
-}
-Use an empty spans array if "issues_found" = "false" or "human".
+{{
+{example_keys}
+}}
+```
 No commentary outside JSON.
 
 ###  **Context Rule**
@@ -147,20 +449,58 @@ Focus only on the **Target Chunk**; use *preceding* and *next* chunks solely to
 Never infer intent beyond textual evidence.
 
 ---
+""")
+    parts.append(render_inputs_section(
+        title, target_chunk, previous_chunk, next_chunk,
+        closing="Return **only** the JSON object keyed by reviewer name — no commentary."
+    ))
 
-"""
-    parts.append(evidence_mapping_block)
+    return "\n\n".join(parts)
 
-    inputs_section = f"""## Inputs
+def summarize_agent_rubric(doc):
+    """Short rubric of an agent for the evaluator: its criteria, or its primary objective if it has none."""
+    return get_content_from_field(doc, "criteria") or get_content_from_field(doc, "primary_objective") or "❌ RUBRIC MISSING"
 
-* Book Title: {title}
-* **Previous_chunk (context only; do not quote if absent in Target Chunk):** {previous_chunk}
-* **Target_chunk (review focus):** {target_chunk}
-* **Next_chunk (context only; do not quote if absent in Target Chunk):** {next_chunk}
 
-Return **only** the JSON above — no commentary.
+def build_batched_evaluation_prompt(agent_responses, title, target_chunk, db_name=None, collection_name=None):
+    """
+    Builds one evaluator prompt scoring several agents' responses to the same
+    chunk. agent_responses maps agent_name to the agent's raw response; the
+    chunk is included once, followed by each agent's rubric summary and
+    response. The model must answer with a JSON object keyed by agent_name.
+    """
+    parts = [
+        "You are evaluating the responses of several independent policy reviewers to the same Target Chunk.",
+        f"""## Inputs
+
+* Book Title: {title}
+* **Target_chunk (reviewed text):** {target_chunk}
 """
-    parts.append(inputs_section)
+    ]
+
+    for agent_name, raw_response in agent_responses.items():
+        doc, error = fetch_agent_document(agent_name, db_name, collection_name)
+        rubric = error if error else summarize_agent_rubric(doc)
+        parts.append(f"""# ===== Reviewer: {agent_name} =====
+
+## Rubric
+{rubric}
+
+## Reviewer's Raw Response
+"{raw_response}"
+""")
+
+    example_keys = ",\n".join(f'  "{agent_name}": {{"confidence": <score>}}' for agent_name in agent_responses)
+    parts.append(f"""For each reviewer: how correct and relevant is the Response to the Target Chunk under that reviewer's Rubric?
+
+Give each reviewer a confidence score between 0 and 100.
+
+Respond only with a single, valid JSON object with one key per reviewer, spelled exactly as below:
+{{
+{example_keys}
+}}
+DO NOT include any explanation or text outside of the JSON object.
+""")
 
     return "\n\n".join(parts)
 
@@ -0,0 +1,216 @@
+# llm_hedging.py
+# Hedged LLM requests: when a call has not returned within the observed
+# HEDGE_PERCENTILE latency of its prompt-length bucket, the same request is
+# sent again (to the hedge endpoint if one is configured), the first
+# response wins and the other request is cancelled. Hedges are capped at
+# HEDGE_MAX_RATE of all calls.
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from config import HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MAX_RATE, HEDGE_MIN_SAMPLES
+from llm_metrics import record_llm_event
+from llm_streaming import stream_json_response, astream_json_response
+
+
+def prompt_bucket(prompt_chars: int) -> int:
+    """Prompt-length bucket: the estimated token count (~4 chars/token) rounded up to a power of two, at least 256."""
+    estimated_tokens = max(1, prompt_chars // 4)
+    return max(256, 2 ** math.ceil(math.log2(estimated_tokens)))
+
+
+def messages_chars(messages) -> int:
+    """Prompt length in characters of a string prompt or a list of messages (LangChain messages or OpenAI dicts)."""
+    if isinstance(messages, str):
+        return len(messages)
+    return sum(len(str(message.get("content", "") if isinstance(message, dict) else getattr(message, "content", message))) for message in messages)
+
+
+class HedgeTracker:
+    """Latencies per prompt-length bucket and the call/hedge counts behind the rate cap."""
+
+    def __init__(self, max_samples: int = 500):
+        self.max_samples = max_samples
+        self.latencies = {}
+        self.calls = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def record_latency(self, bucket: int, seconds: float):
+        with self.lock:
+            samples = self.latencies.setdefault(bucket, [])
+            samples.append(seconds)
+            if len(samples) > self.max_samples:
+                del samples[0]
+
+    def hedge_delay(self, bucket: int):
+        """Seconds to wait before hedging a call in this bucket, or None until HEDGE_MIN_SAMPLES latencies were seen."""
+        with self.lock:
+            samples = sorted(self.latencies.get(bucket, []))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE))]
+
+    def start_call(self):
+        with self.lock:
+            self.calls += 1
+        record_llm_event("hedge_eligible_calls")
+
+    def try_hedge(self) -> bool:
+        """Counts a hedge if it keeps hedges within HEDGE_MAX_RATE of all calls."""
+        with self.lock:
+            if self.hedges + 1 > HEDGE_MAX_RATE * self.calls:
+                allowed = False
+            else:
+                self.hedges += 1
+                allowed = True
+        record_llm_event("hedges_sent" if allowed else "hedges_over_budget")
+        return allowed
+
+
+hedge_tracker = HedgeTracker()
+
+
+async def ahedged_call(call, messages, hedge_call=None):
+    """
+    Awaits call() (a coroutine factory); if it is still running after the
+    bucket's hedge delay, also starts hedge_call() (default: call again) and
+    returns whichever result arrives first, cancelling the other task.
+    A failed request does not win: the other one is awaited instead.
+    """
+    if not HEDGE_ENABLED:
+        return await call()
+    bucket = prompt_bucket(messages_chars(messages))
+    hedge_tracker.start_call()
+    started = time.monotonic()
+    primary = asyncio.ensure_future(call())
+    delay = hedge_tracker.hedge_delay(bucket)
+    try:
+        # asyncio.wait does not cancel its tasks when the caller is cancelled (e.g. at the chunk deadline)
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not hedge_tracker.try_hedge():
+            result = await primary
+            hedge_tracker.record_latency(bucket, time.monotonic() - started)
+            return result
+    except asyncio.CancelledError:
+        primary.cancel()
+        raise
+
+    hedge = asyncio.ensure_future((hedge_call or call)())
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            # A successful response wins over a failed one that finished at the same time
+            for task in sorted(done, key=lambda t: t.exception() is not None):
+                if task.exception() is None or not pending:
+                    if task is hedge:
+                        record_llm_event("hedges_won")
+                    # Timed from the primary's start: a hedge win records the primary's latency
+                    # censored at that point, so slow primaries still raise the percentile
+                    hedge_tracker.record_latency(bucket, time.monotonic() - started)
+                    return task.result()
+    finally:
+        # Cancelling the losing task closes its stream, which aborts the request in vLLM
+        for task in pending:
+            task.cancel()
+
+
+# Only hedges run here; primaries run inline or on their own thread, so they never queue for a worker
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+
+
+def _start_thread(call, cancel_event) -> Future:
+    """Runs call(cancel_event) on a new thread and returns its Future."""
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        try:
+            future.set_result(call(cancel_event))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="llm-primary", daemon=True).start()
+    return future
+
+
+def hedged_call(call, messages, hedge_call=None):
+    """
+    Blocking version of ahedged_call. Until the bucket has a hedge delay the
+    primary call(cancel_event) runs inline; after that it runs on its own
+    thread and hedge_call(cancel_event) on the hedge pool. The loser's
+    cancel_event is set, which stops a streamed response
+    (stream_json_response) and closes its request. A non-streaming loser
+    runs to completion and is discarded.
+    """
+    if not HEDGE_ENABLED:
+        return call(None)
+    bucket = prompt_bucket(messages_chars(messages))
+    hedge_tracker.start_call()
+    started = time.monotonic()
+    delay = hedge_tracker.hedge_delay(bucket)
+    if delay is None:
+        result = call(None)
+        hedge_tracker.record_latency(bucket, time.monotonic() - started)
+        return result
+
+    events = {"primary": threading.Event(), "hedge": threading.Event()}
+    primary = _start_thread(call, events["primary"])
+    done, _ = wait({primary}, timeout=delay)
+    if done or not hedge_tracker.try_hedge():
+        result = primary.result()
+        hedge_tracker.record_latency(bucket, time.monotonic() - started)
+        return result
+
+    hedge = _hedge_pool.submit(hedge_call or call, events["hedge"])
+    names = {primary: "primary", hedge: "hedge"}
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in sorted(done, key=lambda f: f.exception() is not None):
+                if future.exception() is None or not pending:
+                    if future is hedge:
+                        record_llm_event("hedges_won")
+                    hedge_tracker.record_latency(bucket, time.monotonic() - started)
+                    return future.result()
+    finally:
+        for future in pending:
+            events[names[future]].set()
+
+
+def hedged_stream_json_response(llm_model, messages, cap_key: str, hedge_llm_model=None, **kwargs) -> str:
+    """stream_json_response with hedging; the hedge goes to hedge_llm_model if given, else to llm_model again."""
+    hedge_model = hedge_llm_model or llm_model
+    return hedged_call(
+        lambda cancel_event: stream_json_response(llm_model, messages, cap_key, cancel_event=cancel_event, **kwargs),
+        messages,
+        lambda cancel_event: stream_json_response(hedge_model, messages, cap_key, cancel_event=cancel_event, **kwargs),
+    )
+
+
+async def ahedged_stream_json_response(llm_model, messages, cap_key: str, hedge_llm_model=None, **kwargs) -> str:
+    """Async version of hedged_stream_json_response."""
+    hedge_model = hedge_llm_model or llm_model
+    return await ahedged_call(
+        lambda: astream_json_response(llm_model, messages, cap_key, **kwargs),
+        messages,
+        lambda: astream_json_response(hedge_model, messages, cap_key, **kwargs),
+    )
+
+
+def print_hedge_report():
+    if not HEDGE_ENABLED:
+        return
+    with hedge_tracker.lock:
+        calls, hedges = hedge_tracker.calls, hedge_tracker.hedges
+        buckets = {bucket: len(samples) for bucket, samples in hedge_tracker.latencies.items()}
+    print("\n--- Hedged Requests ---")
+    print(f"  Calls: {calls}, hedged: {hedges} ({hedges / calls:.1%} of calls, cap {HEDGE_MAX_RATE:.0%})" if calls else "  Calls: 0")
+    for bucket in sorted(buckets):
+        delay = hedge_tracker.hedge_delay(bucket)
+        delay_text = f"{delay:.1f}s" if delay is not None else f"none (<{HEDGE_MIN_SAMPLES} samples)"
+        print(f"  prompt ≤{bucket:>6} tokens: {buckets[bucket]} latencies, hedge after {delay_text}")
+    print("-" * 40)
@@ -4,6 +4,7 @@ from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGener
 from langchain_community.embeddings import FastEmbedEmbeddings
 import os
 from dotenv import load_dotenv
+from config import LLM_REQUEST_TIMEOUT_SECONDS, LLM_CLIENT_MAX_RETRIES
 
 load_dotenv(override=True)
 
@@ -17,21 +18,47 @@ embeddings = FastEmbedEmbeddings(model_name=os.getenv("embedding_model"))
 llm = ChatOpenAI(
 openai_api_base="http://192.168.18.100:8000/v1",
 openai_api_key="EMPTY",
-model_name="gpt-oss-20b"
+model_name="gpt-oss-20b",
+request_timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+max_retries=LLM_CLIENT_MAX_RETRIES
 )
 
 eval_llm = ChatOpenAI(
    openai_api_base="http://192.168.18.100:8000/v1",
    openai_api_key="EMPTY",
-   model_name="gpt-oss-20b"
+   model_name="gpt-oss-20b",
+   request_timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+   max_retries=LLM_CLIENT_MAX_RETRIES
 )
 
 llm1 = ChatOpenAI(
   openai_api_base="http://192.168.18.100:8000/v1",
   openai_api_key="EMPTY",
-  model_name="gpt-oss-20b"
+  model_name="gpt-oss-20b",
+  request_timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+  max_retries=LLM_CLIENT_MAX_RETRIES
 )
 
+# Small/quantized screening model on a second OpenAI-compatible endpoint (model cascade).
+# Left as None when SCREEN_LLM_BASE_URL is not set, which disables the cascade.
+screen_llm = ChatOpenAI(
+  openai_api_base=os.getenv("SCREEN_LLM_BASE_URL"),
+  openai_api_key=os.getenv("SCREEN_LLM_API_KEY", "EMPTY"),
+  model_name=os.getenv("SCREEN_LLM_MODEL", "gpt-oss-20b"),
+  request_timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+  max_retries=LLM_CLIENT_MAX_RETRIES
+) if os.getenv("SCREEN_LLM_BASE_URL") else None
+
+# Second OpenAI-compatible endpoint that hedged requests are sent to (llm_hedging.py).
+# Left as None when HEDGE_LLM_BASE_URL is not set; hedges then go to the same endpoint.
+hedge_llm = ChatOpenAI(
+  openai_api_base=os.getenv("HEDGE_LLM_BASE_URL"),
+  openai_api_key=os.getenv("HEDGE_LLM_API_KEY", "EMPTY"),
+  model_name=os.getenv("HEDGE_LLM_MODEL", "gpt-oss-20b"),
+  request_timeout=LLM_REQUEST_TIMEOUT_SECONDS,
+  max_retries=LLM_CLIENT_MAX_RETRIES
+) if os.getenv("HEDGE_LLM_BASE_URL") else None
+
 from langchain_openai import ChatOpenAI
 
 # Main LLM
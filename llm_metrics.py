@@ -0,0 +1,63 @@
+# llm_metrics.py
+# Process-wide counters for LLM response handling (parse successes and
+# failures, fenced JSON parsed, retries caused by unparseable output), so
+# runs with and without structured output can be compared.
+import threading
+from collections import Counter
+from config import STRUCTURED_OUTPUT
+
+_counters = Counter()
+_lock = threading.Lock()
+
+
+def record_llm_event(event: str, count: int = 1):
+    with _lock:
+        _counters[event] += count
+
+
+def llm_metrics_snapshot() -> dict:
+    with _lock:
+        return dict(_counters)
+
+
+def reset_llm_metrics():
+    with _lock:
+        _counters.clear()
+
+
+def _rate(part: int, total: int) -> str:
+    return f"{part / total:.1%}" if total else "n/a"
+
+
+def print_llm_metrics():
+    m = llm_metrics_snapshot()
+    agent_total = m.get("agent_parse_ok", 0) + m.get("agent_parse_failed", 0)
+    eval_total = m.get("evaluator_parse_ok", 0) + m.get("evaluator_parse_failed", 0)
+    print(f"\n--- LLM Output Metrics (structured output: {'on' if STRUCTURED_OUTPUT else 'off'}) ---")
+    print(f"  Agent responses: {agent_total}, parse failures (→ human review): {m.get('agent_parse_failed', 0)} ({_rate(m.get('agent_parse_failed', 0), agent_total)})")
+    print(f"  Agent responses missing required keys: {m.get('agent_missing_keys', 0)}")
+    print(f"  Evaluator responses: {eval_total}, parse failures (→ confidence 0): {m.get('evaluator_parse_failed', 0)} ({_rate(m.get('evaluator_parse_failed', 0), eval_total)})")
+    print(f"  Agent retries caused by a low confidence: {m.get('agent_retries', 0)}, evaluator-only retries after an unparseable reply: {m.get('evaluator_retries', 0)}")
+    print(f"  Evaluator responses parsed from a ```json fence: {m.get('evaluator_fenced_json', 0)} (non-streamed responses only; the stream scanner drops the fence)")
+    print(f"  Streams stopped early at the end of the JSON object: {m.get('stream_early_stops', 0)}, JSON cut off under a learned max_tokens cap: {m.get('stream_incomplete_under_cap', 0)}")
+    if m.get("self_consistency_calls"):
+        print(f"  Self-consistency calls: {m['self_consistency_calls']}, unanimous: {m.get('self_consistency_unanimous', 0)} ({_rate(m.get('self_consistency_unanimous', 0), m['self_consistency_calls'])})")
+    if m.get("validation_passed") or m.get("validation_failed"):
+        print(f"  Local validation: {m.get('validation_passed', 0)} passed, {m.get('validation_failed', 0)} failed, {m.get('validation_repairs', 0)} repair retries (no evaluator call)")
+    if m.get("logprobs_scored") or m.get("logprobs_unavailable"):
+        print(f"  Logprob confidences: {m.get('logprobs_scored', 0)}, responses without usable logprobs: {m.get('logprobs_unavailable', 0)}")
+    if m.get("agent_transient_failures") or m.get("batched_evaluation_failures"):
+        print(f"  Failed LLM requests: {m.get('agent_transient_failures', 0)} agent(s) left pending, "
+              f"{m.get('batched_evaluation_failures', 0)} batched evaluation(s) routed to human review")
+    if m.get("packed_requests"):
+        print(f"  Packed review requests: {m['packed_requests']}, chunks reviewed in them: {m.get('packed_chunks', 0)} "
+              f"({m.get('packed_chunks', 0) / m['packed_requests']:.1f} per request)")
+    if m.get("hedge_eligible_calls"):
+        print(f"  Hedged requests: {m.get('hedges_sent', 0)} of {m['hedge_eligible_calls']} calls ({_rate(m.get('hedges_sent', 0), m['hedge_eligible_calls'])}), "
+              f"hedge won: {m.get('hedges_won', 0)}, not sent (rate cap): {m.get('hedges_over_budget', 0)}")
+    screened, escalated = m.get("cascade_screened", 0), m.get("cascade_escalated", 0)
+    if screened or escalated:
+        print(f"  Cascade: {screened + escalated} screened, {escalated} escalated ({_rate(escalated, screened + escalated)}; "
+              f"flagged={m.get('cascade_escalated_flagged', 0)}, human={m.get('cascade_escalated_human', 0)}, low confidence={m.get('cascade_escalated_low_confidence', 0)})")
+        print(f"  Cascade agreement on escalated chunks: {_rate(m.get('cascade_agreed', 0), escalated)} ({m.get('cascade_disagreed', 0)} disagreement(s))")
+    print("-" * 40)
@@ -0,0 +1,176 @@
+# llm_streaming.py
+# Streams chat completions and stops reading (which cancels the request in
+# vLLM) as soon as a complete top-level JSON object has arrived, instead of
+# waiting for whatever the model generates after the closing brace. Also
+# learns per-agent max_tokens caps from the observed response lengths.
+import threading
+from config import STREAM_EARLY_STOP, MAX_TOKENS_MIN_SAMPLES, MAX_TOKENS_PERCENTILE, MAX_TOKENS_HEADROOM, MAX_TOKENS_FLOOR
+from llm_metrics import record_llm_event
+
+
+class JsonObjectScanner:
+    """
+    Incremental scanner over streamed text. Everything before the first "{"
+    (e.g. a ```json fence) is skipped; braces and brackets inside strings
+    are ignored. Once the top-level object closes, `complete` is True and
+    `json_text` holds exactly that object.
+    """
+
+    def __init__(self):
+        self.text = []
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.complete = False
+
+    def feed(self, fragment: str) -> bool:
+        for ch in fragment:
+            if self.complete:
+                break
+            if not self.started:
+                if ch != "{":
+                    continue
+                self.started = True
+            self.text.append(ch)
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+        return self.complete
+
+    @property
+    def json_text(self) -> str:
+        return "".join(self.text)
+
+
+class ResponseLengthTracker:
+    """
+    Records how many tokens each agent's responses take (one streamed chunk
+    is counted as one token; reasoning deltas are included, since they count
+    against max_tokens too) and derives a max_tokens cap per agent:
+    the MAX_TOKENS_PERCENTILE of the observed lengths times MAX_TOKENS_HEADROOM,
+    never below MAX_TOKENS_FLOOR. No cap is applied until
+    MAX_TOKENS_MIN_SAMPLES responses have been seen.
+    """
+
+    def __init__(self, max_samples: int = 500):
+        self.max_samples = max_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, key: str, tokens: int):
+        with self.lock:
+            samples = self.samples.setdefault(key, [])
+            samples.append(tokens)
+            if len(samples) > self.max_samples:
+                del samples[0]
+
+    def max_tokens(self, key: str):
+        with self.lock:
+            samples = sorted(self.samples.get(key, []))
+        if len(samples) < MAX_TOKENS_MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * MAX_TOKENS_PERCENTILE))
+        return max(MAX_TOKENS_FLOOR, int(samples[index] * MAX_TOKENS_HEADROOM))
+
+    def summary(self) -> dict:
+        with self.lock:
+            keys = list(self.samples)
+        return {key: {"samples": len(self.samples[key]), "max_tokens": self.max_tokens(key)} for key in keys}
+
+
+response_lengths = ResponseLengthTracker()
+
+
+def with_learned_max_tokens(cap_key: str, kwargs: dict) -> dict:
+    """kwargs plus the learned max_tokens cap for cap_key, unless a cap is already given."""
+    max_tokens = response_lengths.max_tokens(cap_key)
+    if max_tokens is not None and "max_tokens" not in kwargs:
+        return {**kwargs, "max_tokens": max_tokens}
+    return kwargs
+
+
+def _finish(cap_key: str, scanner: JsonObjectScanner, pieces: list, chunk_count: int, stopped_early: bool) -> str:
+    if stopped_early:
+        record_llm_event("stream_early_stops")
+        # The tracker only learns from complete responses, so caps stay above the JSON length
+        response_lengths.record(cap_key, chunk_count)
+        return scanner.json_text
+    if scanner.started and response_lengths.max_tokens(cap_key) is not None:
+        # The JSON object never closed, most likely cut off by the learned cap
+        record_llm_event("stream_incomplete_under_cap")
+    else:
+        response_lengths.record(cap_key, chunk_count)
+    return "".join(pieces)
+
+
+def stream_json_response(llm_model, messages, cap_key: str, cancel_event=None, **kwargs) -> str:
+    """
+    Returns the response content of llm_model for messages, stopping the
+    stream once a complete JSON object has been received (the object is then
+    returned on its own). cap_key selects the learned max_tokens cap.
+    Falls back to a plain invoke when STREAM_EARLY_STOP is off.
+    Setting cancel_event (a threading.Event, see llm_hedging) abandons the stream.
+    """
+    kwargs = with_learned_max_tokens(cap_key, kwargs)
+    if not STREAM_EARLY_STOP:
+        return llm_model.invoke(messages, **kwargs).content
+
+    scanner, pieces, chunk_count = JsonObjectScanner(), [], 0
+    stream = llm_model.stream(messages, **kwargs)
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                # Lost a hedged race; the partial text is discarded by the caller
+                return "".join(pieces)
+            chunk_count += 1
+            pieces.append(chunk.content)
+            if scanner.feed(chunk.content):
+                return _finish(cap_key, scanner, pieces, chunk_count, stopped_early=True)
+    finally:
+        # Closing the generator closes the HTTP response, which aborts the request in vLLM
+        stream.close()
+    return _finish(cap_key, scanner, pieces, chunk_count, stopped_early=False)
+
+
+async def astream_json_response(llm_model, messages, cap_key: str, **kwargs) -> str:
+    """Async version of stream_json_response."""
+    kwargs = with_learned_max_tokens(cap_key, kwargs)
+    if not STREAM_EARLY_STOP:
+        return (await llm_model.ainvoke(messages, **kwargs)).content
+
+    scanner, pieces, chunk_count = JsonObjectScanner(), [], 0
+    stream = llm_model.astream(messages, **kwargs)
+    try:
+        async for chunk in stream:
+            chunk_count += 1
+            pieces.append(chunk.content)
+            if scanner.feed(chunk.content):
+                return _finish(cap_key, scanner, pieces, chunk_count, stopped_early=True)
+    finally:
+        await stream.aclose()
+    return _finish(cap_key, scanner, pieces, chunk_count, stopped_early=False)
+
+
+def print_response_length_caps():
+    summary = response_lengths.summary()
+    if not summary:
+        return
+    print("\n--- Learned max_tokens Caps ---")
+    for key, info in sorted(summary.items()):
+        cap = info["max_tokens"] if info["max_tokens"] is not None else f"none (<{MAX_TOKENS_MIN_SAMPLES} samples)"
+        print(f"  {key:<30} samples={info['samples']} max_tokens={cap}")
+    print("-" * 40)
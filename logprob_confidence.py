@@ -0,0 +1,48 @@
+# logprob_confidence.py
+# Derives an agent's confidence from the token logprobs of its own response
+# (the probability the model gave to the chunk_flagged/issues_found and
+# recommendation values), as an alternative to a separate evaluator call.
+import math
+import re
+
+# JSON values whose tokens carry the agent's decision
+DECISION_VALUE_PATTERN = re.compile(r'"(chunk_flagged|issues_found|recommendation)"\s*:\s*"?([^",}\]\s]+)')
+
+
+def extract_logprobs_content(response_metadata: dict):
+    """The per-token logprobs list of a chat response, or None if the endpoint returned none."""
+    logprobs = (response_metadata or {}).get("logprobs")
+    if isinstance(logprobs, dict):
+        logprobs = logprobs.get("content")
+    return logprobs if isinstance(logprobs, list) and logprobs else None
+
+
+def confidence_from_logprobs(logprobs_content: list):
+    """
+    Returns (confidence 0-100, details) from token logprobs, or (None, details)
+    if no decision value was found. Each decision value's probability is the
+    probability of its first token (the one that decides e.g. "true" vs
+    "false"); the confidence is the lowest of them, so one uncertain field is
+    enough to fail the agent's threshold.
+    """
+    tokens = [entry.get("token", "") for entry in logprobs_content]
+    offsets, position = [], 0
+    for token in tokens:
+        offsets.append(position)
+        position += len(token)
+    text = "".join(tokens)
+
+    fields = []
+    for match in DECISION_VALUE_PATTERN.finditer(text):
+        value_start = match.start(2)
+        # The token that contains the first character of the value
+        index = max(i for i, offset in enumerate(offsets) if offset <= value_start)
+        logprob = logprobs_content[index].get("logprob")
+        if logprob is None:
+            continue
+        fields.append({"field": match.group(1), "value": match.group(2), "probability": round(math.exp(logprob), 4)})
+
+    if not fields:
+        return None, {"fields": []}
+    confidence = min(field["probability"] for field in fields) * 100
+    return int(round(confidence)), {"fields": fields}
@@ -1,59 +1,609 @@
 from langgraph.graph import START, END, StateGraph
+from langchain_core.runnables import RunnableLambda
 from models import State
-from llm_init import llm, eval_llm, llm1
+from llm_init import llm, eval_llm, llm1, screen_llm, hedge_llm
 from knowledge_base import knowledge_list, retriever
-from agents import load_agents_from_mongo, available_agents
-from workflow_nodes import main_node, final_report_generator
+from agents import read_agents_from_mongo, available_agents, agent_settings, format_long_text_as_target_chunk, split_chunk_into_lines, create_combined_review_node, create_batched_evaluation_node, create_packed_review_node, warm_up_prefix_cache, transient_failure_output
+from workflow_nodes import main_node, final_report_generator, relevance_gate, relevant_agents
+from relevance_router import NOT_APPLICABLE_STATUS
 # Modified imports to use Pipeline 1 specific chunk retrieval functions
 # Now importing the new functions from pdf_processor
 from pdf_processor import get_first_pipeline1_chunk, get_all_pipeline1_chunks_details, get_next_pending_pipeline1_chunk, get_all_pending_pipeline1_chunks_details, get_chunk_with_context
-from config import AGENTS_DB_NAME, AGENTS_COLLECTION_NAME, MONGO_URI, PDF_DB_NAME
-from database_saver import save_results_to_mongo, clear_results_collection, update_chunk_analysis_status, RESULTS_DB_NAME, RESULTS_COLLECTION_NAME
+from pdf_processor import iter_pending_chunks_with_context
+from pdf_processor import claim_next_pending_chunk, release_chunk_claim, reap_expired_chunk_leases, ensure_pending_chunk_indexes, watch_for_pending_chunks
+from pdf_processor import renew_chunk_leases, ChunkLeaseHeartbeat
+from config import AGENTS_DB_NAME, AGENTS_COLLECTION_NAME, MONGO_URI, PDF_DB_NAME, MAX_INFLIGHT_CHUNKS, CHUNK_LEASE_SECONDS, PENDING_RETRY_BACKOFF_SECONDS
+from config import CHUNK_DEADLINE_SECONDS, LLM_REQUEST_TIMEOUT_SECONDS
+from config import CLASSIFY_WORKERS, PERSIST_WORKERS, STAGE_QUEUE_SIZE, STAGE_STATS_INTERVAL_SECONDS, REVIEW_MODE, PREFIX_CACHE_WARMUP, PROMPT_LAYOUT, CONTEXT_TOKEN_BUDGET, AGENT_HOT_RELOAD
+from database_saver import save_results_to_mongo, clear_results_collection, update_chunk_analysis_status, ensure_results_indexes, RESULTS_DB_NAME, RESULTS_COLLECTION_NAME
 from text_classifier import classify_text
+from pipeline_stages import Stage, StagedPipeline
+from agent_registry import AgentRegistry
+from context_trimmer import trim_context
+from chunk_packing import pack_chunk_windows
+from vllm_metrics import prefix_cache_snapshot, print_prefix_cache_report
+from llm_metrics import print_llm_metrics
+from llm_streaming import print_response_length_caps
+from retry_strategies import print_retry_strategy_report
+from llm_hedging import print_hedge_report
+import argparse
+import asyncio
+import itertools
+import os
+import socket
+import time
 import pymongo
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 
-def run_workflow():
-    # Clear the results collection at the beginning of each program execution
-    # Consider if you really want to clear all results every time you run.
-    # If you're resuming, you might not want to clear previous results.
-    # clear_results_collection() # <--- COMMENTED OUT TO PRESERVE PREVIOUS RUNS' DATA
+def build_workflow_graph(review_mode: str = REVIEW_MODE, agents: dict = None, settings: dict = None):
+    """
+    Builds and compiles the StateGraph: main_node hands the chunk to the
+    relevance gate, which fans out to the loaded agents that apply to it, and
+    every agent feeds into the final report generator.
+    With review_mode="combined", a single node reviews the chunk for all
+    agents in one LLM call instead. With review_mode="batched_eval", the
+    agents feed a batched evaluation node that scores all of their responses
+    in one evaluator request before the final report. With
+    review_mode="packed", the result is the packed reviewer instead of a
+    graph (see build_packed_reviewer): it reviews a list of chunk states.
 
-    # Load agents dynamically from MongoDB
-    print("Loading agents from MongoDB...")
-    load_agents_from_mongo(llm, eval_llm)
-    
-    total_agents = len(available_agents)
-    if total_agents == 0:
-        print("WARNING: No agents loaded. Analysis workflow might not function as expected.")
-        return # Exit if no agents are loaded
+    agents/settings default to the registered agents. The agent registry
+    passes a snapshot instead, so a graph keeps its own agent set even after
+    a hot reload has published a newer one.
+    """
+    agents = dict(available_agents) if agents is None else agents
+    settings = dict(agent_settings) if settings is None else settings
+
+    if review_mode == "packed":
+        return build_packed_reviewer(agents, settings)
 
     # Initialize the StateGraph with the defined State
     graph_builder = StateGraph(State)
 
     # Add the main_node and final_report_generator nodes to the graph
     graph_builder.add_node("main_node", main_node)
-    graph_builder.add_node("fnl_rprt", final_report_generator)
+    graph_builder.add_node("fnl_rprt", lambda state: final_report_generator(state, agents))
+
+    # Set the entry point of the graph to "main_node"
+    graph_builder.add_edge(START, "main_node")
+
+    # Routing layer: decides which agents apply to the chunk
+    graph_builder.add_node("relevance_gate", lambda state: relevance_gate(state, agents, settings))
+    graph_builder.add_edge("main_node", "relevance_gate")
+
+    if review_mode == "combined":
+        # One request carrying every agent's rubric; the response is split back per agent.
+        graph_builder.add_node("combined_review", create_combined_review_node(list(agents.keys()), llm))
+        print(f"Added combined review node for agents: {list(agents.keys())}")
+        graph_builder.add_edge("relevance_gate", "combined_review")
+        graph_builder.add_edge("combined_review", "fnl_rprt")
+        graph_builder.add_edge("fnl_rprt", END)
+        return graph_builder.compile()
 
     # Add dynamically loaded agents as nodes
-    for agent_name, agent_runnable in available_agents.items():
+    for agent_name, agent_runnable in agents.items():
         graph_builder.add_node(agent_name, agent_runnable)
         print(f"Added agent '{agent_name}' as a node to the graph.")
 
-    # Set the entry point of the graph to "main_node"
-    graph_builder.add_edge(START, "main_node")
+    # One evaluator request per chunk instead of one per agent; it waits for every agent.
+    review_exit = "fnl_rprt"
+    if review_mode == "batched_eval":
+        graph_builder.add_node("batched_evaluation", create_batched_evaluation_node(eval_llm, agents=agents, settings=settings))
+        graph_builder.add_edge("batched_evaluation", "fnl_rprt")
+        review_exit = "batched_evaluation"
 
-    # Dynamically add edges from "main_node" to each loaded agent, and then from each agent to the "fnl_rprt"
-    for agent_name in available_agents:
-        graph_builder.add_edge("main_node", agent_name)
-        graph_builder.add_edge(agent_name, "fnl_rprt")
+    # The relevance gate fans out to the agents that apply to the chunk; each agent then feeds the "fnl_rprt"
+    graph_builder.add_conditional_edges(
+        "relevance_gate",
+        lambda state: relevant_agents(state, agents) or [review_exit],
+        list(agents.keys()) + [review_exit]
+    )
+    for agent_name in agents:
+        graph_builder.add_edge(agent_name, review_exit)
 
     # Set the exit point of the graph to "fnl_rprt"
     graph_builder.add_edge("fnl_rprt", END)
 
     # Compile the graph for execution
-    graph = graph_builder.compile()
+    return graph_builder.compile()
+
+
+def apply_node_update(state: dict, update: dict) -> dict:
+    """Applies a node's update to a state as the State reducers do: main_node_output is merged, aggregate appended, other keys replaced."""
+    # Keys outside State (e.g. an agent's top-level output) are dropped by the graph as well
+    update = {key: value for key, value in update.items() if key in State.__annotations__}
+    merged = {**state, **update}
+    if "main_node_output" in update:
+        merged["main_node_output"] = {**state.get("main_node_output", {}), **update["main_node_output"]}
+    if "aggregate" in update:
+        merged["aggregate"] = state.get("aggregate", []) + update["aggregate"]
+    return merged
+
+
+def mark_unfinished_agents(state: dict, reason: str) -> dict:
+    """
+    Records every agent of the chunk without a result in state as a transient
+    failure and regenerates the final report, so a chunk whose review timed
+    out is saved with the results that did finish and stays Pending.
+    """
+    agent_names = state.get("metadata", {}).get("agent_names", list(available_agents.keys()))
+    for agent_name in agent_names:
+        if agent_name not in state.get("main_node_output", {}):
+            state = apply_node_update(state, transient_failure_output(agent_name, reason))
+    return apply_node_update(state, final_report_generator(state, agent_names))
+
+
+async def review_with_timeout(graph, report_data: dict, timeout: float) -> dict:
+    """
+    Runs a chunk through the graph, applying each node's update to the
+    chunk's state as it streams in. If the timeout expires, the agents that
+    finished keep their results and the rest are marked unfinished.
+    """
+    state = report_data
+
+    async def collect_updates():
+        nonlocal state
+        async for step in graph.astream(report_data, stream_mode="updates"):
+            for node_update in step.values():
+                if node_update:
+                    state = apply_node_update(state, node_update)
+
+    try:
+        await asyncio.wait_for(collect_updates(), timeout=timeout)
+    except asyncio.TimeoutError:
+        print(f"⏰ Review of chunk {report_data['metadata'].get('chunk_id')} timed out; saving the agents that finished.")
+        state = mark_unfinished_agents(state, "chunk review timed out")
+    return state
+
+
+def build_packed_reviewer(agents: dict, settings: dict):
+    """
+    The "packed" counterpart of the compiled graph: takes the states of a pack
+    of consecutive chunks and returns one final state per chunk. Each chunk
+    goes through the relevance gate and the final report generator as in the
+    graph, while each agent reviews the whole pack in one request.
+    """
+    packed_review = create_packed_review_node(list(agents.keys()), llm)
+    print(f"Added packed review node for agents: {list(agents.keys())}")
+
+    def gated(states: list) -> list:
+        return [apply_node_update(state, relevance_gate(state, agents, settings)) for state in states]
+
+    def reported(states: list, updates: list) -> list:
+        results = [apply_node_update(state, update) for state, update in zip(states, updates)]
+        return [apply_node_update(result, final_report_generator(result, agents)) for result in results]
+
+    def review_pack(states: list) -> list:
+        states = gated(states)
+        return reported(states, packed_review.invoke(states))
+
+    async def review_pack_async(states: list) -> list:
+        states = gated(states)
+        return reported(states, await packed_review.ainvoke(states))
+
+    return RunnableLambda(review_pack, afunc=review_pack_async, name="packed_reviewer")
+
+
+# ─── PIPELINE STAGES: classify → prepare → review → persist ─────────────────
+
+def classify_chunk_window(chunk_window: tuple) -> dict:
+    """
+    Stage 1 (CPU-bound): runs the zero-shot classifier on the target chunk of a
+    (previous, target, next) chunk window.
+    The HF pipeline is not guaranteed to be thread-safe, so this stage runs
+    with a single worker unless CLASSIFY_WORKERS is raised explicitly.
+    """
+    previous_chunk, target_chunk, next_chunk = chunk_window
+
+    # Extract fields from the target chunk
+    p1_chunk_uuid = target_chunk.get("_id")
+    doc_id_p1 = target_chunk.get("doc_id")
+    chunk_index_p1 = target_chunk.get("chunk_index")
+    original_chunk_text = target_chunk.get("text")
+    book_name_p1 = target_chunk.get("doc_name", "Unknown Document")
+    p1_coordinates = target_chunk.get("coordinates")
+    p1_page_number = target_chunk.get("page_number")
+
+    # Get text for previous and next chunks
+    previous_chunk_text = previous_chunk.get("text", "") if previous_chunk else ""
+    next_chunk_text = next_chunk.get("text", "") if next_chunk else ""
+
+    # Use the target chunk's text for classification
+    merged_text_for_id = original_chunk_text
+
+    print(f"\n--- Processing Chunk ID: {p1_chunk_uuid} (Document: '{book_name_p1}', P1 Doc ID: {doc_id_p1}, P1 Chunk Index: {chunk_index_p1}) ---")
+    print(f"Original Chunk Text: {original_chunk_text}\n")
+
+    classification_result = classify_text(merged_text_for_id)
+    predicted_label = classification_result['predicted_label']
+    print(f"--- Predicted Label for Chunk: \"{predicted_label}\" (Confidence: {classification_result['confidence']}%) ---")
+
+    return {
+        "chunk_uuid": p1_chunk_uuid,
+        "doc_id": doc_id_p1,
+        "chunk_index": chunk_index_p1,
+        "report_text": original_chunk_text,
+        "book_name": book_name_p1,
+        "predicted_label": predicted_label,
+        "classification_scores": classification_result['all_scores'],
+        "coordinates": p1_coordinates,
+        "page_number": p1_page_number,
+        "previous_chunk_text": previous_chunk_text,
+        "next_chunk_text": next_chunk_text,
+    }
+
+
+def build_chunk_state(chunk: dict) -> dict:
+    """
+    Stage 2 ("prepare"): builds the initial Langgraph state (report_data) for
+    a classified chunk. The target chunk is formatted for the prompt once here
+    instead of in every agent attempt, and the previous/next context is
+    trimmed to CONTEXT_TOKEN_BUDGET once for all agents. The agent prompts
+    themselves are built by each agent in the review stage, because a retry
+    changes them.
+    """
+    previous_chunk, next_chunk, context_trim = trim_context(chunk["previous_chunk_text"], chunk["next_chunk_text"], CONTEXT_TOKEN_BUDGET)
+    if context_trim["tokens_saved"]:
+        print(f"✂️ Context for chunk {chunk['chunk_uuid']} trimmed from ~{context_trim['original_tokens']} to ~{context_trim['trimmed_tokens']} tokens.")
+
+    report_data = {
+        "report_text": chunk["report_text"],
+        "metadata": {
+            "doc_id": chunk["doc_id"],
+            "chunk_index": chunk["chunk_index"],
+            "title": chunk["book_name"],
+            "chunk_id": chunk["chunk_uuid"],
+            "predicted_label": chunk["predicted_label"],
+            "classification_scores": chunk["classification_scores"],
+            "coordinates": chunk["coordinates"],
+            "page_number": chunk["page_number"],
+            "previous_chunk": previous_chunk,
+            "next_chunk": next_chunk,
+            "context_trim": context_trim,
+            "formatted_target_chunk": split_chunk_into_lines(format_long_text_as_target_chunk(chunk["report_text"] or "")),
+        },
+        "main_node_output": {},
+        "aggregate": [],
+        "final_decision_report": "",
+        "current_agent_name": "",
+        "current_agent_input_prompt": "",
+        "current_agent_raw_output": "",
+        "current_agent_parsed_output": {},
+        "current_agent_confidence": 0,
+        "current_agent_retries": 0,
+        "current_agent_human_review": False
+    }
+
+    return {**chunk, "report_data": report_data}
+
+
+def compute_agent_analysis_statuses(result_with_review: dict):
+    """
+    Derives the per-agent analysis statuses and the overall chunk status
+    from the graph's final state.
+    """
+    overall_chunk_status = "Complete"
+    # Initialize agent_analysis_statuses with all agents of the graph that reviewed the chunk set to "Pending"
+    graph_agent_names = result_with_review.get("metadata", {}).get("agent_names", list(available_agents.keys()))
+    agent_analysis_statuses = {agent_name: "Pending" for agent_name in graph_agent_names}
+
+    # Now iterate over agents that actually produced output and update their status
+    for agent_name, agent_data in result_with_review.get("main_node_output", {}).items():
+        agent_output = agent_data.get("output", {})
+
+        # Skipped by the relevance gate: nothing to review, and not pending either
+        if agent_data.get("analysis_status") == NOT_APPLICABLE_STATUS:
+            agent_analysis_statuses[agent_name] = NOT_APPLICABLE_STATUS
+            continue
+
+        # Cancelled at the chunk deadline: the chunk stays pending so it is reviewed again
+        if agent_data.get("transient_failure"):
+            agent_analysis_statuses[agent_name] = "Pending"
+            overall_chunk_status = "Pending"
+            continue
+
+        # --- MODIFIED LOGIC: First, check for the specific `None` case as per your request ---
+        # This ensures that if the agent returns None for the key fields, the status is 'Complete'.
+        if (
+            agent_output.get("problematic_text") is None
+            and agent_output.get("observation") is None
+            and agent_output.get("recommendation") is None
+        ):
+            agent_analysis_statuses[agent_name] = "Complete"
+        else:
+            # --- EXISTING LOGIC: If it's not the `None` case, run the original validation ---
+            is_output_complete = True
+
+            if not isinstance(agent_output, dict):
+                is_output_complete = False
+            else:
+                if "issues_found" in agent_output and not isinstance(agent_output.get("issues_found"), bool):
+                    is_output_complete = False
+
+                if "observation" in agent_output and not isinstance(agent_output.get("observation"), str):
+                    is_output_complete = False
+
+                if "recommendation" in agent_output and not isinstance(agent_output.get("recommendation"), str):
+                    is_output_complete = False
+
+            if is_output_complete:
+                agent_analysis_statuses[agent_name] = "Complete"
+            else:
+                agent_analysis_statuses[agent_name] = "Pending"
+                overall_chunk_status = "Pending" # If any agent is pending, the overall chunk is pending
+
+    return overall_chunk_status, agent_analysis_statuses
+
+
+def persist_chunk_result(chunk: dict, result_with_review: dict, worker_id: str = None):
+    """
+    Saves the graph's result for a chunk through save_results_to_mongo and
+    updates the chunk's analysis status in Pipeline 1's collection. When the
+    chunk was claimed by worker_id, the status update also releases its lease,
+    and nothing is saved if the lease has been lost to another worker.
+    """
+    # Renewing the lease also checks it is still ours, and covers the writes below
+    if worker_id and not renew_chunk_leases([chunk["chunk_uuid"]], worker_id):
+        print(f"⚠️ Worker '{worker_id}' lost the lease on chunk '{chunk['chunk_uuid']}'; its result is not saved.")
+        return
+
+    overall_chunk_status, agent_analysis_statuses = compute_agent_analysis_statuses(result_with_review)
+
+    save_results_to_mongo(
+        chunk_uuid=chunk["chunk_uuid"],
+        doc_id=chunk["doc_id"],
+        chunk_index=chunk["chunk_index"],
+        report_text=chunk["report_text"],
+        book_name=chunk["book_name"],
+        predicted_label=chunk["predicted_label"],
+        classification_scores=chunk["classification_scores"],
+        coordinates=chunk["coordinates"],
+        page_number=chunk["page_number"],
+        result_with_review=result_with_review,
+        overall_chunk_status=overall_chunk_status,
+        agent_analysis_statuses=agent_analysis_statuses
+    )
+
+    update_chunk_analysis_status(
+        doc_id=chunk["doc_id"],
+        chunk_id=chunk["chunk_uuid"],
+        analysis_status=overall_chunk_status,
+        worker_id=worker_id
+    )
+
+    print("\n--- Langgraph Workflow Final Output (from State) ---")
+    for agent_name, agent_output_data in result_with_review.get("main_node_output", {}).items():
+        print(f"\n--- Summary for {agent_name} ---\n")
+        output_content = agent_output_data.get('output', {})
+        # Updated lines to print the new JSON fields
+        print(f"  Chunk Flagged: {output_content.get('chunk_flagged', 'N/A')}")
+        print(f"  Observation: {output_content.get('observation', 'N/A')}")
+        print(f"  Recommendation: {output_content.get('recommendation', 'N/A')}")
+        # These lines were already correct, but moved here for clarity
+        print(f"  Confidence: {agent_output_data.get('confidence', 0)}%")
+        print(f"  Retries: {agent_output_data.get('retries', 0)}")
+        print(f"  Human Review Needed: {agent_output_data.get('human_review', False)}")
+
+    print(f"\n--- Overall Chunk Status: {overall_chunk_status} ---\n")
+    print(f"--- Agent Analysis Statuses (per chunk, all agents included): {agent_analysis_statuses} ---\n")
+
+    print("Full Result Dictionary (for debugging):\n")
+    print(result_with_review)
+    print("-" * 40)
+
+
+def default_worker_id() -> str:
+    """Identifies this process when claiming chunks (host name + pid)."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def iter_claimed_chunks(worker_id: str, retry_backoff_seconds: float = 0):
+    """
+    Yields pending chunks one at a time by claiming them for worker_id, so
+    several run_workflow processes can drain the same collection without
+    working on the same chunk. Chunks written back as "Pending" during this
+    pass (or within retry_backoff_seconds before it) are not claimed again.
+    """
+    not_attempted_since = datetime.now() - timedelta(seconds=retry_backoff_seconds)
+    while True:
+        claimed_chunk = claim_next_pending_chunk(worker_id, CHUNK_LEASE_SECONDS, not_attempted_since=not_attempted_since)
+        if not claimed_chunk:
+            return
+        # Fetch the claimed chunk along with its surrounding context
+        previous_chunk, target_chunk, next_chunk = get_chunk_with_context(
+            doc_id=claimed_chunk.get("doc_id"),
+            chunk_index=claimed_chunk.get("chunk_index")
+        )
+        yield previous_chunk, target_chunk or claimed_chunk, next_chunk
+
+
+def held_chunk_windows(chunk_windows, heartbeat: ChunkLeaseHeartbeat):
+    """Passes claimed chunk windows through, holding each target chunk's lease on heartbeat from the moment it is claimed."""
+    for chunk_window in chunk_windows:
+        heartbeat.hold(_target_chunk_id(chunk_window))
+        yield chunk_window
+
+
+def _target_chunk_id(item):
+    """The Pipeline 1 _id of the chunk a pipeline item (window or chunk dict) refers to."""
+    if isinstance(item, tuple):
+        return item[1].get("_id")
+    return item.get("chunk_uuid")
+
+
+def claim_queue_size(max_inflight_chunks: int) -> int:
+    """
+    Stage queue size when chunks are claimed as they enter the pipeline. Every
+    chunk queued ahead of the review stage holds a lease, so the queues are
+    sized for the chunks ahead of a newly claimed one (three queues plus the
+    classify and prepare workers) to be reviewed, max_inflight_chunks at a
+    time, within CHUNK_LEASE_SECONDS together with its own review. A review
+    takes at most CHUNK_DEADLINE_SECONDS + LLM_REQUEST_TIMEOUT_SECONDS; without
+    a deadline it is unbounded and the queues hold one item each. The lease
+    heartbeat still covers a review that runs longer than this estimate.
+    """
+    if not CHUNK_DEADLINE_SECONDS:
+        return 1
+    review_rounds = int(CHUNK_LEASE_SECONDS // (CHUNK_DEADLINE_SECONDS + LLM_REQUEST_TIMEOUT_SECONDS)) - 1
+    queue_size = (review_rounds * max_inflight_chunks - CLASSIFY_WORKERS - 1) // 3
+    return max(1, min(STAGE_QUEUE_SIZE, queue_size))
+
+
+def build_chunk_pipeline(graph, max_inflight_chunks: int, worker_id: str = None, packed: bool = False, heartbeat: ChunkLeaseHeartbeat = None) -> StagedPipeline:
+    """
+    Builds the staged pipeline for a drain: classification, state building
+    ("prepare"), LLM review through the graph and persistence each get their own
+    workers and are connected by bounded queues, so BART inference for chunk
+    k+1 overlaps with the agents reviewing chunk k and the save of chunk k-1.
+    With packed=True every item is a pack of consecutive chunk windows
+    (pack_chunk_windows) and graph is the packed reviewer. heartbeat keeps
+    the leases of claimed chunks alive until they are saved or released; with
+    a worker_id the queues are sized by claim_queue_size.
+    """
+    def release_on_error(item, error):
+        # Leave the chunk pending so the next run (or another worker) picks it up again.
+        if worker_id:
+            for chunk_item in (item if isinstance(item, list) else [item]):
+                release_chunk_claim(_target_chunk_id(chunk_item), worker_id)
+                if heartbeat:
+                    heartbeat.drop(_target_chunk_id(chunk_item))
+
+    async def review(chunk: dict) -> dict:
+        print(f"\n--- Langgraph Workflow Input for Chunk ID: {chunk['chunk_uuid']} ---")
+        print("Initial state before agent execution. Individual agents will now perform their internal evaluation loops.")
+        print("-" * 40)
+        if not CHUNK_DEADLINE_SECONDS:
+            return {**chunk, "result_with_review": await graph.ainvoke(chunk["report_data"])}
+        # Agents still running at deadline_at are cancelled; the outer timeout only guards the nodes after them
+        report_data = with_deadline(chunk["report_data"])
+        result_with_review = await review_with_timeout(graph, report_data, CHUNK_DEADLINE_SECONDS + LLM_REQUEST_TIMEOUT_SECONDS)
+        return {**chunk, "result_with_review": result_with_review}
+
+    def with_deadline(report_data: dict) -> dict:
+        return {**report_data, "metadata": {**report_data["metadata"], "deadline_at": time.time() + CHUNK_DEADLINE_SECONDS}}
+
+    async def review_pack(pack: list) -> list:
+        print(f"\n--- Packed Review Input for {len(pack)} Chunk(s): {[chunk['chunk_uuid'] for chunk in pack]} ---")
+        states = [chunk["report_data"] for chunk in pack]
+        if not CHUNK_DEADLINE_SECONDS:
+            results = await graph.ainvoke(states)
+        else:
+            # One request per agent covers the whole pack, so the deadline bounds the pack as a whole;
+            # agents still running at deadline_at are cancelled inside the packed reviewer
+            states = [with_deadline(state) for state in states]
+            try:
+                results = await asyncio.wait_for(graph.ainvoke(states), timeout=CHUNK_DEADLINE_SECONDS + LLM_REQUEST_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                print(f"⏰ Review of a pack of {len(states)} chunk(s) timed out; marking its agents unfinished.")
+                results = [mark_unfinished_agents(state, "chunk review timed out") for state in states]
+        return [{**chunk, "result_with_review": result} for chunk, result in zip(pack, results)]
+
+    def persist(chunk: dict) -> dict:
+        persist_chunk_result(chunk, chunk["result_with_review"], worker_id)
+        if heartbeat:
+            heartbeat.drop(chunk["chunk_uuid"])
+        return chunk
+
+    def per_chunk(handler):
+        return lambda pack: [handler(item) for item in pack]
+
+    return StagedPipeline(
+        [
+            Stage("classify", per_chunk(classify_chunk_window) if packed else classify_chunk_window, workers=CLASSIFY_WORKERS, on_error=release_on_error),
+            Stage("prepare", per_chunk(build_chunk_state) if packed else build_chunk_state, workers=1, on_error=release_on_error),
+            Stage("review", review_pack if packed else review, workers=max_inflight_chunks, on_error=release_on_error),
+            Stage("persist", per_chunk(persist) if packed else persist, workers=PERSIST_WORKERS, on_error=release_on_error),
+        ],
+        queue_size=claim_queue_size(max_inflight_chunks) if worker_id else STAGE_QUEUE_SIZE,
+        stats_interval_seconds=STAGE_STATS_INTERVAL_SECONDS,
+    )
+
+
+def drain_chunks(graph, chunk_windows, max_inflight_chunks: int, worker_id: str = None, review_mode: str = REVIEW_MODE, loop=None):
+    """
+    Runs every (previous, target, next) chunk window through the staged
+    pipeline, keeping up to max_inflight_chunks chunks inside the graph at once.
+    Chunk windows are pulled lazily, so a claiming iterator only claims a chunk
+    when the first stage's queue has room. In "packed" mode consecutive
+    windows are grouped first and max_inflight_chunks counts packs.
+    loop is the event loop to run the drain on (a new one if None); serve()
+    passes the same loop to every drain, because the LLM clients' async
+    connection pools stay bound to the loop they were first used on.
+    """
+    packed = review_mode == "packed"
+    heartbeat = None
+    if worker_id:
+        # Claimed chunks can wait in the stage queues and under review for longer than CHUNK_LEASE_SECONDS
+        heartbeat = ChunkLeaseHeartbeat(worker_id)
+        chunk_windows = held_chunk_windows(chunk_windows, heartbeat)
+    if packed:
+        chunk_windows = pack_chunk_windows(chunk_windows)
+    print(f"Running with up to {max_inflight_chunks} {'pack' if packed else 'chunk'}(s) in the review stage.")
+    pipeline = build_chunk_pipeline(graph, max_inflight_chunks, worker_id, packed=packed, heartbeat=heartbeat)
+    metrics_before = prefix_cache_snapshot()
+    if heartbeat:
+        heartbeat.start()
+    try:
+        if loop is None:
+            asyncio.run(pipeline.run(chunk_windows))
+        else:
+            loop.run_until_complete(pipeline.run(chunk_windows))
+    finally:
+        if heartbeat:
+            heartbeat.stop()
+    pipeline.print_stats()
+    print_prefix_cache_report(f"review run (prompt layout: {PROMPT_LAYOUT})", metrics_before, prefix_cache_snapshot())
+    print_llm_metrics()
+    print_response_length_caps()
+    print_retry_strategy_report()
+    print_hedge_report()
+
+
+def load_workflow_graph(review_mode: str = REVIEW_MODE):
+    """
+    Loads the agents from MongoDB and compiles the graph into an
+    AgentRegistry, which is used in place of the compiled graph. With
+    AGENT_HOT_RELOAD the registry watches the agents collection and swaps in
+    a rebuilt graph when agents change; chunks already under review finish
+    on the graph they started with. Returns None if no agents are loaded.
+    """
+    def warm_up(agents):
+        if PREFIX_CACHE_WARMUP and review_mode != "combined":
+            # Prime vLLM's prefix cache with every agent's static prompt prefix
+            print("Warming up the vLLM prefix cache...")
+            metrics_before = prefix_cache_snapshot()
+            warm_up_prefix_cache(llm, list(agents))
+            print_prefix_cache_report("warm-up", metrics_before, prefix_cache_snapshot())
+
+    registry = AgentRegistry(
+        # Load agents dynamically from MongoDB
+        load_agents=lambda: read_agents_from_mongo(llm, eval_llm, defer_evaluation=(review_mode == "batched_eval"), screen_llm_model=screen_llm,
+                                                 hedge_llm_model=hedge_llm),
+        build_graph=lambda agents, settings: build_workflow_graph(review_mode, agents, settings),
+        on_reload=warm_up,
+        # Hot reloads swap prompts too; chunks still on the old graph keep its templates
+        snapshot_templates=AGENT_HOT_RELOAD
+    )
+    print("Loading agents from MongoDB...")
+    if not registry.reload():
+        print("WARNING: No agents loaded. Analysis workflow might not function as expected.")
+        return None
+
+    if AGENT_HOT_RELOAD:
+        registry.start_watching()
+    return registry
+
+
+def run_workflow(max_inflight_chunks: int = MAX_INFLIGHT_CHUNKS, claim_chunks: bool = False, worker_id: str = None, review_mode: str = REVIEW_MODE):
+    # Clear the results collection at the beginning of each program execution
+    # Consider if you really want to clear all results every time you run.
+    # If you're resuming, you might not want to clear previous results.
+    # clear_results_collection() # <--- COMMENTED OUT TO PRESERVE PREVIOUS RUNS' DATA
+
+    graph = load_workflow_graph(review_mode)
+    if graph is None:
+        return # Exit if no agents are loaded
 
     print("Loading chunks from Pipeline 1's database...")
 
@@ -63,163 +613,113 @@ def run_workflow():
     # Uncomment the following two lines and comment out OPTION 2 to use this.
     #print("\n--- OPTION 1: Executing graph.invoke() for the next PENDING chunk from Pipeline 1 ---")
     #next_pending_chunk = get_next_pending_pipeline1_chunk()
-    #documents_to_process = [next_pending_chunk] if next_pending_chunk else []
-
-    # OPTION 2: Process ALL PENDING Pipeline 1 chunks (ACTIVE BY DEFAULT)
-    # Uncomment the following two lines and comment out OPTION 1 to use this.
-    print("\n--- OPTION 2: Executing graph.invoke() for ALL PENDING chunks from Pipeline 1 ---")
-    documents_to_process = get_all_pending_pipeline1_chunks_details()
-
-
-    # --- Common processing loop for selected documents (Pipeline 1 schema) ---
-    if documents_to_process:
-        print(f"Found {len(documents_to_process)} PENDING chunks from Pipeline 1 to process.")
-        for doc_to_process in documents_to_process:
-            if not doc_to_process:
-                continue
-
-            # Fetch the target chunk along with its surrounding context
-            previous_chunk, target_chunk, next_chunk = get_chunk_with_context(
-                doc_id=doc_to_process.get("doc_id"),
-                chunk_index=doc_to_process.get("chunk_index")
-            )
-            
-            # Extract fields from the target chunk
-            p1_chunk_uuid = target_chunk.get("_id")
-            doc_id_p1 = target_chunk.get("doc_id")
-            chunk_index_p1 = target_chunk.get("chunk_index")
-            original_chunk_text = target_chunk.get("text")
-            book_name_p1 = target_chunk.get("doc_name", "Unknown Document")
-            p1_coordinates = target_chunk.get("coordinates")
-            p1_page_number = target_chunk.get("page_number")
-            
-            # Get text for previous and next chunks
-            previous_chunk_text = previous_chunk.get("text", "") if previous_chunk else ""
-            next_chunk_text = next_chunk.get("text", "") if next_chunk else ""
-
-            # Use the target chunk's text for classification
-            merged_text_for_id = original_chunk_text
-
-            print(f"\n--- Processing Chunk ID: {p1_chunk_uuid} (Document: '{book_name_p1}', P1 Doc ID: {doc_id_p1}, P1 Chunk Index: {chunk_index_p1}) ---")
-            print(f"Original Chunk Text: {original_chunk_text}\n")
-
-            classification_result = classify_text(merged_text_for_id)
-            predicted_label = classification_result['predicted_label']
-            print(f"--- Predicted Label for Chunk: \"{predicted_label}\" (Confidence: {classification_result['confidence']}%) ---")
-
-            report_data = {
-                "report_text": merged_text_for_id,
-                "metadata": {
-                    "doc_id": doc_id_p1,
-                    "chunk_index": chunk_index_p1,
-                    "title": book_name_p1,
-                    "chunk_id": p1_chunk_uuid,
-                    "predicted_label": predicted_label,
-                    "classification_scores": classification_result['all_scores'],
-                    "coordinates": p1_coordinates,
-                    "page_number": p1_page_number,
-                    "previous_chunk": previous_chunk_text,
-                    "next_chunk": next_chunk_text,
-                },
-                "main_node_output": {},
-                "aggregate": [],
-                "final_decision_report": "",
-                "current_agent_name": "",
-                "current_agent_input_prompt": "",
-                "current_agent_raw_output": "",
-                "current_agent_parsed_output": {},
-                "current_agent_confidence": 0,
-                "current_agent_retries": 0,
-                "current_agent_human_review": False
-            }
-
-            print(f"\n--- Langgraph Workflow Input for Chunk ID: {p1_chunk_uuid} ---")
-            print("Initial state before agent execution. Individual agents will now perform their internal evaluation loops.")
-            print("-" * 40)
-
-            result_with_review = graph.invoke(report_data)
-
-            overall_chunk_status = "Complete"
-            # Initialize agent_analysis_statuses with all available agents set to "Pending"
-            agent_analysis_statuses = {agent_name: "Pending" for agent_name in available_agents.keys()}
-            
-            # Now iterate over agents that actually produced output and update their status
-            for agent_name, agent_data in result_with_review.get("main_node_output", {}).items():
-                agent_output = agent_data.get("output", {})
-
-                # --- MODIFIED LOGIC: First, check for the specific `None` case as per your request ---
-                # This ensures that if the agent returns None for the key fields, the status is 'Complete'.
-                if (
-                    agent_output.get("problematic_text") is None
-                    and agent_output.get("observation") is None
-                    and agent_output.get("recommendation") is None
-                ):
-                    agent_analysis_statuses[agent_name] = "Complete"
-                else:
-                    # --- EXISTING LOGIC: If it's not the `None` case, run the original validation ---
-                    is_output_complete = True
-                    
-                    if not isinstance(agent_output, dict):
-                        is_output_complete = False
-                    else:
-                        if "issues_found" in agent_output and not isinstance(agent_output.get("issues_found"), bool):
-                            is_output_complete = False
-                        
-                        if "observation" in agent_output and not isinstance(agent_output.get("observation"), str):
-                            is_output_complete = False
-                        
-                        if "recommendation" in agent_output and not isinstance(agent_output.get("recommendation"), str):
-                            is_output_complete = False
-
-                    if is_output_complete:
-                        agent_analysis_statuses[agent_name] = "Complete"
-                    else:
-                        agent_analysis_statuses[agent_name] = "Pending"
-                        overall_chunk_status = "Pending" # If any agent is pending, the overall chunk is pending
-
-            save_results_to_mongo(
-                chunk_uuid=p1_chunk_uuid,
-                doc_id=doc_id_p1,
-                chunk_index=chunk_index_p1,
-                report_text=original_chunk_text,
-                book_name=book_name_p1,
-                predicted_label=predicted_label,
-                classification_scores=classification_result['all_scores'],
-                coordinates=p1_coordinates,
-                page_number=p1_page_number,
-                result_with_review=result_with_review,
-                overall_chunk_status=overall_chunk_status,
-                agent_analysis_statuses=agent_analysis_statuses
-            )
-            
-            update_chunk_analysis_status(
-                doc_id=doc_id_p1,
-                chunk_id=p1_chunk_uuid,
-                analysis_status=overall_chunk_status
-            )
-
-            print("\n--- Langgraph Workflow Final Output (from State) ---")
-            for agent_name, agent_output_data in result_with_review.get("main_node_output", {}).items():
-                print(f"\n--- Summary for {agent_name} ---\n")
-                output_content = agent_output_data.get('output', {})
-                # Updated lines to print the new JSON fields
-                print(f"  Chunk Flagged: {output_content.get('chunk_flagged', 'N/A')}")
-                print(f"  Observation: {output_content.get('observation', 'N/A')}")
-                print(f"  Recommendation: {output_content.get('recommendation', 'N/A')}")
-                # These lines were already correct, but moved here for clarity
-                print(f"  Confidence: {agent_output_data.get('confidence', 0)}%")
-                print(f"  Retries: {agent_output_data.get('retries', 0)}")
-                print(f"  Human Review Needed: {agent_output_data.get('human_review', False)}")
-            
-            print(f"\n--- Overall Chunk Status: {overall_chunk_status} ---\n")
-            print(f"--- Agent Analysis Statuses (per chunk, all agents included): {agent_analysis_statuses} ---\n")
-
-            print("Full Result Dictionary (for debugging):\n")
-            print(result_with_review)
-            print("-" * 40)
+    #chunk_windows = [get_chunk_with_context(next_pending_chunk["doc_id"], next_pending_chunk["chunk_index"])] if next_pending_chunk else []
 
+    if claim_chunks:
+        # OPTION 3: Claim pending chunks one at a time under a lease (safe with several workers)
+        worker_id = worker_id or default_worker_id()
+        print(f"\n--- OPTION 3: Claiming PENDING chunks from Pipeline 1 as worker '{worker_id}' ---")
+        reap_expired_chunk_leases()
+        ensure_results_indexes()
+        chunk_windows = iter_claimed_chunks(worker_id)
     else:
-        print("No PENDING chunks found from Pipeline 1's configured database and collection to process. All chunks might be processed, or none were pending.")
+        # OPTION 2: Process ALL PENDING Pipeline 1 chunks (ACTIVE BY DEFAULT)
+        # Uncomment the following two lines and comment out OPTION 1 to use this.
+        # Pending chunks are streamed book by book with their previous/next
+        # context from a sliding window (see iter_pending_chunks_with_context).
+        print("\n--- OPTION 2: Executing graph.invoke() for ALL PENDING chunks from Pipeline 1 ---")
+        worker_id = None
+        chunk_windows = iter_pending_chunks_with_context()
+
+        first_window = next(chunk_windows, None)
+        if first_window is None:
+            print("No PENDING chunks found from Pipeline 1's configured database and collection to process. All chunks might be processed, or none were pending.")
+            return
+        chunk_windows = itertools.chain([first_window], chunk_windows)
+
+    drain_chunks(graph, chunk_windows, max_inflight_chunks, worker_id, review_mode)
+
+
+def serve(max_inflight_chunks: int = MAX_INFLIGHT_CHUNKS, worker_id: str = None, review_mode: str = REVIEW_MODE):
+    """
+    Daemon mode: loads the classifier, knowledge base, agents and graph once,
+    then keeps draining newly pending chunks as Pipeline 1 ingests them.
+    Chunks are always claimed under a lease, so several daemons can share the queue.
+    """
+    graph = load_workflow_graph(review_mode)
+    if graph is None:
+        return
+
+    worker_id = worker_id or default_worker_id()
+    ensure_pending_chunk_indexes()
+    ensure_results_indexes()
+    print(f"\n--- SERVE MODE: Worker '{worker_id}' waiting for PENDING chunks from Pipeline 1 ---")
+
+    # One event loop for the life of the daemon, shared by every drain
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        for reason in watch_for_pending_chunks(not_attempted_before_seconds=PENDING_RETRY_BACKOFF_SECONDS):
+            print(f"\n--- Draining pending chunks (trigger: {reason}) ---")
+            reap_expired_chunk_leases()
+            try:
+                drain_chunks(
+                    graph,
+                    iter_claimed_chunks(worker_id, retry_backoff_seconds=PENDING_RETRY_BACKOFF_SECONDS),
+                    max_inflight_chunks,
+                    worker_id,
+                    review_mode,
+                    loop=loop
+                )
+            except Exception as e:
+                # The failed chunk was released back to pending; keep serving.
+                print(f"❌ Error while draining pending chunks: {e}")
+    except KeyboardInterrupt:
+        print(f"\n🛑 Worker '{worker_id}' stopped.")
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
 
 if __name__ == "__main__":
-    run_workflow()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the Pipeline 2 agent review workflow over pending Pipeline 1 chunks.")
+    parser.add_argument(
+        "--max-inflight-chunks",
+        type=int,
+        default=MAX_INFLIGHT_CHUNKS,
+        help="Number of chunks kept in the graph at once (1 = sequential, the original behaviour)."
+    )
+    parser.add_argument(
+        "--claim",
+        action="store_true",
+        help="Claim pending chunks under a lease instead of taking a snapshot, so several workers can share one queue."
+    )
+    parser.add_argument(
+        "--serve", "--watch",
+        dest="serve",
+        action="store_true",
+        help="Stay running and process newly pending chunks as they arrive (implies --claim)."
+    )
+    parser.add_argument(
+        "--review-mode",
+        choices=["per_agent", "combined", "batched_eval", "packed"],
+        default=REVIEW_MODE,
+        help="per_agent: one agent + evaluator call per agent; combined: one call reviewing the chunk for all agents; "
+             "batched_eval: one agent call per agent + one evaluator call per chunk; "
+             "packed: one call per agent reviewing several consecutive short chunks."
+    )
+    parser.add_argument(
+        "--worker-id",
+        default=None,
+        help="Worker id recorded on claimed chunks (defaults to <hostname>-<pid>)."
+    )
+    args = parser.parse_args()
+    if args.serve:
+        serve(max_inflight_chunks=max(1, args.max_inflight_chunks), worker_id=args.worker_id, review_mode=args.review_mode)
+    else:
+        run_workflow(
+            max_inflight_chunks=max(1, args.max_inflight_chunks),
+            claim_chunks=args.claim,
+            worker_id=args.worker_id,
+            review_mode=args.review_mode
+        )
@@ -22,7 +22,15 @@ class State(TypedDict):
         current_agent_parsed_output: Dict # The parsed JSON output from the agent
         current_agent_confidence: int
         current_agent_retries: int
+        current_agent_retry_counts: Dict # Retries of this agent per cause (agent_invalid, evaluator_invalid, low_confidence)
+        current_agent_retry_strategy: Dict # Strategy of the latest attempt if it was a low-confidence retry (retry_strategies.py)
+        current_agent_deadline_exceeded: bool # The chunk deadline passed before an accepted attempt (transient failure)
         current_agent_human_review: bool
+        current_agent_evaluation: Dict # Whether the evaluator ran for the latest attempt, and why (evaluation policy audit)
+        current_agent_cascade: Dict # Which model tier produced the latest attempt (model cascade)
+        current_agent_consistency: Dict # Votes and agreement of the latest self-consistency sampling, if used
+        current_agent_logprob_confidence: Dict # Confidence derived from the latest response's token logprobs, if requested
+        current_agent_validation: Dict # Local validator result (hard errors, warnings) of the latest attempt
     """
     report_text: str
     final_decision_report: str
@@ -35,4 +43,12 @@ class State(TypedDict):
     current_agent_parsed_output: Dict
     current_agent_confidence: int
     current_agent_retries: int
-    current_agent_human_review: bool
\ No newline at end of file
+    current_agent_retry_counts: Dict
+    current_agent_retry_strategy: Dict
+    current_agent_deadline_exceeded: bool
+    current_agent_human_review: bool
+    current_agent_evaluation: Dict
+    current_agent_cascade: Dict
+    current_agent_consistency: Dict
+    current_agent_logprob_confidence: Dict
+    current_agent_validation: Dict
\ No newline at end of file
@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 from pymongo import MongoClient
 from bson.objectid import ObjectId
 from typing import Dict, Any, List
+from llm_hedging import hedged_call
 
 # Load environment variables from the .env file.
 # Make sure your .env file is in the same directory.
@@ -25,6 +26,11 @@ MONGO_CHUNK_COLLECTION = "chunks"
 
 MAX_RETRIES = 3
 RETRY_DELAY = 5
+# Per-request timeout, so a hung connection fails the attempt instead of blocking the chunk
+LLM_TIMEOUT_SECONDS = 120
+# Second endpoint for hedged requests (HEDGE_ENABLED, see llm_hedging.py), the same variable llm_init.py reads;
+# unset hedges to LLM_API_BASE again.
+LLM_HEDGE_API_BASE = os.getenv("HEDGE_LLM_BASE_URL")
 
 # Define the Agent Name for file logging and reporting
 AGENT_NAME = "National_Security_Agent full book_new"
@@ -50,6 +56,47 @@ def _log_prompt_to_file(chunk_id: str, prompt: str, log_filename: str):
     except Exception as e:
         print(f"Error logging prompt for chunk {chunk_id} to {log_filename}: {e}")
 
+# --- HEDGED COMPLETION ---
+# Created once; None when LLM_HEDGE_API_BASE is unset (hedges then use the caller's client)
+_hedge_client = OpenAI(
+    api_key=os.getenv("HEDGE_LLM_API_KEY", LLM_API_KEY),
+    base_url=LLM_HEDGE_API_BASE,
+    timeout=LLM_TIMEOUT_SECONDS,
+    max_retries=0,
+) if LLM_HEDGE_API_BASE else None
+
+def _streamed_completion_text(client: OpenAI, cancel_event, **params) -> str:
+    """
+    The response text of a streamed chat completion. Once cancel_event is set
+    (the request lost a hedged race) the stream is closed, which aborts the
+    request in vLLM.
+    """
+    stream = client.chat.completions.create(stream=True, **params)
+    pieces = []
+    try:
+        for chunk in stream:
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if chunk.choices and chunk.choices[0].delta.content:
+                pieces.append(chunk.choices[0].delta.content)
+    finally:
+        stream.close()
+    return "".join(pieces)
+
+def _hedged_completion(client: OpenAI, **params) -> str:
+    """
+    The response text of client.chat.completions.create(**params), with a
+    hedged duplicate request when the call is slower than usual. Both
+    requests are streamed, so the loser is stopped instead of running to
+    completion.
+    """
+    hedge_client = _hedge_client or client
+    return hedged_call(
+        lambda cancel_event: _streamed_completion_text(client, cancel_event, **params),
+        params["messages"],
+        lambda cancel_event: _streamed_completion_text(hedge_client, cancel_event, **params),
+    )
+
 # --- EVALUATION FUNCTION (FOR LLM RESPONSE QUALITY) ---
 # chunk_id is now passed to this function for logging purposes
 def evaluate_agent_response(chunk_id: str, agent_prompt: str, agent_response: str) -> Dict[str, Any]:
@@ -62,7 +109,7 @@ def evaluate_agent_response(chunk_id: str, agent_prompt: str, agent_response: st
     RETRY_DELAY = 3  # seconds between attempts
 
     try:
-        eval_client = OpenAI(api_key=LLM_API_KEY, base_url=LLM_API_BASE)
+        eval_client = OpenAI(api_key=LLM_API_KEY, base_url=LLM_API_BASE, timeout=LLM_TIMEOUT_SECONDS, max_retries=0)
     except Exception as e:
         print(f"API Init Error for evaluator: {e}")
         return {"confidence": 50}  # fallback
@@ -118,14 +165,14 @@ Respond **only** with a valid JSON:
         try:
             print(f"[Attempt {attempt}/{MAX_RETRIES}] Evaluating response...")
 
-            eval_completion = eval_client.chat.completions.create(
+            eval_response_content = _hedged_completion(
+                eval_client,
                 messages=[{"role": "user", "content": eval_prompt_template}],
                 model=LLM_MODEL,
                 #response_format={"type": "json_object"},
                 temperature=0.1,
             )
 
-            eval_response_content = eval_completion.choices[0].message.content
 
             # --- JSON Extraction & Cleanup ---
             clean_content = None
@@ -180,6 +227,8 @@ def review_text_with_llm(title: str, target_chunk: str, chunk_id: str, prev_chun
         client = OpenAI(
             api_key=LLM_API_KEY,
             base_url=LLM_API_BASE,
+            timeout=LLM_TIMEOUT_SECONDS,
+            max_retries=0,
         )
     except Exception as e:
         error_result = {"chunk_flagged": "human", "observation": f"API Init Error: {e}", "spans": [], "recommendation": "fact-check", "confidence": 0.0}
@@ -336,7 +385,8 @@ Return **only** the JSON above — no commentary.
         print(f"Attempt {attempt + 1} of {MAX_RETRIES} for chunk ID: {chunk_id}")
         
         try:
-            chat_completion = client.chat.completions.create(
+            raw_response_content = _hedged_completion(
+                client,
                 messages=[
                     {
                         "role": "system",
@@ -349,7 +399,6 @@ Return **only** the JSON above — no commentary.
                 temperature=0.1,
             )
 
-            raw_response_content = chat_completion.choices[0].message.content
             
             # Use json.loads() directly since response_format="json_object" is set
             result = json.loads(raw_response_content)
@@ -0,0 +1,135 @@
+# output_validator.py
+# Deterministic checks of a parsed agent output, run before any evaluator
+# call: allowed values, spans vs. verdict, length limits, and whether every
+# span quote actually occurs in the target chunk. Hard failures are sent
+# back to the agent with a repair prompt; soft ones are only reported.
+import re
+from typing import List
+from config import OBSERVATION_MAX_WORDS, QUOTE_MAX_WORDS
+
+ALLOWED_VERDICTS = ("true", "false", "human")
+ALLOWED_RECOMMENDATIONS = ("delete", "rephrase", "fact-check", "provide-references")
+
+
+def normalize_for_match(text: str) -> str:
+    """Lowercased words only, so quotes match regardless of punctuation, spacing and the '; ' chunk formatting."""
+    return " ".join(re.findall(r"\w+", str(text).lower()))
+
+
+def quote_in_chunk(quote: str, normalized_chunks: List[str]) -> bool:
+    """True if every part of the quote (split at ellipses) occurs in one of the chunk texts."""
+    parts = [normalize_for_match(part) for part in re.split(r"\.\.\.|…", quote)]
+    parts = [part for part in parts if part]
+    if not parts:
+        return False
+    # Padded so a part only matches whole words
+    return any(all(f" {part} " in f" {chunk} " for part in parts) for chunk in normalized_chunks)
+
+
+def output_verdict(parsed_output: dict) -> str:
+    """
+    The verdict of an agent output, lowercased: issues_found (as the prompt
+    asks) if set, else chunk_flagged; "human" if neither is set.
+    """
+    value = parsed_output.get("issues_found")
+    if value is None:
+        value = parsed_output.get("chunk_flagged")
+    if value is None:
+        return "human"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value).lower()
+
+
+def verdict_confidence(parsed_output: dict):
+    """
+    The confidence (0-1) an agent output reports for its verdict: a top-level
+    confidence if it has one, else the lowest of its span confidences (the
+    prompt asks for one per span). None if the output reports none.
+    """
+    values = [parsed_output.get("confidence")]
+    if values[0] is None:
+        spans = parsed_output.get("spans")
+        values = [span.get("confidence") for span in spans if isinstance(span, dict)] if isinstance(spans, list) else []
+    confidences = []
+    for value in values:
+        try:
+            confidences.append(float(value))
+        except (TypeError, ValueError):
+            continue
+    return min(confidences) if confidences else None
+
+
+def validate_agent_output(parsed_output: dict, chunk_texts: List[str]) -> dict:
+    """
+    Returns {"passed": bool, "errors": [...], "warnings": [...]} for an agent
+    output as the model returned it, before defaults are filled in for
+    missing keys. errors are hard failures (the output is retried with a
+    repair prompt); warnings are recorded but do not block the output.
+    """
+    errors, warnings = [], []
+
+    verdict = output_verdict(parsed_output)
+    if parsed_output.get("issues_found") is None and parsed_output.get("chunk_flagged") is None:
+        errors.append("chunk_flagged/issues_found is missing.")
+    elif verdict not in ALLOWED_VERDICTS:
+        errors.append(f'chunk_flagged/issues_found is "{verdict}", expected one of {", ".join(ALLOWED_VERDICTS)}.')
+
+    # The prompt asks for a recommendation per span only; a top-level one is checked if the model adds it
+    recommendation = parsed_output.get("recommendation")
+    if recommendation is not None and str(recommendation).lower() not in ALLOWED_RECOMMENDATIONS:
+        errors.append(f'recommendation is "{recommendation}", expected one of {", ".join(ALLOWED_RECOMMENDATIONS)}.')
+
+    spans = parsed_output.get("spans") or []
+    if not isinstance(spans, list):
+        errors.append("spans must be a list.")
+        spans = []
+    if spans and verdict in ("false", "human"):
+        # The prompt asks for an empty spans array in both cases; "false" with spans contradicts itself
+        if verdict == "false":
+            errors.append('spans must be empty when the chunk is not flagged ("false").')
+        else:
+            warnings.append('spans should be empty when the verdict is "human".')
+    if verdict == "true" and not spans:
+        warnings.append("the chunk is flagged but no span is quoted.")
+
+    normalized_chunks = [normalize_for_match(text) for text in chunk_texts if text]
+    for index, span in enumerate(spans, 1):
+        if not isinstance(span, dict):
+            errors.append(f"span {index} is not an object.")
+            continue
+        quote = str(span.get("quote", "")).strip()
+        if not quote:
+            errors.append(f"span {index} has an empty quote.")
+            continue
+        if not quote_in_chunk(quote, normalized_chunks):
+            errors.append(f'span {index} quote "{quote[:80]}" does not occur in the Target Chunk.')
+        if len(quote.split()) > QUOTE_MAX_WORDS:
+            warnings.append(f"span {index} quote is longer than {QUOTE_MAX_WORDS} words.")
+        span_recommendation = span.get("recommendation")
+        if span_recommendation is not None and str(span_recommendation).lower() not in ALLOWED_RECOMMENDATIONS:
+            errors.append(f'span {index} recommendation is "{span_recommendation}", expected one of {", ".join(ALLOWED_RECOMMENDATIONS)}.')
+
+    if len(str(parsed_output.get("observation", "")).split()) > OBSERVATION_MAX_WORDS:
+        warnings.append(f"observation is longer than {OBSERVATION_MAX_WORDS} words.")
+
+    return {"passed": not errors, "errors": errors, "warnings": warnings}
+
+
+def build_repair_instructions(validation: dict, previous_output: str) -> str:
+    """Appended to the agent's user prompt on a retry after failed hard checks."""
+    failed_checks = "\n".join(f"- {error}" for error in validation["errors"])
+    return f"""
+
+---
+
+### Correction Required
+
+Your previous response failed these checks:
+{failed_checks}
+
+Previous response:
+{previous_output}
+
+Return the corrected JSON object only. Every span quote must be copied verbatim from the Target Chunk.
+"""
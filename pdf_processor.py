@@ -1,10 +1,19 @@
+import threading
+import time
 import pymongo
-from typing import Dict, List, Optional, Tuple
-from config import MONGO_URI, PDF_DB_NAME, PDF_COLLECTION_NAME
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import MONGO_URI, PDF_DB_NAME, PDF_COLLECTION_NAME, CHUNK_LEASE_SECONDS, CHUNK_LEASE_RENEW_SECONDS, WATCH_POLL_SECONDS, WATCH_HEARTBEAT_SECONDS, CONTEXT_STREAM_BATCH_SIZE
 
 # Assuming Pipeline 1's documents collection is named 'documents'
 DOCUMENTS_COLLECTION_NAME = "documents"
 
+# Pipeline 1 writes "pending" and Pipeline 2 writes "Pending" back for incomplete chunks.
+PENDING_STATUSES = ["pending", "Pending"]
+# Status of a chunk that a worker has claimed and is currently analysing.
+IN_PROGRESS_STATUS = "in_progress"
+
 # Original function (kept as per request, but not directly used for P1 chunks in mains1.py)
 def get_merged_pdf_chunks() -> Dict[str, str]:
     """
@@ -197,6 +206,101 @@ def get_chunk_with_context(doc_id: str, chunk_index: int) -> Tuple[Optional[Dict
     return previous_chunk, target_chunk, next_chunk
 
 
+def iter_pending_chunks_with_context(batch_size: int = CONTEXT_STREAM_BATCH_SIZE) -> Iterator[Tuple[Optional[Dict], Dict, Optional[Dict]]]:
+    """
+    Streams every pending chunk together with its context, ordered by
+    (doc_id, chunk_index), as (previous_chunk, target_chunk, next_chunk) triples.
+
+    Each book is read once, in chunk_index order, through a rolling
+    three-element buffer, so the context comes from the same read as the
+    target instead of a separate query per chunk. Document names are resolved
+    once per book and a single MongoClient is used for the whole stream.
+    Books are read in pages of batch_size chunks (short queries instead of one
+    long-lived cursor), limited to the range around that book's pending chunks.
+    As in get_chunk_with_context, a neighbour is None if its chunk_index is missing.
+    """
+    mongo_client = None
+    try:
+        mongo_client = pymongo.MongoClient(MONGO_URI)
+        db = mongo_client[PDF_DB_NAME]
+        collection = db[PDF_COLLECTION_NAME]
+
+        # One pass over the pending chunks: which books, and which chunk_index range in each.
+        pending_ranges = list(collection.aggregate([
+            {"$match": {"analysis_status": {"$regex": "^pending$", "$options": "i"}}},
+            {"$group": {
+                "_id": "$doc_id",
+                "first_index": {"$min": "$chunk_index"},
+                "last_index": {"$max": "$chunk_index"},
+                "pending_count": {"$sum": 1},
+            }},
+            {"$sort": {"_id": 1}},
+        ]))
+        if not pending_ranges:
+            return
+
+        total_pending = sum(r["pending_count"] for r in pending_ranges)
+        print(f"Streaming {total_pending} PENDING chunks across {len(pending_ranges)} document(s).")
+
+        doc_ids = [r["_id"] for r in pending_ranges]
+        doc_names_map = {}
+        for doc_info in db[DOCUMENTS_COLLECTION_NAME].find({"doc_id": {"$in": doc_ids}}, {"doc_id": 1, "doc_name": 1}):
+            doc_names_map[doc_info["doc_id"]] = doc_info.get("doc_name", "Unknown Document")
+
+        projection = {"_id": 1, "text": 1, "doc_id": 1, "chunk_index": 1, "coordinates": 1, "page_number": 1, "analysis_status": 1}
+
+        for pending_range in pending_ranges:
+            doc_id = pending_range["_id"]
+            doc_name = doc_names_map.get(doc_id, "Unknown Document")
+            window: List[Optional[Dict]] = [None, None, None]  # previous, target, next
+
+            def emit():
+                previous_chunk, target_chunk, next_chunk = window
+                if target_chunk is None or str(target_chunk.get("analysis_status", "")).lower() != "pending":
+                    return None
+                index = target_chunk["chunk_index"]
+                if previous_chunk is not None and previous_chunk["chunk_index"] != index - 1:
+                    previous_chunk = None
+                if next_chunk is not None and next_chunk["chunk_index"] != index + 1:
+                    next_chunk = None
+                return previous_chunk, target_chunk, next_chunk
+
+            last_index = pending_range["first_index"] - 2
+            while True:
+                page = list(collection.find(
+                    {
+                        "doc_id": doc_id,
+                        "chunk_index": {"$gt": last_index, "$lte": pending_range["last_index"] + 1},
+                    },
+                    projection,
+                    sort=[('chunk_index', pymongo.ASCENDING)],
+                    limit=batch_size
+                ))
+                for chunk in page:
+                    chunk["doc_name"] = doc_name
+                    window = [window[1], window[2], chunk]
+                    triple = emit()
+                    if triple:
+                        yield triple
+                if len(page) < batch_size:
+                    break
+                last_index = page[-1]["chunk_index"]
+
+            # Flush the last chunk of the book, which has no next chunk.
+            window = [window[1], window[2], None]
+            triple = emit()
+            if triple:
+                yield triple
+
+    except pymongo.errors.ConnectionFailure as e:
+        print(f"❌ MongoDB connection error when streaming pending chunks with context: {e}")
+    except Exception as e:
+        print(f"❌ An unexpected error occurred when streaming pending chunks with context: {e}")
+    finally:
+        if mongo_client:
+            mongo_client.close()
+
+
 def get_next_pending_pipeline1_chunk() -> Dict:
     """
     Retrieves the next chunk with 'analysis_status' as "Pending" from the collection
@@ -279,4 +383,295 @@ def get_all_pending_pipeline1_chunks_details() -> List[Dict]:
         if "doc_id" in chunk:
             chunk["doc_name"] = doc_names_map.get(chunk["doc_id"], "Unknown Document")
 
-    return all_pending_chunks
\ No newline at end of file
+    return all_pending_chunks
+
+
+# --- LEASE-BASED CLAIMING SO SEVERAL WORKERS CAN DRAIN ONE QUEUE ---
+
+def _claimable_chunks_query(not_attempted_since: Optional[datetime] = None) -> Dict:
+    """Query matching pending chunks, optionally only those not attempted since a given time."""
+    query = {"analysis_status": {"$in": PENDING_STATUSES}}
+    if not_attempted_since is not None:
+        query["$or"] = [
+            {"last_attempt_at": {"$exists": False}},
+            {"last_attempt_at": {"$lt": not_attempted_since}},
+        ]
+    return query
+
+def claim_next_pending_chunk(worker_id: str, lease_seconds: int = CHUNK_LEASE_SECONDS, not_attempted_since: Optional[datetime] = None) -> Optional[Dict]:
+    """
+    Atomically claims the next pending chunk (ordered by doc_id and chunk_index)
+    for worker_id. The chunk is marked 'in_progress' with the worker id and a
+    lease expiry, so no other worker can claim it until the lease runs out.
+
+    If not_attempted_since is given, chunks already attempted at or after that
+    time are skipped. A draining worker passes its start time so chunks it just
+    wrote back as "Pending" are not claimed again in the same pass.
+
+    Returns the claimed chunk (P1 schema + doc_name), or None if nothing is pending.
+    """
+    mongo_client_pdf = None
+    claimed_chunk = None
+    now = datetime.now()
+    query = _claimable_chunks_query(not_attempted_since)
+    try:
+        mongo_client_pdf = pymongo.MongoClient(MONGO_URI)
+        pdf_db = mongo_client_pdf[PDF_DB_NAME]
+        pdf_collection = pdf_db[PDF_COLLECTION_NAME]
+        claimed_chunk = pdf_collection.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "analysis_status": IN_PROGRESS_STATUS,
+                    "claimed_by": worker_id,
+                    "claimed_at": now,
+                    "last_attempt_at": now,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                },
+                "$inc": {"claim_count": 1},
+            },
+            projection={"_id": 1, "text": 1, "doc_id": 1, "chunk_index": 1, "coordinates": 1, "page_number": 1},
+            sort=[('doc_id', pymongo.ASCENDING), ('chunk_index', pymongo.ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+    except pymongo.errors.ConnectionFailure as e:
+        print(f"❌ MongoDB connection error when claiming a pending Pipeline 1 chunk: {e}")
+    except Exception as e:
+        print(f"❌ An unexpected error occurred when claiming a pending Pipeline 1 chunk: {e}")
+    finally:
+        if mongo_client_pdf:
+            mongo_client_pdf.close()
+
+    if claimed_chunk and "doc_id" in claimed_chunk:
+        claimed_chunk["doc_name"] = _get_doc_name_from_p1_documents_collection(claimed_chunk["doc_id"])
+        print(f"🔒 Worker '{worker_id}' claimed chunk '{claimed_chunk['_id']}' (doc_id={claimed_chunk['doc_id']}, chunk_index={claimed_chunk.get('chunk_index')}).")
+    return claimed_chunk
+
+
+def release_chunk_claim(chunk_id, worker_id: str, analysis_status: str = "pending") -> bool:
+    """
+    Returns a chunk claimed by worker_id to the queue (e.g. after a failure),
+    clearing its lease. Does nothing if the lease now belongs to another worker.
+    """
+    mongo_client_pdf = None
+    released = False
+    try:
+        mongo_client_pdf = pymongo.MongoClient(MONGO_URI)
+        pdf_db = mongo_client_pdf[PDF_DB_NAME]
+        pdf_collection = pdf_db[PDF_COLLECTION_NAME]
+        update_result = pdf_collection.update_one(
+            {"_id": chunk_id, "claimed_by": worker_id, "analysis_status": IN_PROGRESS_STATUS},
+            {
+                "$set": {"analysis_status": analysis_status},
+                "$unset": {"claimed_by": "", "claimed_at": "", "lease_expires_at": ""},
+            }
+        )
+        released = update_result.modified_count > 0
+        if released:
+            print(f"🔓 Worker '{worker_id}' released chunk '{chunk_id}' back to '{analysis_status}'.")
+    except pymongo.errors.ConnectionFailure as e:
+        print(f"❌ MongoDB connection error when releasing chunk '{chunk_id}': {e}")
+    except Exception as e:
+        print(f"❌ An unexpected error occurred when releasing chunk '{chunk_id}': {e}")
+    finally:
+        if mongo_client_pdf:
+            mongo_client_pdf.close()
+    return released
+
+
+def renew_chunk_leases(chunk_ids: List, worker_id: str, lease_seconds: int = CHUNK_LEASE_SECONDS) -> int:
+    """
+    Extends the leases worker_id still holds on chunk_ids by lease_seconds from
+    now. Returns the number of leases renewed; a chunk whose lease was reaped
+    (and possibly claimed by another worker) is not renewed.
+    """
+    if not chunk_ids:
+        return 0
+    mongo_client_pdf = None
+    renewed = 0
+    try:
+        mongo_client_pdf = pymongo.MongoClient(MONGO_URI)
+        pdf_db = mongo_client_pdf[PDF_DB_NAME]
+        pdf_collection = pdf_db[PDF_COLLECTION_NAME]
+        update_result = pdf_collection.update_many(
+            {"_id": {"$in": list(chunk_ids)}, "claimed_by": worker_id, "analysis_status": IN_PROGRESS_STATUS},
+            {"$set": {"lease_expires_at": datetime.now() + timedelta(seconds=lease_seconds)}}
+        )
+        renewed = update_result.matched_count
+        if renewed < len(chunk_ids):
+            print(f"⚠️ Worker '{worker_id}' no longer holds {len(chunk_ids) - renewed} of {len(chunk_ids)} chunk lease(s).")
+    except pymongo.errors.ConnectionFailure as e:
+        print(f"❌ MongoDB connection error when renewing chunk leases: {e}")
+    except Exception as e:
+        print(f"❌ An unexpected error occurred when renewing chunk leases: {e}")
+    finally:
+        if mongo_client_pdf:
+            mongo_client_pdf.close()
+    return renewed
+
+
+class ChunkLeaseHeartbeat:
+    """
+    Renews the leases of the chunks a worker holds every renew_seconds, so a
+    chunk waiting in the pipeline's queues or under a long review is not
+    reaped and claimed by a second worker. Chunks are held from their claim
+    until their result is saved or the claim is released.
+    """
+
+    def __init__(self, worker_id: str, lease_seconds: int = CHUNK_LEASE_SECONDS, renew_seconds: float = CHUNK_LEASE_RENEW_SECONDS):
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.renew_seconds = max(1.0, renew_seconds)
+        self.chunk_ids = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def hold(self, chunk_id):
+        with self.lock:
+            self.chunk_ids.add(chunk_id)
+
+    def drop(self, chunk_id):
+        with self.lock:
+            self.chunk_ids.discard(chunk_id)
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="chunk-lease-heartbeat", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def _run(self):
+        while not self.stopped.wait(self.renew_seconds):
+            with self.lock:
+                chunk_ids = list(self.chunk_ids)
+            if chunk_ids:
+                renew_chunk_leases(chunk_ids, self.worker_id, self.lease_seconds)
+
+
+def reap_expired_chunk_leases() -> int:
+    """
+    Returns every 'in_progress' chunk whose lease has expired to the pending
+    queue (its worker crashed or was stopped). Returns the number of chunks reaped.
+    """
+    mongo_client_pdf = None
+    reaped = 0
+    try:
+        mongo_client_pdf = pymongo.MongoClient(MONGO_URI)
+        pdf_db = mongo_client_pdf[PDF_DB_NAME]
+        pdf_collection = pdf_db[PDF_COLLECTION_NAME]
+        update_result = pdf_collection.update_many(
+            {"analysis_status": IN_PROGRESS_STATUS, "lease_expires_at": {"$lt": datetime.now()}},
+            {
+                "$set": {"analysis_status": "pending"},
+                "$unset": {"claimed_by": "", "claimed_at": "", "lease_expires_at": ""},
+            }
+        )
+        reaped = update_result.modified_count
+        if reaped:
+            print(f"♻️ Returned {reaped} chunk(s) with expired leases to pending.")
+    except pymongo.errors.ConnectionFailure as e:
+        print(f"❌ MongoDB connection error when reaping expired chunk leases: {e}")
+    except Exception as e:
+        print(f"❌ An unexpected error occurred when reaping expired chunk leases: {e}")
+    finally:
+        if mongo_client_pdf:
+            mongo_client_pdf.close()
+    return reaped
+
+
+# --- WATCHING FOR NEWLY INGESTED PENDING CHUNKS (DAEMON MODE) ---
+
+def ensure_pending_chunk_indexes():
+    """
+    Creates the indexes used by claiming, lease reaping and pending-chunk polling.
+    Safe to call on every startup (create_index is a no-op if the index exists).
+    """
+    mongo_client_pdf = None
+    try:
+        mongo_client_pdf = pymongo.MongoClient(MONGO_URI)
+        pdf_db = mongo_client_pdf[PDF_DB_NAME]
+        pdf_collection = pdf_db[PDF_COLLECTION_NAME]
+        pdf_collection.create_index(
+            [("analysis_status", pymongo.ASCENDING), ("doc_id", pymongo.ASCENDING), ("chunk_index", pymongo.ASCENDING)],
+            name="analysis_status_doc_id_chunk_index"
+        )
+        pdf_collection.create_index(
+            [("analysis_status", pymongo.ASCENDING), ("lease_expires_at", pymongo.ASCENDING)],
+            name="analysis_status_lease_expires_at"
+        )
+        print(f"✅ Pending-chunk indexes ensured on '{PDF_DB_NAME}.{PDF_COLLECTION_NAME}'.")
+    except pymongo.errors.ConnectionFailure as e:
+        print(f"❌ MongoDB connection error when creating chunk indexes: {e}")
+    except Exception as e:
+        print(f"❌ An unexpected error occurred when creating chunk indexes: {e}")
+    finally:
+        if mongo_client_pdf:
+            mongo_client_pdf.close()
+
+
+def watch_for_pending_chunks(poll_interval_seconds: float = WATCH_POLL_SECONDS, heartbeat_seconds: float = WATCH_HEARTBEAT_SECONDS, not_attempted_before_seconds: float = 0):
+    """
+    Generator that yields a reason string ("startup", "change_stream", "poll"
+    or "heartbeat") every time newly pending chunks may be available.
+
+    Uses a MongoDB change stream on the chunks collection when the server is a
+    replica set, and falls back to polling the analysis_status index otherwise.
+    A heartbeat is yielded at least every heartbeat_seconds so the caller can
+    reap expired leases and retry chunks whose backoff has elapsed.
+    When polling, chunks attempted within the last not_attempted_before_seconds
+    do not count as new work.
+    """
+    yield "startup"
+
+    mongo_client_pdf = pymongo.MongoClient(MONGO_URI)
+    try:
+        pdf_db = mongo_client_pdf[PDF_DB_NAME]
+        pdf_collection = pdf_db[PDF_COLLECTION_NAME]
+
+        # Inserts of pending chunks and updates that set a chunk (back) to pending.
+        change_pipeline = [
+            {"$match": {
+                "$or": [
+                    {"operationType": {"$in": ["insert", "replace"]}, "fullDocument.analysis_status": {"$in": PENDING_STATUSES}},
+                    {"operationType": "update", "updateDescription.updatedFields.analysis_status": {"$in": PENDING_STATUSES}},
+                ]
+            }}
+        ]
+
+        try:
+            with pdf_collection.watch(change_pipeline, max_await_time_ms=int(poll_interval_seconds * 1000)) as stream:
+                print(f"👀 Watching '{PDF_DB_NAME}.{PDF_COLLECTION_NAME}' for pending chunks via change stream.")
+                last_signal = time.monotonic()
+                while stream.alive:
+                    change = stream.try_next()
+                    if change is not None:
+                        # Drain any burst of events (e.g. a whole book inserted) into one signal.
+                        while stream.try_next() is not None:
+                            pass
+                        last_signal = time.monotonic()
+                        yield "change_stream"
+                    elif time.monotonic() - last_signal >= heartbeat_seconds:
+                        last_signal = time.monotonic()
+                        yield "heartbeat"
+        except pymongo.errors.OperationFailure as e:
+            # Change streams need a replica set or sharded cluster.
+            print(f"⚠️ Change streams unavailable ({e}). Falling back to polling every {poll_interval_seconds}s.")
+
+        last_signal = time.monotonic()
+        while True:
+            time.sleep(poll_interval_seconds)
+            not_attempted_since = datetime.now() - timedelta(seconds=not_attempted_before_seconds)
+            if pdf_collection.find_one(_claimable_chunks_query(not_attempted_since), {"_id": 1}):
+                last_signal = time.monotonic()
+                yield "poll"
+            elif time.monotonic() - last_signal >= heartbeat_seconds:
+                last_signal = time.monotonic()
+                yield "heartbeat"
+    finally:
+        mongo_client_pdf.close()
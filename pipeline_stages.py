@@ -0,0 +1,168 @@
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# Marks the end of the stream on a stage's input queue.
+_END_OF_STREAM = object()
+
+
+class Stage:
+    """
+    One step of a StagedPipeline.
+
+    handler receives an item and returns the item for the next stage (or None
+    to drop it). Plain functions run in worker threads, coroutine functions
+    run on the event loop. on_error(item, exception) is called when handler
+    raises; the item is then dropped.
+    """
+
+    def __init__(self, name: str, handler: Callable, workers: int = 1, on_error: Optional[Callable] = None):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.on_error = on_error
+        self.is_async = inspect.iscoroutinefunction(handler)
+
+        # --- Stats ---
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.queue_depth_samples = 0
+        self.queue_depth_total = 0
+        self.queue_depth_max = 0
+
+    async def handle(self, item: Any) -> Any:
+        if self.is_async:
+            return await self.handler(item)
+        return await asyncio.to_thread(self.handler, item)
+
+    def record_queue_depth(self, depth: int):
+        self.queue_depth_samples += 1
+        self.queue_depth_total += depth
+        self.queue_depth_max = max(self.queue_depth_max, depth)
+
+    def stats(self, elapsed_seconds: float) -> Dict[str, Any]:
+        capacity = self.workers * elapsed_seconds
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "avg_queue_depth": round(self.queue_depth_total / self.queue_depth_samples, 2) if self.queue_depth_samples else 0.0,
+            "max_queue_depth": self.queue_depth_max,
+            "utilization": round(self.busy_seconds / capacity, 3) if capacity else 0.0,
+            "avg_seconds_per_item": round(self.busy_seconds / self.processed, 3) if self.processed else 0.0,
+        }
+
+
+class StagedPipeline:
+    """
+    Runs items through a sequence of stages connected by bounded queues, so
+    that each stage works on a different item at the same time (e.g. the
+    classifier on chunk k+1 while the LLM reviews chunk k and chunk k-1 is
+    being saved). Each stage has its own worker count, and queue depths are
+    sampled so the bottleneck stage can be identified.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 4, stats_interval_seconds: float = 0):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.stats_interval_seconds = stats_interval_seconds
+        self.started_at = None
+        self.finished_at = None
+
+    async def run(self, items: Iterable):
+        self.started_at = time.monotonic()
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+
+        async def feed():
+            # The source may block (e.g. claim queries), so it is pulled from a thread.
+            iterator = iter(items)
+            while True:
+                item = await asyncio.to_thread(next, iterator, _END_OF_STREAM)
+                if item is _END_OF_STREAM:
+                    break
+                await queues[0].put(item)
+            for _ in range(self.stages[0].workers):
+                await queues[0].put(_END_OF_STREAM)
+
+        async def run_stage(index: int):
+            stage = self.stages[index]
+            input_queue = queues[index]
+            output_queue = queues[index + 1] if index + 1 < len(self.stages) else None
+
+            async def worker():
+                while True:
+                    item = await input_queue.get()
+                    if item is _END_OF_STREAM:
+                        return
+                    stage.record_queue_depth(input_queue.qsize())
+                    started = time.monotonic()
+                    try:
+                        result = await stage.handle(item)
+                        stage.processed += 1
+                    except Exception as e:
+                        stage.failed += 1
+                        result = None
+                        print(f"❌ Stage '{stage.name}' failed on an item: {e}")
+                        if stage.on_error:
+                            try:
+                                await asyncio.to_thread(stage.on_error, item, e)
+                            except Exception as hook_error:
+                                print(f"❌ Error handler of stage '{stage.name}' failed: {hook_error}")
+                    finally:
+                        stage.busy_seconds += time.monotonic() - started
+                    if output_queue is not None and result is not None:
+                        await output_queue.put(result)
+
+            await asyncio.gather(*(worker() for _ in range(stage.workers)))
+            if output_queue is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    await output_queue.put(_END_OF_STREAM)
+
+        async def sample_queue_depths(done: asyncio.Event):
+            last_report = time.monotonic()
+            while not done.is_set():
+                for stage, queue in zip(self.stages, queues):
+                    stage.record_queue_depth(queue.qsize())
+                if self.stats_interval_seconds and time.monotonic() - last_report >= self.stats_interval_seconds:
+                    last_report = time.monotonic()
+                    self.print_stats()
+                try:
+                    await asyncio.wait_for(done.wait(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    pass
+
+        done = asyncio.Event()
+        sampler = asyncio.create_task(sample_queue_depths(done))
+        try:
+            await asyncio.gather(feed(), *(run_stage(i) for i in range(len(self.stages))))
+        finally:
+            done.set()
+            await sampler
+            self.finished_at = time.monotonic()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        if self.started_at is None:
+            return []
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return [stage.stats(elapsed) for stage in self.stages]
+
+    def bottleneck(self) -> Optional[str]:
+        """The stage whose workers were busy the largest share of the time."""
+        stats = self.stats()
+        if not stats:
+            return None
+        return max(stats, key=lambda s: s["utilization"])["stage"]
+
+    def print_stats(self):
+        print("\n--- Pipeline Stage Stats ---")
+        for s in self.stats():
+            print(
+                f"  {s['stage']:<10} workers={s['workers']} processed={s['processed']} failed={s['failed']} "
+                f"queue(avg={s['avg_queue_depth']}, max={s['max_queue_depth']}) "
+                f"utilization={s['utilization']:.0%} avg={s['avg_seconds_per_item']}s/item"
+            )
+        print(f"  Bottleneck stage: {self.bottleneck()}")
+        print("-" * 40)
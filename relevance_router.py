@@ -0,0 +1,84 @@
+# relevance_router.py
+# Decides per chunk which agents need to run. Each agent document may carry
+# a "relevance" rule; agents without one run on every chunk (the previous
+# behaviour). Example:
+#   "relevance": {
+#       "labels": ["bilateral realtions", "institutions"],   # classifier labels that concern the agent
+#       "min_score": 0.2,                                     # minimum classifier score on those labels
+#       "keywords": ["China", "Saudi Arabia", "embassy"],     # case-insensitive whole-word matches
+#       "entities": ["ISI", "SEATO"]                          # case-sensitive names/acronyms
+#   }
+# An agent runs if any keyword or entity occurs in the target chunk, or if
+# its best label score reaches min_score.
+import re
+
+NOT_APPLICABLE_STATUS = "not_applicable"
+
+
+def normalize_relevance_rule(raw_rule):
+    """Normalizes an agent document's relevance field; None means the agent always runs."""
+    if not isinstance(raw_rule, dict):
+        return None
+    rule = {
+        "labels": [str(label) for label in raw_rule.get("labels", []) or []],
+        "keywords": [str(keyword) for keyword in raw_rule.get("keywords", []) or []],
+        "entities": [str(entity) for entity in raw_rule.get("entities", []) or []],
+    }
+    try:
+        rule["min_score"] = float(raw_rule.get("min_score", 0.0))
+    except (TypeError, ValueError):
+        rule["min_score"] = 0.0
+    if not (rule["labels"] or rule["keywords"] or rule["entities"]):
+        return None
+    # Whole-word patterns are compiled once per agent
+    rule["keyword_patterns"] = [re.compile(r"\b" + re.escape(k) + r"\b", re.IGNORECASE) for k in rule["keywords"]]
+    rule["entity_patterns"] = [re.compile(r"\b" + re.escape(e) + r"\b") for e in rule["entities"]]
+    return rule
+
+
+def relevance_decision(rule, text: str, classification_scores: dict):
+    """
+    Applies an agent's relevance rule to a chunk.
+    Returns (should_run, reason).
+    """
+    if rule is None:
+        return True, "no relevance rule"
+    text = text or ""
+
+    for keyword, pattern in zip(rule["keywords"], rule["keyword_patterns"]):
+        if pattern.search(text):
+            return True, f"keyword '{keyword}'"
+    for entity, pattern in zip(rule["entities"], rule["entity_patterns"]):
+        if pattern.search(text):
+            return True, f"entity '{entity}'"
+
+    if rule["labels"]:
+        scores = classification_scores or {}
+        best_label = max(rule["labels"], key=lambda label: scores.get(label, 0.0))
+        best_score = scores.get(best_label, 0.0)
+        if best_score >= rule["min_score"]:
+            return True, f"label '{best_label}' score {best_score:.3f} >= {rule['min_score']}"
+        return False, f"best label '{best_label}' score {best_score:.3f} < {rule['min_score']}, no keyword or entity match"
+
+    return False, "no keyword or entity match"
+
+
+def route_chunk_to_agents(agent_rules: dict, text: str, classification_scores: dict) -> dict:
+    """{agent_name: {"run": bool, "reason": str}} for every agent in agent_rules."""
+    decisions = {}
+    for agent_name, rule in agent_rules.items():
+        should_run, reason = relevance_decision(rule, text, classification_scores)
+        decisions[agent_name] = {"run": should_run, "reason": reason}
+    return decisions
+
+
+def not_applicable_entry(reason: str) -> dict:
+    """The main_node_output entry recorded for an agent the router skipped."""
+    return {
+        "output": {},
+        "confidence": 0,
+        "retries": 0,
+        "human_review": False,
+        "analysis_status": NOT_APPLICABLE_STATUS,
+        "relevance": reason,
+    }
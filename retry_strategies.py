@@ -0,0 +1,118 @@
+# retry_strategies.py
+# Decides how a low-confidence retry differs from the attempt before it, so
+# a retry is not the same request at the same settings again, and tracks
+# how much each strategy raises the confidence per retry.
+#
+# Stored per agent, e.g.
+#   "retry_strategy": ["resample", "critique", "strict_schema"]
+#   "retry_strategy": {"sequence": ["critique"], "temperature_step": 0.2, "max_temperature": 0.9}
+# Retry n uses the n-th entry of the sequence (the last one is repeated).
+import random
+import threading
+from config import RETRY_STRATEGY_SEQUENCE, RETRY_TEMPERATURE_STEP, RETRY_MAX_TEMPERATURE
+
+# resample:      new seed and a higher temperature
+# critique:      the evaluator's critique of the previous response as a corrective suffix
+# strict_schema: the response constrained to the agent output JSON schema
+RETRY_STRATEGIES = ("resample", "critique", "strict_schema")
+
+
+def normalize_retry_strategy(raw_policy) -> dict:
+    """Normalizes an agent document's retry_strategy field to {"sequence", "temperature_step", "max_temperature"}."""
+    if isinstance(raw_policy, str):
+        raw_policy = {"sequence": [raw_policy]}
+    elif isinstance(raw_policy, list):
+        raw_policy = {"sequence": raw_policy}
+    if not isinstance(raw_policy, dict):
+        raw_policy = {}
+
+    sequence = [str(name).lower() for name in raw_policy.get("sequence", RETRY_STRATEGY_SEQUENCE)]
+    unknown = [name for name in sequence if name not in RETRY_STRATEGIES]
+    if unknown:
+        print(f"⚠️ Warning: Unknown retry strategies {unknown} ignored.")
+    sequence = [name for name in sequence if name in RETRY_STRATEGIES] or ["resample"]
+    try:
+        temperature_step = float(raw_policy.get("temperature_step", RETRY_TEMPERATURE_STEP))
+        max_temperature = float(raw_policy.get("max_temperature", RETRY_MAX_TEMPERATURE))
+    except (TypeError, ValueError):
+        temperature_step, max_temperature = RETRY_TEMPERATURE_STEP, RETRY_MAX_TEMPERATURE
+    return {"sequence": sequence, "temperature_step": temperature_step, "max_temperature": max_temperature}
+
+
+def critique_suffix(evaluation: dict, confidence: int, previous_output: str) -> str:
+    """Appended to the agent's user prompt on a critique retry."""
+    return f"""
+
+---
+
+### Reviewer Feedback on Your Previous Response
+
+A reviewer scored your previous response {confidence}% and noted:
+{evaluation["critique"]}
+
+Previous response:
+{previous_output}
+
+Address the feedback and return the corrected JSON object only.
+"""
+
+
+def plan_retry(retry_policy: dict, retry_number: int, state: dict, base_temperature: float, strict_kwargs: dict) -> dict:
+    """
+    The plan of low-confidence retry number retry_number (1-based):
+    {"strategy", "retry", "llm_kwargs", "prompt_suffix", "confidence_before"}.
+    A critique retry without a critique to use (e.g. the confidence came
+    from self-consistency) falls back to resample.
+    """
+    sequence = retry_policy["sequence"]
+    strategy = sequence[min(retry_number, len(sequence)) - 1]
+    evaluation = state.get("current_agent_evaluation") or {}
+    confidence_before = state.get("current_agent_confidence", 0)
+    if strategy == "critique" and not evaluation.get("critique"):
+        strategy = "resample"
+
+    llm_kwargs, prompt_suffix = {}, ""
+    if strategy == "resample":
+        temperature = min(retry_policy["max_temperature"], base_temperature + retry_policy["temperature_step"] * retry_number)
+        llm_kwargs = {"seed": random.randint(0, 2**31 - 1), "temperature": round(temperature, 3)}
+    elif strategy == "critique":
+        prompt_suffix = critique_suffix(evaluation, confidence_before, state.get("current_agent_raw_output", ""))
+    elif strategy == "strict_schema":
+        llm_kwargs = dict(strict_kwargs)
+    return {"strategy": strategy, "retry": retry_number, "llm_kwargs": llm_kwargs, "prompt_suffix": prompt_suffix, "confidence_before": confidence_before}
+
+
+class RetryStrategyStats:
+    """Per strategy: how many retries it made, their confidence gain, and how many reached the agent's threshold."""
+
+    def __init__(self):
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def record(self, strategy: str, confidence_before: int, confidence_after: int, passed: bool):
+        with self.lock:
+            entry = self.stats.setdefault(strategy, {"retries": 0, "gain_total": 0, "improved": 0, "passed": 0})
+            entry["retries"] += 1
+            entry["gain_total"] += confidence_after - confidence_before
+            entry["improved"] += int(confidence_after > confidence_before)
+            entry["passed"] += int(passed)
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {strategy: dict(entry) for strategy, entry in self.stats.items()}
+
+
+retry_strategy_stats = RetryStrategyStats()
+
+
+def print_retry_strategy_report():
+    summary = retry_strategy_stats.summary()
+    if not summary:
+        return
+    print("\n--- Retry Strategy Effectiveness ---")
+    print(f"  {'strategy':<14} {'retries':>8} {'avg gain':>9} {'improved':>9} {'passed':>7}")
+    for strategy, entry in sorted(summary.items()):
+        retries = entry["retries"]
+        print(f"  {strategy:<14} {retries:>8} {entry['gain_total'] / retries:>+9.1f} "
+              f"{entry['improved'] / retries:>9.0%} {entry['passed'] / retries:>7.0%}")
+    print("-" * 40)
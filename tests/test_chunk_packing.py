@@ -0,0 +1,77 @@
+import json
+
+from chunk_packing import add_pack_results, follows, pack_chunk_windows
+
+
+def window(chunk_index, doc_id="book-1", text="x" * 40):
+    target = {"doc_id": doc_id, "chunk_index": chunk_index, "text": text}
+    return (None, target, None)
+
+
+def pack_indexes(packs):
+    return [[target["chunk_index"] for _, target, _ in pack] for pack in packs]
+
+
+def test_follows():
+    assert follows({"doc_id": "a", "chunk_index": 3}, {"doc_id": "a", "chunk_index": 2})
+    assert not follows({"doc_id": "b", "chunk_index": 3}, {"doc_id": "a", "chunk_index": 2})
+    assert not follows({"doc_id": "a", "chunk_index": 4}, {"doc_id": "a", "chunk_index": 2})
+    assert not follows({"doc_id": "a", "chunk_index": 1}, {"doc_id": "a"})
+
+
+def test_packs_end_at_max_chunks():
+    packs = pack_chunk_windows([window(i) for i in range(5)], token_budget=1000, max_chunks=2)
+    assert pack_indexes(packs) == [[0, 1], [2, 3], [4]]
+
+
+def test_packs_end_at_a_gap_or_a_new_book():
+    windows = [window(0), window(1), window(3), window(4, doc_id="book-2"), window(5, doc_id="book-2")]
+    assert pack_indexes(pack_chunk_windows(windows, token_budget=1000, max_chunks=8)) == [[0, 1], [3], [4, 5]]
+
+
+def test_packs_end_at_the_token_budget():
+    # 40 characters is ~10 estimated tokens
+    packs = pack_chunk_windows([window(i) for i in range(4)], token_budget=25, max_chunks=8)
+    assert pack_indexes(packs) == [[0, 1], [2, 3]]
+
+
+def test_oversized_chunk_is_packed_alone():
+    windows = [window(0), window(1, text="x" * 400), window(2)]
+    assert pack_indexes(pack_chunk_windows(windows, token_budget=25, max_chunks=8)) == [[0], [1], [2]]
+
+
+def test_windows_are_pulled_lazily():
+    pulled = []
+
+    def claim():
+        for i in range(6):
+            pulled.append(i)
+            yield window(i)
+
+    packs = pack_chunk_windows(claim(), token_budget=1000, max_chunks=2)
+    assert pack_indexes([next(packs)]) == [[0, 1]]
+    assert pulled == [0, 1, 2]
+
+
+def test_pack_results_in_the_prompt_format_are_accepted():
+    # One output per chunk id, each in EVIDENCE_MAPPING_BLOCK's format
+    raw_output = json.dumps({
+        "c1": {"issues_found": "false", "observation": "Nothing.", "spans": []},
+        "c2": {"issues_found": "true", "observation": "Disputed date.",
+               "spans": [{"quote": "annexed in 1871", "recommendation": "fact-check", "confidence": 0.75}]},
+    })
+    pack_texts = [("c1", ["The river flooded."]), ("c2", ["The province was annexed in 1871."])]
+    updates = [{"aggregate": [], "main_node_output": {}} for _ in range(3)]
+    add_pack_results(updates, "agent", [0, 2], pack_texts, raw_output, {"total_tokens": 0})
+
+    not_flagged, flagged = updates[0]["main_node_output"]["agent"], updates[2]["main_node_output"]["agent"]
+    assert not updates[1]["main_node_output"]
+    assert not not_flagged["human_review"] and not flagged["human_review"]
+    assert flagged["confidence"] == 75
+    assert flagged["pack"] == {"chunks": 2, "position": 1}
+
+
+def test_pack_chunk_missing_from_the_response_goes_to_human_review():
+    updates = [{"aggregate": [], "main_node_output": {}}]
+    add_pack_results(updates, "agent", [0], [("c1", ["text"])], "{}", {"total_tokens": 0})
+    assert updates[0]["main_node_output"]["agent"]["human_review"]
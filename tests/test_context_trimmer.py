@@ -0,0 +1,46 @@
+from config import CONTEXT_TOKEN_BUDGET, PIPELINE1_CHUNK_SIZE
+from context_trimmer import estimate_tokens, split_sentences, trim_context
+
+# Two neighbours of a Pipeline 1 chunk (~200 characters each)
+PREVIOUS_CHUNK = ("The army marched north through the pass. Supplies ran low within a week. "
+                  "The general ordered a halt near the river, and scouts went ahead to find a crossing.")
+NEXT_CHUNK = ("At dawn the crossing began. Several boats were lost to the current. "
+              "By noon the vanguard had reached the far bank and set up camp on the ridge above.")
+
+
+def test_default_budget_trims_pipeline1_sized_context():
+    assert len(PREVIOUS_CHUNK) <= PIPELINE1_CHUNK_SIZE and len(NEXT_CHUNK) <= PIPELINE1_CHUNK_SIZE
+    previous_chunk, next_chunk, stats = trim_context(PREVIOUS_CHUNK, NEXT_CHUNK, CONTEXT_TOKEN_BUDGET)
+    assert stats["tokens_saved"] > 0
+    assert stats["trimmed_tokens"] <= CONTEXT_TOKEN_BUDGET
+
+
+def test_keeps_sentences_nearest_the_target_chunk():
+    previous_chunk, next_chunk, _ = trim_context(PREVIOUS_CHUNK, NEXT_CHUNK, CONTEXT_TOKEN_BUDGET)
+    assert PREVIOUS_CHUNK.endswith(previous_chunk)
+    assert NEXT_CHUNK.startswith(next_chunk)
+    assert previous_chunk and next_chunk
+
+
+def test_context_within_budget_is_unchanged():
+    previous_chunk, next_chunk, stats = trim_context("Short one.", "Short two.", 100)
+    assert (previous_chunk, next_chunk) == ("Short one.", "Short two.")
+    assert stats["tokens_saved"] == 0
+
+
+def test_zero_budget_disables_trimming():
+    previous_chunk, next_chunk, stats = trim_context(PREVIOUS_CHUNK, NEXT_CHUNK, 0)
+    assert (previous_chunk, next_chunk) == (PREVIOUS_CHUNK, NEXT_CHUNK)
+    assert stats["tokens_saved"] == 0
+
+
+def test_oversized_nearest_sentence_keeps_its_boundary_words():
+    long_sentence = " ".join(f"word{i}" for i in range(100)) + "."
+    previous_chunk, _, _ = trim_context(long_sentence, "", 10)
+    assert long_sentence.endswith(previous_chunk)
+    assert 0 < estimate_tokens(previous_chunk) <= 10
+
+
+def test_split_sentences():
+    assert split_sentences("One. Two! Three?") == ["One.", "Two!", "Three?"]
+    assert split_sentences("") == []
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+
+import pytest
+
+import llm_hedging
+from llm_hedging import HedgeTracker, ahedged_call, hedged_call
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    """A fresh tracker with hedging on, 5 samples needed, p80 delay and a 50% hedge rate cap."""
+    tracker = HedgeTracker()
+    monkeypatch.setattr(llm_hedging, "hedge_tracker", tracker)
+    monkeypatch.setattr(llm_hedging, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(llm_hedging, "HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(llm_hedging, "HEDGE_PERCENTILE", 0.8)
+    monkeypatch.setattr(llm_hedging, "HEDGE_MAX_RATE", 0.5)
+    return tracker
+
+
+def seed(tracker, seconds, count=10, bucket=256):
+    for _ in range(count):
+        tracker.record_latency(bucket, seconds)
+
+
+def test_no_delay_until_enough_samples(tracker):
+    seed(tracker, 1.0, count=4)
+    assert tracker.hedge_delay(256) is None
+    tracker.record_latency(256, 1.0)
+    assert tracker.hedge_delay(256) == 1.0
+
+
+def test_delay_is_the_percentile_of_the_bucket(tracker):
+    for seconds in range(1, 11):
+        tracker.record_latency(256, float(seconds))
+    assert tracker.hedge_delay(256) == 9.0
+    assert tracker.hedge_delay(512) is None
+
+
+def test_rate_cap(tracker):
+    for _ in range(4):
+        tracker.start_call()
+    assert [tracker.try_hedge() for _ in range(3)] == [True, True, False]
+    assert tracker.hedges == 2
+
+
+def test_async_hedge_wins_over_a_slow_primary(tracker):
+    seed(tracker, 0.05)
+    calls = []
+
+    async def call():
+        calls.append("primary")
+        await asyncio.sleep(5)
+        return "primary"
+
+    async def hedge_call():
+        calls.append("hedge")
+        return "hedge"
+
+    tracker.calls = 10  # room under the rate cap
+    assert asyncio.run(ahedged_call(call, "prompt", hedge_call)) == "hedge"
+    assert calls == ["primary", "hedge"]
+    # Timed from the primary's start, so the sample is at least the hedge delay
+    assert tracker.latencies[256][-1] >= 0.05
+
+
+def test_async_primary_is_cancelled_with_its_caller(tracker):
+    seed(tracker, 5.0)
+    cancelled = asyncio.Event()
+
+    async def call():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    async def caller():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(ahedged_call(call, "prompt"), timeout=0.05)
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+    asyncio.run(caller())
+    assert cancelled.is_set()
+
+
+def test_sync_primary_runs_inline_without_a_delay(tracker):
+    threads = []
+    assert hedged_call(lambda cancel_event: threads.append(threading.current_thread()) or "ok", "prompt") == "ok"
+    assert threads == [threading.current_thread()]
+    assert len(tracker.latencies[256]) == 1
+
+
+def test_sync_hedge_wins_and_cancels_the_primary(tracker):
+    seed(tracker, 0.05)
+    tracker.calls = 10
+    primary_cancelled = threading.Event()
+
+    def call(cancel_event):
+        if cancel_event.wait(5):
+            primary_cancelled.set()
+        return "primary"
+
+    assert hedged_call(call, "prompt", lambda cancel_event: "hedge") == "hedge"
+    assert primary_cancelled.wait(1)
+
+
+def test_disabled_hedging_calls_once(monkeypatch):
+    monkeypatch.setattr(llm_hedging, "HEDGE_ENABLED", False)
+    assert hedged_call(lambda cancel_event: cancel_event, "prompt") is None
+    assert asyncio.run(ahedged_call(lambda: asyncio.sleep(0, "done"), "prompt")) == "done"
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+from llm_streaming import JsonObjectScanner, stream_json_response, astream_json_response
+
+
+def feed_all(fragments):
+    scanner = JsonObjectScanner()
+    for fragment in fragments:
+        if scanner.feed(fragment):
+            break
+    return scanner
+
+
+def test_scanner_skips_fence_and_trailing_text():
+    scanner = feed_all(['```json\n{"a": 1', ', "b": [1, 2]}', '\n```\nExplanation follows'])
+    assert scanner.complete
+    assert scanner.json_text == '{"a": 1, "b": [1, 2]}'
+
+
+def test_scanner_ignores_braces_and_escaped_quotes_in_strings():
+    text = '{"quote": "a } b ] \\" { c", "spans": [{"quote": "x"}]} tail'
+    scanner = feed_all([text[i:i + 3] for i in range(0, len(text), 3)])
+    assert scanner.complete
+    assert scanner.json_text == text[:-len(" tail")]
+
+
+def test_scanner_incomplete_object():
+    scanner = feed_all(['{"a": {"b": 1}'])
+    assert scanner.started and not scanner.complete
+
+
+class FakeStreamingModel:
+    """Yields the response in fragments and records whether the stream was closed before its end."""
+
+    def __init__(self, fragments):
+        self.fragments = fragments
+        self.yielded = 0
+        self.closed = False
+
+    def stream(self, messages, **kwargs):
+        try:
+            for fragment in self.fragments:
+                self.yielded += 1
+                yield SimpleNamespace(content=fragment)
+        finally:
+            self.closed = True
+
+    async def astream(self, messages, **kwargs):
+        try:
+            for fragment in self.fragments:
+                self.yielded += 1
+                yield SimpleNamespace(content=fragment)
+        finally:
+            self.closed = True
+
+
+RESPONSE = ['{"chunk_flagged": ', '"false"', ', "spans": []}', " I hope this helps", " with your review."]
+
+
+def test_stream_stops_at_the_end_of_the_json_object():
+    model = FakeStreamingModel(RESPONSE)
+    assert stream_json_response(model, [], "test-sync") == '{"chunk_flagged": "false", "spans": []}'
+    assert model.yielded == 3
+    assert model.closed
+
+
+def test_async_stream_stops_at_the_end_of_the_json_object():
+    model = FakeStreamingModel(RESPONSE)
+    assert asyncio.run(astream_json_response(model, [], "test-async")) == '{"chunk_flagged": "false", "spans": []}'
+    assert model.yielded == 3
+    assert model.closed
+
+
+def test_stream_without_json_returns_everything():
+    model = FakeStreamingModel(["no ", "json ", "here"])
+    assert stream_json_response(model, [], "test-no-json") == "no json here"
+
+
+def test_cancelled_stream_is_abandoned():
+    cancel_event = threading.Event()
+    cancel_event.set()
+    model = FakeStreamingModel(RESPONSE)
+    assert stream_json_response(model, [], "test-cancel", cancel_event=cancel_event) == ""
+    assert model.closed
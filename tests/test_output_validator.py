@@ -0,0 +1,82 @@
+from output_validator import output_verdict, quote_in_chunk, normalize_for_match, validate_agent_output, verdict_confidence
+
+CHUNK = "The province was annexed in 1871; its governor resigned a year later."
+
+
+def output(**fields):
+    return {"observation": "ok", "spans": [], **fields}
+
+
+def test_outputs_in_the_prompt_format_pass():
+    # EVIDENCE_MAPPING_BLOCK's output format: no top-level recommendation or confidence
+    not_flagged = {"issues_found": "false", "observation": "Nothing.", "spans": []}
+    flagged = {
+        "issues_found": "true",
+        "observation": "The annexation date is disputed.",
+        "spans": [{"quote": "annexed in 1871", "recommendation": "fact-check", "confidence": 0.75}],
+    }
+    assert validate_agent_output(not_flagged, [CHUNK])["passed"]
+    assert validate_agent_output(flagged, [CHUNK]) == {"passed": True, "errors": [], "warnings": []}
+
+
+def test_verdict_prefers_issues_found():
+    # fill_missing_output_keys adds chunk_flagged="human" to outputs in the prompt's issues_found format
+    assert output_verdict({"issues_found": "false", "chunk_flagged": "human"}) == "false"
+    assert output_verdict({"chunk_flagged": "TRUE"}) == "true"
+    assert output_verdict({"issues_found": True}) == "true"
+    assert output_verdict({"issues_found": False}) == "false"
+    assert output_verdict({}) == "human"
+
+
+def test_not_flagged_output_with_spans_fails():
+    validation = validate_agent_output(output(issues_found="false", spans=[{"quote": "its governor resigned"}]), [CHUNK])
+    assert not validation["passed"]
+    assert any("spans must be empty" in error for error in validation["errors"])
+
+
+def test_fabricated_quote_fails():
+    validation = validate_agent_output(output(issues_found="true", spans=[{"quote": "the king abdicated"}]), [CHUNK])
+    assert not validation["passed"]
+    assert any("does not occur" in error for error in validation["errors"])
+
+
+def test_missing_verdict_fails():
+    validation = validate_agent_output(output(), [CHUNK])
+    assert validation["errors"] == ["chunk_flagged/issues_found is missing."]
+
+
+def test_unknown_values_fail():
+    validation = validate_agent_output(output(chunk_flagged="maybe", recommendation="ignore"), [CHUNK])
+    assert len(validation["errors"]) == 2
+
+
+def test_unknown_span_recommendation_fails():
+    spans = [{"quote": "annexed in 1871", "recommendation": "ignore", "confidence": 0.5}]
+    validation = validate_agent_output(output(issues_found="true", spans=spans), [CHUNK])
+    assert validation["errors"] == ['span 1 recommendation is "ignore", expected one of delete, rephrase, fact-check, provide-references.']
+
+
+def test_valid_flagged_output_passes():
+    validation = validate_agent_output(output(issues_found="true", spans=[{"quote": "The province was annexed in 1871"}]), [CHUNK])
+    assert validation == {"passed": True, "errors": [], "warnings": []}
+
+
+def test_human_verdict_with_spans_only_warns():
+    validation = validate_agent_output(output(chunk_flagged="human", spans=[{"quote": "annexed"}]), [CHUNK])
+    assert validation["passed"]
+    assert validation["warnings"]
+
+
+def test_quote_matching_ignores_punctuation_and_needs_whole_words():
+    chunks = [normalize_for_match(CHUNK)]
+    assert quote_in_chunk("annexed in 1871 -- its governor", chunks)
+    assert quote_in_chunk("province was annexed ... governor resigned", chunks)
+    assert not quote_in_chunk("nex", chunks)
+    assert not quote_in_chunk("...", chunks)
+
+
+def test_verdict_confidence():
+    spans = [{"quote": "a", "confidence": 1.0}, {"quote": "b", "confidence": "0.5"}, {"quote": "c"}]
+    assert verdict_confidence({"issues_found": "true", "spans": spans}) == 0.5
+    assert verdict_confidence({"issues_found": "false", "confidence": 0.75, "spans": spans}) == 0.75
+    assert verdict_confidence({"issues_found": "false", "spans": []}) is None
@@ -0,0 +1,51 @@
+from retry_strategies import RetryStrategyStats, normalize_retry_strategy, plan_retry
+
+POLICY = {"sequence": ["resample", "critique", "strict_schema"], "temperature_step": 0.2, "max_temperature": 0.5}
+STRICT_KWARGS = {"response_format": {"type": "json_schema"}}
+
+
+def test_normalize_accepts_a_name_a_list_or_a_dict():
+    assert normalize_retry_strategy("Critique")["sequence"] == ["critique"]
+    assert normalize_retry_strategy(["critique", "resample"])["sequence"] == ["critique", "resample"]
+    policy = normalize_retry_strategy({"sequence": ["strict_schema"], "temperature_step": "0.3"})
+    assert policy["sequence"] == ["strict_schema"]
+    assert policy["temperature_step"] == 0.3
+
+
+def test_normalize_drops_unknown_strategies():
+    assert normalize_retry_strategy(["bogus", "critique"])["sequence"] == ["critique"]
+    assert normalize_retry_strategy(["bogus"])["sequence"] == ["resample"]
+
+
+def test_resample_raises_the_temperature_up_to_the_maximum():
+    first = plan_retry({**POLICY, "sequence": ["resample"]}, 1, {}, 0.0, STRICT_KWARGS)
+    assert first["strategy"] == "resample"
+    assert first["llm_kwargs"]["temperature"] == 0.2
+    assert "seed" in first["llm_kwargs"]
+    third = plan_retry({**POLICY, "sequence": ["resample"]}, 3, {}, 0.0, STRICT_KWARGS)
+    assert third["llm_kwargs"]["temperature"] == 0.5
+
+
+def test_sequence_entries_are_used_in_order_and_the_last_repeats():
+    state = {"current_agent_evaluation": {"critique": "The quote is not in the chunk."},
+             "current_agent_confidence": 40, "current_agent_raw_output": '{"spans": []}'}
+    plans = [plan_retry(POLICY, n, state, 0.0, STRICT_KWARGS) for n in (1, 2, 3, 4)]
+    assert [plan["strategy"] for plan in plans] == ["resample", "critique", "strict_schema", "strict_schema"]
+    assert "The quote is not in the chunk." in plans[1]["prompt_suffix"]
+    assert "40%" in plans[1]["prompt_suffix"]
+    assert plans[2]["llm_kwargs"] == STRICT_KWARGS
+    assert plans[2]["llm_kwargs"] is not STRICT_KWARGS
+
+
+def test_critique_without_a_critique_falls_back_to_resample():
+    plan = plan_retry({**POLICY, "sequence": ["critique"]}, 1, {"current_agent_confidence": 30}, 0.0, STRICT_KWARGS)
+    assert plan["strategy"] == "resample"
+    assert plan["prompt_suffix"] == ""
+    assert plan["confidence_before"] == 30
+
+
+def test_stats():
+    stats = RetryStrategyStats()
+    stats.record("critique", 40, 80, True)
+    stats.record("critique", 60, 50, False)
+    assert stats.summary() == {"critique": {"retries": 2, "gain_total": 30, "improved": 1, "passed": 1}}
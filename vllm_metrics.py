@@ -0,0 +1,94 @@
+# vllm_metrics.py
+# Reads vLLM's Prometheus /metrics endpoint to report how well the prefix
+# cache is working: prefix-cache hit ratio, time-to-first-token and prefill
+# (prompt-processing) time, as deltas between two snapshots.
+import urllib.request
+from config import VLLM_METRICS_URL
+
+# Counter names differ between vLLM versions; the first one present is used.
+PREFIX_CACHE_QUERIES_METRICS = ("vllm:prefix_cache_queries_total", "vllm:gpu_prefix_cache_queries_total", "vllm:gpu_prefix_cache_queries")
+PREFIX_CACHE_HITS_METRICS = ("vllm:prefix_cache_hits_total", "vllm:gpu_prefix_cache_hits_total", "vllm:gpu_prefix_cache_hits")
+PREFIX_CACHE_HIT_RATE_GAUGE = "vllm:gpu_prefix_cache_hit_rate"  # older engines only expose a gauge
+
+
+def parse_prometheus_text(text: str) -> dict:
+    """Sums the samples of every metric in Prometheus text format over their labels."""
+    metrics = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            name_and_labels, value = line.rsplit(" ", 1)
+            name = name_and_labels.split("{", 1)[0]
+            metrics[name] = metrics.get(name, 0.0) + float(value)
+        except ValueError:
+            continue
+    return metrics
+
+
+def fetch_vllm_metrics(metrics_url: str = VLLM_METRICS_URL, timeout_seconds: float = 5) -> dict:
+    """Returns the parsed /metrics of the vLLM server, or {} if it cannot be reached."""
+    try:
+        with urllib.request.urlopen(metrics_url, timeout=timeout_seconds) as response:
+            return parse_prometheus_text(response.read().decode("utf-8"))
+    except Exception as e:
+        print(f"⚠️ Could not read vLLM metrics from {metrics_url}: {e}")
+        return {}
+
+
+def _first_metric(metrics: dict, names: tuple) -> float:
+    for name in names:
+        if name in metrics:
+            return metrics[name]
+    return 0.0
+
+
+def prefix_cache_snapshot(metrics_url: str = VLLM_METRICS_URL) -> dict:
+    """The cumulative counters needed for a prefix-cache report."""
+    metrics = fetch_vllm_metrics(metrics_url)
+    return {
+        "available": bool(metrics),
+        "prefix_queries": _first_metric(metrics, PREFIX_CACHE_QUERIES_METRICS),
+        "prefix_hits": _first_metric(metrics, PREFIX_CACHE_HITS_METRICS),
+        "hit_rate_gauge": metrics.get(PREFIX_CACHE_HIT_RATE_GAUGE),
+        "prompt_tokens": metrics.get("vllm:prompt_tokens_total", 0.0),
+        "ttft_sum": metrics.get("vllm:time_to_first_token_seconds_sum", 0.0),
+        "ttft_count": metrics.get("vllm:time_to_first_token_seconds_count", 0.0),
+        "prefill_sum": metrics.get("vllm:request_prefill_time_seconds_sum", 0.0),
+        "prefill_count": metrics.get("vllm:request_prefill_time_seconds_count", 0.0),
+    }
+
+
+def prefix_cache_report(before: dict, after: dict) -> dict:
+    """Prefix-hit ratio and average prompt-processing times between two snapshots."""
+    def delta(key):
+        return (after.get(key) or 0.0) - (before.get(key) or 0.0)
+
+    queries, hits = delta("prefix_queries"), delta("prefix_hits")
+    ttft_count, prefill_count = delta("ttft_count"), delta("prefill_count")
+    hit_ratio = hits / queries if queries else after.get("hit_rate_gauge")
+    return {
+        "requests": int(ttft_count),
+        "prompt_tokens": int(delta("prompt_tokens")),
+        "prefix_hit_ratio": hit_ratio,
+        "avg_ttft_seconds": delta("ttft_sum") / ttft_count if ttft_count else None,
+        "avg_prefill_seconds": delta("prefill_sum") / prefill_count if prefill_count else None,
+    }
+
+
+def print_prefix_cache_report(label: str, before: dict, after: dict):
+    if not (before.get("available") and after.get("available")):
+        print(f"⚠️ vLLM metrics unavailable; no prefix cache report for '{label}'.")
+        return
+    report = prefix_cache_report(before, after)
+
+    def fmt(value, pattern):
+        return pattern.format(value) if value is not None else "n/a"
+
+    print(f"\n--- vLLM Prefix Cache: {label} ---")
+    print(f"  Requests: {report['requests']}  Prompt tokens: {report['prompt_tokens']}")
+    print(f"  Prefix cache hit ratio: {fmt(report['prefix_hit_ratio'], '{:.1%}')}")
+    print(f"  Avg time to first token: {fmt(report['avg_ttft_seconds'], '{:.3f}s')}")
+    print(f"  Avg prefill time: {fmt(report['avg_prefill_seconds'], '{:.3f}s')}")
+    print("-" * 40)
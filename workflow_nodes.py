@@ -1,6 +1,7 @@
 from typing import Dict, Any
 from models import State
-from agents import available_agents
+from agents import available_agents, agent_settings
+from relevance_router import route_chunk_to_agents, not_applicable_entry
 
 # ─── CORE WORKFLOW NODES ─────────────────────────────────────────────────────
 def main_node(state: State) -> Dict:
@@ -11,7 +12,36 @@ def main_node(state: State) -> Dict:
     print("main_node called")
     return {}
 
-def final_report_generator(state: State) -> Dict:
+def relevance_gate(state: State, agents: Dict = None, settings: Dict = None) -> Dict:
+    """
+    Decides which agents review this chunk, from each agent's relevance rule
+    (classifier scores, keywords, entities, minimum score). Agents that do not
+    apply are recorded as not_applicable instead of being run.
+    agents/settings default to the registered agents (see build_workflow_graph).
+    """
+    agents = available_agents if agents is None else agents
+    settings = agent_settings if settings is None else settings
+    metadata = state.get("metadata", {})
+    agent_rules = {agent_name: settings.get(agent_name, {}).get("relevance") for agent_name in agents}
+    decisions = route_chunk_to_agents(agent_rules, state.get("report_text", ""), metadata.get("classification_scores", {}))
+
+    skipped = {agent_name: not_applicable_entry(d["reason"]) for agent_name, d in decisions.items() if not d["run"]}
+    if skipped:
+        for agent_name, entry in skipped.items():
+            print(f"⏩ {agent_name} not applicable to this chunk ({entry['relevance']}).")
+    return {
+        "metadata": {**metadata, "agent_relevance": decisions, "agent_names": list(agents)},
+        "main_node_output": skipped,
+        "aggregate": [f"{agent_name} Not Applicable: {entry['relevance']}" for agent_name, entry in skipped.items()],
+    }
+
+def relevant_agents(state: State, agents: Dict = None) -> list:
+    """Names of the agents the relevance gate selected for this chunk."""
+    agents = available_agents if agents is None else agents
+    decisions = state.get("metadata", {}).get("agent_relevance", {})
+    return [agent_name for agent_name in agents if decisions.get(agent_name, {}).get("run", True)]
+
+def final_report_generator(state: State, agents: Dict = None) -> Dict:
     """
     Aggregates the outputs from all review agents and generates a comprehensive
     final decision report.
@@ -19,7 +49,7 @@ def final_report_generator(state: State) -> Dict:
     print("\n--- Final Report Generator Called ---")
     report_parts = {}
 
-    for agent_name in available_agents:
+    for agent_name in (available_agents if agents is None else agents):
         result = state["main_node_output"].get(agent_name, {})
         report_parts[agent_name] = result
 
@@ -31,7 +61,7 @@ def final_report_generator(state: State) -> Dict:
         output_data = result.get("output", {})
         
         # Safely get each field
-        chunk_flagged = output_data.get("chunk_flagged", "N/A")
+        chunk_flagged = result.get("analysis_status") or output_data.get("chunk_flagged", "N/A")
         observation = output_data.get("observation", "N/A")
         spans = output_data.get("spans", [])
         recommendation = output_data.get("recommendation", "N/A")